@@ -1,9 +1,15 @@
 from dash import Dash, dcc, html
-from dash.dependencies import Output, Input
+from dash.dependencies import Output, Input, State, ClientsideFunction
 import plotly.graph_objs as go
-import json
-import numpy as np
-import threading
+from ring_store import DEFAULT_DEVICE
+from live_view import LiveChart, device_options, stats_table, range_options
+from push import PushHub
+from calibration import channel_label, channel_title
+from figures import FigureTemplate, cached_figure
+from payload import register_compression
+import launch
+import metrics
+import history_api
 
 # --- GPIO Setup ---
 try:
@@ -45,6 +51,41 @@ except ImportError:
 # --- Dash application ---
 app = Dash(__name__)
 
+# Push updates to the browsers over SSE as samples arrive (see push.py);
+# False falls back to polling every second
+PUSH_UPDATES = True
+
+ALERT_STATUSES = ('normal', 'warning', 'critical')
+
+STATS_REFRESH = 5000  # ms between rolling statistics panel refreshes
+
+# Full charts as typed arrays within a byte budget, and gzipped responses
+# (see payload.py); False sends plain JSON number and date lists
+COMPACT_PAYLOADS = True
+
+
+# Gauges are sent once with the layout and then updated in the browser from
+# the live-state record (assets/live_state.js)
+def build_ph_gauge(value):
+    return go.Figure(go.Indicator(
+        mode="gauge+number",
+        value=value,
+        gauge={'axis': {'range': [7.5, 8.5]}, 'bar': {'color': 'blue'}}
+    ))
+
+
+def build_cond_gauge(value):
+    return go.Figure(go.Indicator(
+        mode="gauge+number",
+        value=value,
+        gauge={'axis': {'range': [0, 100]}, 'bar': {'color': 'goldenrod'}}
+    ))
+
+
+def popup_style_for(alert_status):
+    return {'display': 'block'} if alert_status != 'normal' else {'display': 'none'}
+
+
 app.layout = html.Div([
     html.H1(
         "The Smart Chemical Injection System",
@@ -58,6 +99,24 @@ app.layout = html.Div([
         }
     ),
 
+    # Skid selector, overlaid on the header
+    dcc.Dropdown(
+        id='skid-select',
+        options=device_options(),
+        value=DEFAULT_DEVICE,
+        clearable=False,
+        style={'position': 'absolute', 'top': '2vh', 'left': '20px', 'width': '180px'}
+    ),
+
+    # Main chart time range, overlaid on the header
+    dcc.RadioItems(
+        id='range-select',
+        options=range_options(),
+        value='live',
+        inline=True,
+        style={'position': 'absolute', 'top': '3vh', 'right': '20px', 'color': 'white'}
+    ),
+
     html.Div([
         html.Div([
             dcc.Graph(
@@ -80,6 +139,7 @@ app.layout = html.Div([
                 html.H4("Current pH", style={'color': 'blue', 'textAlign': 'center'}),
                 dcc.Graph(
                     id='pressure-gauge',
+                    figure=cached_figure('12dash-ph-gauge', build_ph_gauge, None),
                     style={'height': '100%', 'width': '100%'},
                     config={'displayModeBar': False, 'staticPlot': True}
                 )
@@ -93,9 +153,10 @@ app.layout = html.Div([
             }),
 
             html.Div([
-                html.H4("Conductivity (µS/cm)", style={'color': 'goldenrod', 'textAlign': 'center'}),
+                html.H4(channel_title('conductivity'), style={'color': 'goldenrod', 'textAlign': 'center'}),
                 dcc.Graph(
                     id='temperature-gauge',
+                    figure=cached_figure('12dash-cond-gauge', build_cond_gauge, None),
                     style={'height': '100%', 'width': '100%'},
                     config={'displayModeBar': False, 'staticPlot': True}
                 )
@@ -106,6 +167,19 @@ app.layout = html.Div([
                 'boxShadow': '0 4px 8px rgba(0,0,0,0.1)',
                 'flex': '1'
             }),
+
+            html.Div([
+                html.H4("Rolling statistics", style={'color': 'blue', 'textAlign': 'center'}),
+                html.Div(id='stats-panel')
+            ], style={
+                'backgroundColor': 'white',
+                'padding': '15px',
+                'borderRadius': '10px',
+                'boxShadow': '0 4px 8px rgba(0,0,0,0.1)',
+                'marginLeft': '10px',
+                'flex': '1',
+                'overflow': 'auto'
+            }),
         ], style={'display': 'flex', 'flex': '1', 'height': '46vh'}),
     ], style={
         'display': 'flex',
@@ -133,98 +207,132 @@ app.layout = html.Div([
         }
     ),
 
-    dcc.Interval(id='interval-component', interval=1000, n_intervals=0)
+    dcc.Store(id='stream-cursor'),
+    dcc.Store(id='live-state'),
+    dcc.Store(id='popup-styles', data={status: popup_style_for(status) for status in ALERT_STATUSES}),
+    dcc.Store(id='push-update'),
+    html.Div(id='push-status', style={'display': 'none'}),
+    dcc.Interval(id='interval-component', interval=1000, n_intervals=0, disabled=PUSH_UPDATES),
+    dcc.Interval(id='skid-refresh', interval=10000, n_intervals=0),
+    dcc.Interval(id='stats-refresh', interval=STATS_REFRESH, n_intervals=0)
 ])
 
 
-# --- Load JSON sensor data ---
-def load_data():
-    try:
-        with open('sensor_data.json') as f:
-            return json.load(f)
-    except:
-        return []
+PLOT_POINTS = 200  # points shown on the main chart
+
+# Set < 1 to weight recent samples more in the streaming pH trend
+TREND_FORGETTING = 1.0
+
+
+# Trace styles and layout are validated once (and cached across restarts);
+# each tick only fills in the arrays
+def main_template(ph_label, conductivity_label, conductivity_title):
+    return go.Figure(
+        data=[
+            go.Scatter(mode='lines', name=ph_label, line=dict(color='blue')),
+            go.Scatter(mode='lines', name=conductivity_label, yaxis='y2', line=dict(color='goldenrod')),
+            go.Scatter(mode='lines', name='Prediction', line=dict(color='red', dash='dot')),
+        ],
+        layout=go.Layout(
+            title='Sensor Data',
+            xaxis=dict(title='Time', type='date'),
+            yaxis=dict(title=ph_label, color='blue'),
+            yaxis2=dict(title=conductivity_title, overlaying='y', side='right', color='goldenrod'),
+            template='plotly_white'
+        )
+    )
+
+
+MAIN_TEMPLATE = FigureTemplate(cached_figure('12dash-main', main_template, channel_label('ph'),
+                                             channel_label('conductivity'), channel_title('conductivity')))
 
 
-def gpio_thread(status):
-    set_tower_light(status)
+# Trend, alert status, figures and history per new sample (live_view.py);
+# the prediction line covers the next 60 s
+live = LiveChart('12dash', MAIN_TEMPLATE, PLOT_POINTS, (0, 59), set_tower_light,
+                 compact=COMPACT_PAYLOADS, push=PUSH_UPDATES, trend_forgetting=TREND_FORGETTING)
 
 
 @app.callback(
     Output('pressure-temp-graph', 'figure'),
+    Output('pressure-temp-graph', 'extendData'),
+    Output('live-state', 'data'),
+    Output('stream-cursor', 'data'),
+    Input('interval-component', 'n_intervals'),
+    Input('skid-select', 'value'),
+    Input('range-select', 'value'),
+    State('stream-cursor', 'data')
+)
+def update_graph(n, device_id, range_key, cursor):
+    return live.update(device_id, range_key, cursor)
+
+
+app.clientside_callback(
+    ClientsideFunction(namespace='live', function_name='render_gauges'),
     Output('pressure-gauge', 'figure'),
     Output('temperature-gauge', 'figure'),
+    Input('live-state', 'data'),
+    State('pressure-gauge', 'figure'),
+    State('temperature-gauge', 'figure')
+)
+
+app.clientside_callback(
+    ClientsideFunction(namespace='live', function_name='render_popup'),
     Output('warning-popup', 'children'),
     Output('warning-popup', 'style'),
-    Input('interval-component', 'n_intervals')
+    Input('live-state', 'data'),
+    State('popup-styles', 'data')
 )
-def update_graph(n):
-    data = load_data()
-    if not data:
-        empty = go.Figure()
-        return empty, empty, empty, "", {'display': 'none'}
-
-    times = np.array([d['time'] for d in data])
-    ph_values = np.array([d['ph'] for d in data])
-    conductivity_values = np.array([d['conductivity'] for d in data])
-
-    # Trend prediction
-    alert_status = 'normal'
-    alert_message = ""
-
-    threshold_warning = 7.5
-    threshold_critical = 8.5
-
-    traces = [
-        go.Scatter(x=times, y=ph_values, mode='lines', name='pH', line=dict(color='blue')),
-        go.Scatter(x=times, y=conductivity_values, mode='lines', name='Conductivity', yaxis='y2', line=dict(color='goldenrod'))
-    ]
-
-    if len(times) > 10:
-        slope, intercept = np.polyfit(times, ph_values, 1)
-        future = np.arange(times[-1], times[-1] + 60)
-        pred = slope * future + intercept
-
-        traces.append(go.Scatter(x=future, y=pred, mode='lines', name='Prediction', line=dict(color='red', dash='dot')))
-
-        max_pred = max(pred)
-        if max_pred > threshold_critical:
-            alert_status = 'critical'
-            alert_message = "⚠ CRITICAL: pH predicted to exceed limit!"
-        elif max_pred > threshold_warning:
-            alert_status = 'warning'
-            alert_message = "⚠ WARNING: pH approaching limit."
-
-    layout = go.Layout(
-        title='Sensor Data',
-        xaxis=dict(title='Time'),
-        yaxis=dict(title='pH', color='blue'),
-        yaxis2=dict(title='Conductivity (µS/cm)', overlaying='y', side='right', color='goldenrod'),
-        template='plotly_white'
-    )
 
-    fig_main = go.Figure(data=traces, layout=layout)
 
-    # Gauges
-    fig_ph = go.Figure(go.Indicator(
-        mode="gauge+number",
-        value=ph_values[-1],
-        gauge={'axis': {'range': [7.5, 8.5]}, 'bar': {'color': 'blue'}}
-    ))
+# Prometheus-style metrics for scraping at /metrics
+metrics.register_flask(app.server)
 
-    fig_cond = go.Figure(go.Indicator(
-        mode="gauge+number",
-        value=conductivity_values[-1],
-        gauge={'axis': {'range': [0, 100]}, 'bar': {'color': 'goldenrod'}}
-    ))
+# Time-range queries and exports over the history at /api/history/<skid>
+history_api.register(app.server)
+
+if COMPACT_PAYLOADS:
+    register_compression(app.server)
+
+if PUSH_UPDATES:
+    push_hub = PushHub(live.push_update, PLOT_POINTS)
+    push_hub.register(app.server)
+    live.watching = push_hub.devices
 
-    # Run GPIO in background
-    threading.Thread(target=gpio_thread, args=(alert_status,), daemon=True).start()
+    app.clientside_callback(
+        ClientsideFunction(namespace='push', function_name='connect'),
+        Output('push-status', 'children'),
+        Input('skid-select', 'value')
+    )
+
+    app.clientside_callback(
+        ClientsideFunction(namespace='push', function_name='apply'),
+        Output('pressure-temp-graph', 'extendData', allow_duplicate=True),
+        Output('live-state', 'data', allow_duplicate=True),
+        Output('stream-cursor', 'data', allow_duplicate=True),
+        Input('push-update', 'data'),
+        State('stream-cursor', 'data'),
+        prevent_initial_call=True
+    )
 
-    popup_style = {'display': 'block'} if alert_status != 'normal' else {'display': 'none'}
 
-    return fig_main, fig_ph, fig_cond, alert_message, popup_style
+@app.callback(
+    Output('skid-select', 'options'),
+    Input('skid-refresh', 'n_intervals')
+)
+def refresh_skids(n):
+    return device_options()
+
+
+@app.callback(
+    Output('stats-panel', 'children'),
+    Input('stats-refresh', 'n_intervals'),
+    Input('skid-select', 'value')
+)
+def refresh_stats(n, device_id):
+    # Rolling aggregates are maintained by the collector; this only reads them
+    return stats_table(device_id)
 
 
 if __name__ == '__main__':
-    app.run(debug=False, host='0.0.0.0', port=8050)
+    launch.run(app, port=8050, warm=live.warm_up)
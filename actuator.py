@@ -0,0 +1,128 @@
+import queue
+import threading
+import time
+import metrics
+
+TRANSITIONS = metrics.counter('gpio_transitions_total', 'Tower light pin writes', ['status'])
+ACTUATION_SECONDS = metrics.histogram('gpio_actuation_latency_seconds', 'Status request to pin write')
+ERRORS = metrics.counter('gpio_errors_total', 'Failed tower light pin writes')
+
+# A failed pin write is retried after RETRY_SECONDS, doubling up to
+# MAX_RETRY_SECONDS while it keeps failing
+RETRY_SECONDS = 1.0
+MAX_RETRY_SECONDS = 30.0
+
+# Severity order used to decide which changes are escalations
+SEVERITY = {'off': -1, 'normal': 0, 'warning': 1, 'critical': 2}
+
+
+def worst_status(statuses):
+    return max(statuses, key=lambda status: SEVERITY.get(status, -1), default='normal')
+
+
+class TowerLightActuator:
+    # Single long-lived worker that owns the tower light pins.
+    #
+    # Callers post the status they want with request(); the worker applies it
+    # in order and only writes the pins on a real transition. Escalations
+    # (e.g. warning -> critical) are applied at once; de-escalations must hold
+    # for `debounce` seconds so a value hovering at a limit does not flap the
+    # relays. A failed write is retried with backoff until it succeeds or
+    # another status is requested.
+
+    def __init__(self, set_tower_light, debounce=2.0):
+        self.set_tower_light = set_tower_light
+        self.debounce = debounce
+
+        self.current = None        # status last written to the pins
+        self.transitions = 0
+        self.errors = 0
+        self.last_latency = None   # seconds from request to pin write
+        self.max_latency = 0.0
+        self._latency_total = 0.0
+        self._failures = 0         # consecutive failed writes
+
+        self._queue = queue.Queue()
+        self._requested = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='tower-light', daemon=True)
+                self._thread.start()
+
+    def request(self, status):
+        # Cheap enough to call from every callback tick; repeats are dropped
+        if self._thread is None:
+            self.start()
+        with self._lock:
+            if status == self._requested:
+                return
+            self._requested = status
+        self._queue.put((status, time.monotonic()))
+
+    def stop(self):
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self):
+        mean = self._latency_total / self.transitions if self.transitions else None
+        return {
+            'status': self.current,
+            'transitions': self.transitions,
+            'errors': self.errors,
+            'last_latency': self.last_latency,
+            'mean_latency': mean,
+            'max_latency': self.max_latency,
+        }
+
+    def _run(self):
+        # (status, requested_at, due): a de-escalation waiting out the
+        # debounce, or a failed write waiting for its retry
+        pending = None
+        while True:
+            timeout = None
+            if pending is not None:
+                timeout = max(0.0, pending[2] - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                status, requested_at, _ = pending
+                pending = self._apply(status, requested_at)
+                continue
+
+            if item is None:
+                return
+
+            status, requested_at = item
+            if status == self.current:
+                pending = None
+            elif self.current is None or SEVERITY.get(status, -1) > SEVERITY.get(self.current, -1):
+                pending = self._apply(status, requested_at)
+            elif pending is None or pending[0] != status:
+                pending = (status, requested_at, requested_at + self.debounce)
+
+    def _apply(self, status, requested_at):
+        # Writes the pins; returns the retry to schedule if that failed
+        try:
+            self.set_tower_light(status)
+        except Exception as e:
+            self.errors += 1
+            self._failures += 1
+            ERRORS.inc()
+            delay = min(RETRY_SECONDS * 2 ** (self._failures - 1), MAX_RETRY_SECONDS)
+            print(f"Error setting tower light to {status}, retrying in {delay:g} s: {e}")
+            return status, requested_at, time.monotonic() + delay
+        self._failures = 0
+        latency = time.monotonic() - requested_at
+        TRANSITIONS.labels(status).inc()
+        ACTUATION_SECONDS.observe(latency)
+        self.current = status
+        self.transitions += 1
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self._latency_total += latency
+        return None
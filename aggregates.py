@@ -0,0 +1,297 @@
+import os
+import time
+from collections import deque
+import numpy as np
+from ring_store import RECORD_DTYPE, SNAPSHOT_RETRIES, TornRead, store_path
+import metrics
+
+# Rolling min/max/mean/stddev per channel over several time windows,
+# maintained by the collector as samples arrive (a SerialReader sink) and
+# published to a small shared file the dashboards read:
+#
+#   <STORE_DIR>/<device>.agg   header + one AGGREGATE_DTYPE row per window
+#
+# Each window is kept as BUCKETS sub-aggregates (count, mean, M2, min,
+# max per channel) of window / BUCKETS seconds each, so memory depends on
+# the number of windows, not on the sample rate or the window length. A
+# window covers its last BUCKETS buckets, the newest one still filling;
+# its edge moves a bucket at a time (1/BUCKETS of the window). Each sample
+# costs O(1) per window and channel: it goes into the open bucket, and a
+# closing bucket is merged into the window's running totals (Chan's
+# parallel update) while the bucket leaving the window is taken out with
+# the inverse. Min and max come from monotonic deques of bucket extremes.
+# Totals are recomputed from the buckets once per window's worth of
+# evictions, so rounding cannot build up.
+
+WINDOWS = (60, 900, 3600, 86400)  # seconds
+BUCKETS = 600                      # sub-aggregates per window
+
+CHANNELS = tuple(name for name in RECORD_DTYPE.names if name != 'time')
+
+AGG_MAGIC = b'CISAGG01'
+
+AGG_HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('windows', '<u8'),
+    ('generation', '<u8'),  # odd while rows are being written (seqlock)
+    ('time', '<f8'),        # newest sample time covered
+])
+
+AGGREGATE_DTYPE = np.dtype([('window', '<f8'), ('count', '<u8')] + [
+    (f'{channel}_{stat}', '<f8') for channel in CHANNELS for stat in ('min', 'max', 'mean', 'std')])
+
+UPDATE_SECONDS = metrics.histogram('aggregate_update_seconds', 'Rolling aggregate update time per batch')
+
+
+def aggregate_path(device_id):
+    return store_path(device_id)[:-len('.ring')] + '.agg'
+
+
+def window_label(seconds):
+    if seconds % 3600 == 0:
+        return f'{seconds // 3600} h'
+    if seconds % 60 == 0:
+        return f'{seconds // 60} min'
+    return f'{seconds} s'
+
+
+def _merge(n, mean, m2, n_b, mean_b, m2_b):
+    # (count, mean, M2) of two sets combined
+    total = n + n_b
+    if total == 0:
+        return 0, 0.0, 0.0
+    delta = mean_b - mean
+    return total, mean + delta * n_b / total, m2 + m2_b + delta * delta * n * n_b / total
+
+
+def _unmerge(n, mean, m2, n_b, mean_b, m2_b):
+    # (count, mean, M2) with the set (n_b, mean_b, m2_b) taken out again
+    rest = n - n_b
+    if rest <= 0:
+        return 0, 0.0, 0.0
+    mean_a = (n * mean - n_b * mean_b) / rest
+    delta = mean_b - mean_a
+    return rest, mean_a, m2 - m2_b - delta * delta * rest * n_b / n
+
+
+class _Bucket:
+    # Sub-aggregate of the samples in one bucket, per channel
+    __slots__ = ('index', 'count', 'means', 'm2s', 'mins', 'maxs')
+
+    def __init__(self, index, channels):
+        self.index = index
+        self.count = 0
+        self.means = [0.0] * channels
+        self.m2s = [0.0] * channels
+        self.mins = [float('inf')] * channels
+        self.maxs = [float('-inf')] * channels
+
+    def add(self, values):
+        self.count += 1
+        n = self.count
+        means, m2s, mins, maxs = self.means, self.m2s, self.mins, self.maxs
+        for c, x in enumerate(values):
+            delta = x - means[c]
+            means[c] += delta / n
+            m2s[c] += delta * (x - means[c])
+            if x < mins[c]:
+                mins[c] = x
+            if x > maxs[c]:
+                maxs[c] = x
+
+
+class _Window:
+    __slots__ = ('seconds', 'width', 'closed', 'open', 'count', 'means', 'm2s', 'mins', 'maxs', 'evictions')
+
+    def __init__(self, seconds, channels, buckets):
+        self.seconds = seconds
+        self.width = seconds / buckets
+        self.closed = deque()   # closed buckets still inside the window, oldest first
+        self.open = None        # bucket being filled
+        self.count = 0          # totals over the closed buckets
+        self.means = [0.0] * channels
+        self.m2s = [0.0] * channels
+        self.mins = [deque() for _ in range(channels)]  # (index, min), values increasing
+        self.maxs = [deque() for _ in range(channels)]  # (index, max), values decreasing
+        self.evictions = 0
+
+
+class RollingAggregates:
+    def __init__(self, windows=WINDOWS, channels=CHANNELS, buckets=None):
+        self.channels = channels
+        self.buckets = buckets or BUCKETS
+        self.windows = [_Window(seconds, len(channels), self.buckets) for seconds in sorted(windows)]
+        self.time = None
+
+    def add(self, t, values):
+        self.time = t
+        for window in self.windows:
+            index = int(t // window.width)
+            bucket = window.open
+            if bucket is None or index != bucket.index:
+                if bucket is not None:
+                    self._close(window, bucket)
+                self._evict(window, index - self.buckets)
+                bucket = window.open = _Bucket(index, len(self.channels))
+            bucket.add(values)
+
+    def advance(self, now):
+        # Ages the windows to `now` while no samples arrive: buckets that
+        # have left a window are taken out, as a sample at `now` would
+        for window in self.windows:
+            index = int(now // window.width)
+            bucket = window.open
+            if bucket is not None and index > bucket.index:
+                self._close(window, bucket)
+                window.open = None
+            self._evict(window, index - self.buckets)
+
+    def extend(self, times, ph_values, conductivity_values):
+        # SerialReader sink
+        started = time.perf_counter()
+        columns = {'ph': ph_values, 'conductivity': conductivity_values}
+        rows = zip(*(np.asarray(columns[channel], dtype=np.float64).tolist() for channel in self.channels))
+        for t, values in zip(np.asarray(times, dtype=np.float64).tolist(), rows):
+            self.add(t, values)
+        UPDATE_SECONDS.observe(time.perf_counter() - started)
+
+    def _close(self, window, bucket):
+        # Adds a full bucket to the window totals
+        window.closed.append(bucket)
+        n = window.count
+        for c in range(len(self.channels)):
+            _, window.means[c], window.m2s[c] = _merge(n, window.means[c], window.m2s[c],
+                                                       bucket.count, bucket.means[c], bucket.m2s[c])
+            mins, maxs = window.mins[c], window.maxs[c]
+            while mins and mins[-1][1] >= bucket.mins[c]:
+                mins.pop()
+            mins.append((bucket.index, bucket.mins[c]))
+            while maxs and maxs[-1][1] <= bucket.maxs[c]:
+                maxs.pop()
+            maxs.append((bucket.index, bucket.maxs[c]))
+        window.count = n + bucket.count
+
+    def _evict(self, window, oldest):
+        # Takes the buckets at or before index `oldest` out of the window
+        closed = window.closed
+        while closed and closed[0].index <= oldest:
+            bucket = closed.popleft()
+            n = window.count
+            for c in range(len(self.channels)):
+                _, window.means[c], window.m2s[c] = _unmerge(n, window.means[c], window.m2s[c],
+                                                             bucket.count, bucket.means[c], bucket.m2s[c])
+            window.count = n - bucket.count
+            window.evictions += 1
+        for extremes in window.mins + window.maxs:
+            while extremes and extremes[0][0] <= oldest:
+                extremes.popleft()
+        if window.evictions >= self.buckets:
+            self._recompute(window)
+
+    def _recompute(self, window):
+        # Exact totals from the closed buckets
+        n, means, m2s = 0, [0.0] * len(self.channels), [0.0] * len(self.channels)
+        for bucket in window.closed:
+            for c in range(len(self.channels)):
+                _, means[c], m2s[c] = _merge(n, means[c], m2s[c], bucket.count, bucket.means[c], bucket.m2s[c])
+            n += bucket.count
+        window.count, window.means, window.m2s = n, means, m2s
+        window.evictions = 0
+
+    def rows(self):
+        # One AGGREGATE_DTYPE row per window, shortest first
+        rows = np.zeros(len(self.windows), dtype=AGGREGATE_DTYPE)
+        for row, window in zip(rows, self.windows):
+            bucket = window.open
+            open_count = bucket.count if bucket is not None else 0
+            count = window.count + open_count
+            row['window'] = window.seconds
+            row['count'] = count
+            if not count:
+                continue
+            for c, channel in enumerate(self.channels):
+                n, mean, m2 = window.count, window.means[c], window.m2s[c]
+                lo = window.mins[c][0][1] if window.mins[c] else float('inf')
+                hi = window.maxs[c][0][1] if window.maxs[c] else float('-inf')
+                if open_count:
+                    n, mean, m2 = _merge(n, mean, m2, open_count, bucket.means[c], bucket.m2s[c])
+                    lo, hi = min(lo, bucket.mins[c]), max(hi, bucket.maxs[c])
+                row[f'{channel}_min'] = lo
+                row[f'{channel}_max'] = hi
+                row[f'{channel}_mean'] = mean
+                row[f'{channel}_std'] = (max(m2, 0.0) / (n - 1)) ** 0.5 if n > 1 else 0.0
+        return rows
+
+
+class AggregateStore:
+    # Shared file of the latest aggregate rows, published with a seqlock
+    # like the ring store
+
+    def __init__(self, path, windows=len(WINDOWS), readonly=False):
+        self.path = path
+        size = AGG_HEADER_DTYPE.itemsize + windows * AGGREGATE_DTYPE.itemsize
+        if readonly:
+            self._map = np.memmap(path, dtype=np.uint8, mode='r')
+        elif os.path.exists(path) and os.path.getsize(path) == size:
+            self._map = np.memmap(path, dtype=np.uint8, mode='r+')
+        else:
+            self._map = np.memmap(path, dtype=np.uint8, mode='w+', shape=(size,))
+        self._header = self._map[:AGG_HEADER_DTYPE.itemsize].view(AGG_HEADER_DTYPE)
+        if not readonly:
+            self._header['magic'] = AGG_MAGIC
+            self._header['windows'] = windows
+            if self._header['generation'][0] % 2:
+                self._header['generation'] += 1
+        if self._header['magic'][0] != AGG_MAGIC:
+            raise ValueError(f"{path} is not an aggregate file")
+        n = int(self._header['windows'][0])
+        self._rows = self._map[AGG_HEADER_DTYPE.itemsize:].view(AGGREGATE_DTYPE)[:n]
+        self._file = open(path, 'rb')  # see RingStore.replaced
+
+    def replaced(self):
+        # True once the file was deleted (see RingStore.replaced)
+        return os.fstat(self._file.fileno()).st_nlink == 0
+
+    def publish(self, rows, newest):
+        generation = int(self._header['generation'][0]) + 1
+        self._header['generation'] = generation
+        self._rows[:] = rows
+        self._header['time'] = newest
+        self._header['generation'] = generation + 1
+
+    def read(self):
+        # (rows copy, newest sample time); raises TornRead if the writer stays busy
+        for _ in range(SNAPSHOT_RETRIES):
+            generation = int(self._header['generation'][0])
+            if generation % 2 == 0:
+                rows, newest = self._rows.copy(), float(self._header['time'][0])
+                if int(self._header['generation'][0]) == generation:
+                    return rows, newest
+            time.sleep(0)
+        raise TornRead(f"{self.path}: no consistent read after {SNAPSHOT_RETRIES} attempts")
+
+
+def open_aggregates(device_id, windows=WINDOWS, readonly=False):
+    path = aggregate_path(device_id)
+    if not readonly:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    return AggregateStore(path, len(windows), readonly=readonly)
+
+
+class AggregateSink(RollingAggregates):
+    # RollingAggregates that publishes after every batch
+    def __init__(self, device_id, windows=WINDOWS):
+        super().__init__(windows)
+        self.store = open_aggregates(device_id, windows)
+
+    def extend(self, times, ph_values, conductivity_values):
+        if len(times) == 0:
+            return
+        super().extend(times, ph_values, conductivity_values)
+        self.store.publish(self.rows(), self.time)
+
+    def advance(self, now):
+        if self.time is None:
+            return
+        super().advance(now)
+        self.store.publish(self.rows(), self.time)
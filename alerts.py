@@ -0,0 +1,289 @@
+import json
+import os
+import time
+import numpy as np
+from trend import TrendEstimator
+from calibration import channel_label
+import metrics
+
+# Alert rules evaluated once per sample in the ingestion path (a sink of the
+# SerialReader, next to the history), instead of once per dashboard tick.
+# The worst level and the rule behind it are published in the ring store
+# header, where every dashboard process reads them.
+#
+# Rules come from alerts.json (a list, same directory as skids.json); each
+# has a type, a channel ('ph' or 'conductivity'), warning and critical
+# levels and an optional hysteresis in the same units:
+#
+#   band      the value itself; "side": "below" for a low limit
+#   rate      |change| per second over "window" seconds
+#   ewma      |value - exponential average| with smoothing "alpha"
+#   cusum     two-sided CUSUM drift from "target" with slack "slack"
+#   forecast  linear trend over "window" samples, "horizon" seconds ahead
+#
+# e.g. {"type": "band", "channel": "ph", "side": "below", "warning": 7.0,
+#       "critical": 6.5, "hysteresis": 0.05}
+#
+# A level is raised when the score passes it and cleared only once the score
+# is back by more than the hysteresis. An optional "message" replaces the
+# generated popup text.
+
+ALERTS_FILE = 'alerts.json'
+
+STATUSES = ('normal', 'warning', 'critical')
+
+# Without alerts.json: the dashboards' former forecast limits plus a low band
+DEFAULT_RULES = [
+    {'type': 'forecast', 'channel': 'ph', 'warning': 7.5, 'critical': 8.5,
+     'window': 60, 'horizon': 60, 'hysteresis': 0.02},
+    {'type': 'band', 'channel': 'ph', 'side': 'below', 'warning': 7.0, 'critical': 6.5,
+     'hysteresis': 0.05},
+]
+
+EVAL_SECONDS = metrics.histogram('alert_eval_seconds', 'Alert rule evaluation time per batch')
+TRANSITIONS = metrics.counter('alert_transitions_total', 'Alert level changes', ['device', 'status'])
+
+
+def load_rules(path=ALERTS_FILE):
+    if not os.path.exists(path):
+        return [dict(rule) for rule in DEFAULT_RULES]
+    with open(path) as f:
+        return json.load(f)
+
+
+def _latch(score, threshold, hysteresis, state):
+    # Per-sample on/off with hysteresis: on from a sample above `threshold`
+    # until one at or below `threshold - hysteresis`; `state` before the batch
+    event = np.full(len(score), -1, dtype=np.int8)
+    event[score <= threshold - hysteresis] = 0
+    event[score > threshold] = 1
+    last = np.where(event >= 0, np.arange(len(score)), -1)
+    np.maximum.accumulate(last, out=last)
+    return np.where(last >= 0, event[last] == 1, state)
+
+
+def _ewma(values, alpha, start):
+    # Exponential average after each sample, starting from `start`. Closed
+    # form per chunk; chunks keep (1 - alpha) ** -k within float range.
+    if alpha >= 1.0:
+        return values.astype(np.float64)
+    decay = 1.0 - alpha
+    chunk = max(1, int(27.0 / -np.log(decay)))
+    out = np.empty(len(values))
+    for lo in range(0, len(values), chunk):
+        x = values[lo:lo + chunk]
+        powers = decay ** np.arange(1, len(x) + 1)
+        out[lo:lo + len(x)] = powers * (start + alpha * np.cumsum(x / powers))
+        start = out[lo + len(x) - 1]
+    return out
+
+
+def _cusum(increments, start):
+    # S_i = max(0, S_{i-1} + d_i), solved with a running minimum
+    total = np.cumsum(increments)
+    return total - np.minimum(np.minimum.accumulate(total), -start)
+
+
+class Rule:
+    kind = None
+
+    def __init__(self, cfg):
+        self.channel = cfg.get('channel', 'ph')
+        self.side = cfg.get('side', 'above')
+        self.warning = float(cfg['warning'])
+        self.critical = float(cfg['critical'])
+        self.hysteresis = float(cfg.get('hysteresis', 0.0))
+        self.message = cfg.get('message')
+        self.label = channel_label(self.channel)
+        self._on = [False, False]  # warning, critical
+
+    def describe(self, threshold):
+        return f"{self.label} {self.kind} past {threshold:g}"
+
+    def score(self, times, values):
+        raise NotImplementedError
+
+    def levels(self, times, values):
+        score = self.score(times, values)
+        sign = -1.0 if self.side == 'below' else 1.0
+        levels = np.zeros(len(times), dtype=np.uint8)
+        for i, threshold in enumerate((self.warning, self.critical)):
+            on = _latch(sign * score, sign * threshold, self.hysteresis, self._on[i])
+            self._on[i] = bool(on[-1])
+            levels[on] = i + 1
+        return levels
+
+
+class BandRule(Rule):
+    kind = 'band'
+
+    def describe(self, threshold):
+        return f"{self.label} {self.side} {threshold:g}"
+
+    def score(self, times, values):
+        return values
+
+
+class RateRule(Rule):
+    kind = 'rate'
+
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        self.window = float(cfg.get('window', 10))
+        self._times = np.empty(0)
+        self._values = np.empty(0)
+
+    def describe(self, threshold):
+        return f"{self.label} changing faster than {threshold:g}/s"
+
+    def score(self, times, values):
+        t = np.concatenate((self._times, times))
+        v = np.concatenate((self._values, values))
+        # Compare with the last sample at least `window` seconds older
+        # (the oldest one while the window is filling)
+        j = np.maximum(np.searchsorted(t, times - self.window, side='right') - 1, 0)
+        dt = times - t[j]
+        rate = np.divide(np.abs(values - v[j]), dt, out=np.zeros(len(times)), where=dt > 0)
+        keep = max(int(np.searchsorted(t, times[-1] - self.window, side='right')) - 1, 0)
+        self._times, self._values = t[keep:], v[keep:]
+        return rate
+
+
+class EwmaRule(Rule):
+    kind = 'ewma'
+
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        self.alpha = float(cfg.get('alpha', 0.1))
+        self._average = None
+
+    def describe(self, threshold):
+        return f"{self.label} more than {threshold:g} from its average"
+
+    def score(self, times, values):
+        if self._average is None:
+            self._average = float(values[0])
+        average = _ewma(values, self.alpha, self._average)
+        # Deviation from the average before the sample was seen
+        before = np.concatenate(([self._average], average[:-1]))
+        self._average = float(average[-1])
+        return np.abs(values - before)
+
+
+class CusumRule(Rule):
+    kind = 'cusum'
+
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        self.target = float(cfg['target'])
+        self.slack = float(cfg.get('slack', 0.0))
+        self._high = self._low = 0.0
+
+    def describe(self, threshold):
+        return f"{self.label} drifting from {self.target:g} (CUSUM past {threshold:g})"
+
+    def score(self, times, values):
+        high = _cusum(values - self.target - self.slack, self._high)
+        low = _cusum(self.target - values - self.slack, self._low)
+        self._high, self._low = float(high[-1]), float(low[-1])
+        return np.maximum(high, low)
+
+
+class ForecastRule(Rule):
+    kind = 'forecast'
+
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        self.horizon = float(cfg.get('horizon', 60))
+        self.estimator = TrendEstimator(window=int(cfg.get('window', 60)))
+
+    def describe(self, threshold):
+        return f"{self.label} predicted {self.side} {threshold:g} within {self.horizon:g} s"
+
+    def score(self, times, values):
+        # The forecast as of each sample, so a batch scores like the same
+        # samples one at a time (the fit itself is O(1) per sample)
+        estimator = self.estimator
+        pick = min if self.side == 'below' else max
+        score = np.full(len(times), np.nan)
+        for i, (t, y) in enumerate(zip(times.tolist(), values.tolist())):
+            estimator.add(t, y)
+            fit = estimator.fit() if estimator.count > 10 else None
+            if fit is not None:
+                slope, intercept = fit
+                score[i] = pick(slope * t + intercept, slope * (t + self.horizon) + intercept)
+        return score
+
+
+RULE_TYPES = {rule.kind: rule for rule in (BandRule, RateRule, EwmaRule, CusumRule, ForecastRule)}
+
+
+class AlertEngine:
+    # Evaluates the rules over each ingested batch. Works as a SerialReader
+    # sink; with a store it publishes the latest level there. With a `log`
+    # list, every per-sample change is appended to it as (time, level, rule),
+    # including changes inside a batch (replays, backtests).
+
+    def __init__(self, rules=None, store=None, device_id='', log=None):
+        if rules is None:
+            rules = load_rules()
+        for cfg in rules:
+            if cfg.get('type') not in RULE_TYPES:
+                raise ValueError(f"unknown alert rule type {cfg.get('type')!r}")
+        self.rules = [RULE_TYPES[cfg['type']](cfg) for cfg in rules]
+        self.store = store
+        self.device_id = device_id
+        self.log = log
+        self.level = 0
+        self.rule = -1
+
+    def evaluate(self, times, columns):
+        # Per sample: worst level and the index of the first rule at it (-1)
+        levels = np.zeros((max(len(self.rules), 1), len(times)), dtype=np.uint8)
+        for i, rule in enumerate(self.rules):
+            levels[i] = rule.levels(times, np.asarray(columns[rule.channel], dtype=np.float64))
+        worst = levels.max(axis=0)
+        return worst, np.where(worst > 0, levels.argmax(axis=0), -1)
+
+    def extend(self, times, ph_values, conductivity_values):
+        if len(times) == 0:
+            return
+        started = time.perf_counter()
+        times = np.asarray(times, dtype=np.float64)
+        levels, rules = self.evaluate(times, {'ph': ph_values, 'conductivity': conductivity_values})
+        if self.log is not None:
+            self._log_changes(times, levels, rules)
+        level, rule = int(levels[-1]), int(rules[-1])
+        EVAL_SECONDS.observe(time.perf_counter() - started)
+        if (level, rule) != (self.level, self.rule):
+            if level != self.level:
+                TRANSITIONS.labels(self.device_id, STATUSES[level]).inc()
+            self.level, self.rule = level, rule
+            if self.store is not None:
+                self.store.set_alert(level, rule)
+
+    def _log_changes(self, times, levels, rules):
+        changed = np.empty(len(times), dtype=bool)
+        changed[0] = (levels[0], rules[0]) != (self.level, self.rule)
+        changed[1:] = (levels[1:] != levels[:-1]) | (rules[1:] != rules[:-1])
+        for i in np.flatnonzero(changed):
+            self.log.append((float(times[i]), int(levels[i]), int(rules[i])))
+
+    def message(self, level, rule):
+        # Popup text for a published (level, rule)
+        if level <= 0 or not 0 <= rule < len(self.rules):
+            return ""
+        r = self.rules[rule]
+        if r.message:
+            return r.message
+        if level == 2:
+            return f"⚠ CRITICAL: {r.describe(r.critical)}"
+        return f"⚠ WARNING: {r.describe(r.warning)}"
+
+    def limit(self, channel='ph', level='critical'):
+        # Upper limit of the first band or forecast rule on `channel`, for
+        # time-to-limit estimates
+        for rule in self.rules:
+            if rule.kind in ('band', 'forecast') and rule.channel == channel and rule.side == 'above':
+                return getattr(rule, level)
+        return None
@@ -0,0 +1,315 @@
+import os
+import struct
+import sys
+import zlib
+import numpy as np
+from ring_store import RECORD_DTYPE
+
+# Compressed, append-only sample archive (the raw level of history.py).
+#
+# Samples are buffered in memory and written as one compressed chunk every
+# CHUNK_SECONDS, so the SD card sees one small append per chunk instead of
+# one per sample. Inside a chunk:
+#
+#   time          milliseconds, delta-of-delta (0 for a steady sample rate)
+#   ph, ...       quantized to QUANTUM and delta coded; a quantum of 0 keeps
+#                 the float32 bits, XOR'ed with the previous value
+#
+# Each column is stored in the narrowest integer type that holds it, and
+# the chunk is deflated. A fixed-size index entry per chunk (time range,
+# offset, length, count) lets range reads decompress only the chunks they
+# overlap.
+#
+#   <dir>/samples.dat  chunks, back to back
+#   <dir>/samples.idx  INDEX_DTYPE per chunk, written after its chunk
+#
+# Samples still buffered are lost on power failure (at most CHUNK_SECONDS);
+# history.raw_records() fills the gap from the ring store while running.
+
+DATA_FILE = 'samples.dat'
+INDEX_FILE = 'samples.idx'
+
+CHUNK_SECONDS = 300
+MAX_CHUNK_SAMPLES = 65536
+INITIAL_BUFFER = 1024  # samples; the chunk buffer doubles when a chunk needs more
+COMPRESSION_LEVEL = 6
+
+# Resolution kept per channel (the probe reports pH to 0.001)
+QUANTUM = {'ph': 0.001, 'conductivity': 0.001}
+
+INDEX_DTYPE = np.dtype([
+    ('start', '<f8'),
+    ('end', '<f8'),
+    ('offset', '<u8'),
+    ('length', '<u4'),
+    ('count', '<u4'),
+])
+
+CHANNELS = tuple(name for name in RECORD_DTYPE.names if name != 'time')
+
+# Chunk header: first time (ms), count, then the quantum of each channel
+_HEADER = struct.Struct('<qI' + 'd' * len(CHANNELS))
+_INT_TYPES = [np.dtype(t) for t in ('<i1', '<i2', '<i4', '<i8', '<u4')]
+
+
+def _narrow(values):
+    # Smallest signed type for int64 `values`, as (code, array)
+    lo, hi = (int(values.min()), int(values.max())) if len(values) else (0, 0)
+    for code, dtype in enumerate(_INT_TYPES[:4]):
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return code, values.astype(dtype)
+
+
+def encode_chunk(records, quantum=QUANTUM):
+    ms = np.round(records['time'] * 1000.0).astype(np.int64)
+    delta = np.diff(ms, prepend=ms[0])
+    columns = [_narrow(np.diff(delta, prepend=0))]
+    quanta = []
+    for channel in CHANNELS:
+        q = float(quantum.get(channel, 0.0))
+        quanta.append(q)
+        values = records[channel]
+        if q > 0:
+            steps = np.round(values.astype(np.float64) / q).astype(np.int64)
+            columns.append(_narrow(np.diff(steps, prepend=0)))
+        else:
+            bits = values.astype('<f4').view('<u4')
+            columns.append((4, bits ^ np.concatenate(([0], bits[:-1])).astype('<u4')))
+    header = _HEADER.pack(int(ms[0]), len(records), *quanta)
+    codes = bytes(code for code, _ in columns)
+    body = b''.join(array.tobytes() for _, array in columns)
+    return zlib.compress(header + codes + body, COMPRESSION_LEVEL)
+
+
+def decode_chunk(blob):
+    data = zlib.decompress(blob)
+    first, count, *quanta = _HEADER.unpack_from(data)
+    pos = _HEADER.size
+    codes = data[pos:pos + 1 + len(CHANNELS)]
+    pos += len(codes)
+
+    columns = []
+    for code in codes:
+        dtype = _INT_TYPES[code]
+        columns.append(np.frombuffer(data, dtype=dtype, count=count, offset=pos))
+        pos += count * dtype.itemsize
+
+    records = np.empty(count, dtype=RECORD_DTYPE)
+    delta = np.cumsum(columns[0], dtype=np.int64)
+    records['time'] = (first + np.cumsum(delta)) / 1000.0
+    for channel, q, column in zip(CHANNELS, quanta, columns[1:]):
+        if q > 0:
+            records[channel] = np.cumsum(column, dtype=np.int64) * q
+        else:
+            records[channel] = np.bitwise_xor.accumulate(column).view('<f4')
+    return records
+
+
+def _read_index(directory):
+    path = os.path.join(directory, INDEX_FILE)
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return np.empty(0, dtype=INDEX_DTYPE)
+    n = size // INDEX_DTYPE.itemsize
+    if n == 0:
+        return np.empty(0, dtype=INDEX_DTYPE)
+    return np.memmap(path, dtype=INDEX_DTYPE, mode='r', shape=(n,))
+
+
+class ArchiveWriter:
+    # Buffers samples and appends them as compressed chunks. Used by
+    # history.HistoryWriter for the raw samples. The chunk buffer is reused,
+    # so buffering allocates nothing per sample once it has grown to a
+    # chunk's size.
+
+    def __init__(self, directory, chunk_seconds=CHUNK_SECONDS, quantum=QUANTUM):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.chunk_seconds = chunk_seconds
+        self.quantum = quantum
+        self._recover()
+        self._data = open(os.path.join(directory, DATA_FILE), 'ab')
+        self._index = open(os.path.join(directory, INDEX_FILE), 'ab')
+        self._buffer = np.empty(INITIAL_BUFFER, dtype=RECORD_DTYPE)
+        self._count = 0
+        self.bytes_written = 0
+
+    def _recover(self):
+        # Drop what a crash left behind: a partial index entry, entries whose
+        # chunk never reached the disk, and chunk bytes without an entry
+        data_path = os.path.join(self.directory, DATA_FILE)
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        data_size = os.path.getsize(data_path) if os.path.exists(data_path) else 0
+        index = np.array(_read_index(self.directory))
+        valid = index[index['offset'] + index['length'] <= data_size]
+        if os.path.exists(index_path) and os.path.getsize(index_path) != valid.nbytes:
+            with open(index_path, 'r+b') as f:
+                f.truncate(valid.nbytes)
+        end = int(valid['offset'][-1] + valid['length'][-1]) if len(valid) else 0
+        if data_size != end:
+            with open(data_path, 'r+b') as f:
+                f.truncate(end)
+
+    def append(self, batch):
+        # `batch` is a time-ordered RECORD_DTYPE array
+        return self.append_columns(batch['time'], batch['ph'], batch['conductivity'])
+
+    def append_columns(self, times, ph_values, conductivity_values):
+        # Time-ordered columns; returns the buffered records as a view, valid
+        # until the next append
+        n = len(times)
+        start = self._count
+        if start + n > len(self._buffer):
+            grown = np.empty(max(2 * len(self._buffer), start + n), dtype=RECORD_DTYPE)
+            grown[:start] = self._buffer[:start]
+            self._buffer = grown
+        added = self._buffer[start:start + n]
+        added['time'] = times
+        added['ph'] = ph_values
+        added['conductivity'] = conductivity_values
+        self._count = start + n
+        if n and (added['time'][-1] - self._buffer['time'][0] >= self.chunk_seconds
+                  or self._count >= MAX_CHUNK_SAMPLES):
+            self.flush()
+        return added
+
+    def flush(self):
+        # Writes the buffered samples as chunks now (also called on close)
+        if not self._count:
+            return
+        records = self._buffer[:self._count]
+        for lo in range(0, len(records), MAX_CHUNK_SAMPLES):
+            self._write_chunk(records[lo:lo + MAX_CHUNK_SAMPLES])
+        self._count = 0
+        self._index.flush()
+
+    def _write_chunk(self, records):
+        blob = encode_chunk(records, self.quantum)
+        offset = self._data.tell()
+        self._data.write(blob)
+        entry = np.array([(records['time'][0], records['time'][-1], offset, len(blob), len(records))],
+                         dtype=INDEX_DTYPE)
+        # The entry goes out only after its chunk, so readers never see one
+        # pointing past the data
+        self._data.flush()
+        self._index.write(entry.tobytes())
+        self.bytes_written += len(blob) + INDEX_DTYPE.itemsize
+
+    def close(self):
+        self.flush()
+        self._data.close()
+        self._index.close()
+
+
+def _overlapping(index, start, end):
+    # Index rows whose chunk may hold samples in [start, end]; chunks are in
+    # time order, so both ends are binary searches
+    lo = np.searchsorted(index['end'], start, side='left')
+    hi = np.searchsorted(index['start'], end, side='right')
+    return index[lo:max(lo, hi)]
+
+
+def iter_range(directory, start=-np.inf, end=np.inf):
+    # Samples in [start, end], one decompressed chunk at a time; only the
+    # chunks that overlap the range are read
+    chunks = _overlapping(_read_index(directory), start, end)
+    if len(chunks) == 0:
+        return
+    with open(os.path.join(directory, DATA_FILE), 'rb') as f:
+        for entry in chunks:
+            f.seek(int(entry['offset']))
+            records = decode_chunk(f.read(int(entry['length'])))
+            if entry['start'] < start or entry['end'] > end:
+                times = records['time']
+                records = records[np.searchsorted(times, start, side='left'):
+                                  np.searchsorted(times, end, side='right')]
+            if len(records):
+                yield records
+
+
+def read_range(directory, start=-np.inf, end=np.inf):
+    parts = list(iter_range(directory, start, end))
+    return np.concatenate(parts) if parts else np.empty(0, dtype=RECORD_DTYPE)
+
+
+def read_last(directory, n):
+    # The newest n archived samples; only the chunks holding them are read
+    index = _read_index(directory)
+    if n <= 0 or len(index) == 0:
+        return np.empty(0, dtype=RECORD_DTYPE)
+    counts = np.cumsum(index['count'][::-1], dtype=np.int64)
+    chunks = min(int(np.searchsorted(counts, n)) + 1, len(index))
+    parts = []
+    with open(os.path.join(directory, DATA_FILE), 'rb') as f:
+        for entry in index[len(index) - chunks:]:
+            f.seek(int(entry['offset']))
+            parts.append(decode_chunk(f.read(int(entry['length']))))
+    return np.concatenate(parts)[-n:]
+
+
+def count_range(directory, start=-np.inf, end=np.inf):
+    # Number of samples in [start, end]; only the two edge chunks are decoded
+    chunks = _overlapping(_read_index(directory), start, end)
+    if len(chunks) == 0:
+        return 0
+    total = int(chunks['count'][1:-1].sum())
+    edges = chunks[[0, -1]] if len(chunks) > 1 else chunks[:1]
+    for entry in edges:
+        if entry['start'] >= start and entry['end'] <= end:
+            total += int(entry['count'])
+        else:
+            total += len(read_range(directory, max(start, entry['start']), min(end, entry['end'])))
+    return total
+
+
+def last_time(directory):
+    # Time of the newest archived sample, or None
+    index = _read_index(directory)
+    return float(index['end'][-1]) if len(index) else None
+
+
+def stats(directory):
+    index = _read_index(directory)
+    samples = int(index['count'].sum())
+    stored = int(index['length'].sum()) + index.nbytes
+    return {
+        'chunks': len(index),
+        'samples': samples,
+        'bytes': stored,
+        'bytes_per_sample': round(stored / samples, 3) if samples else None,
+        'ratio': round(samples * RECORD_DTYPE.itemsize / stored, 1) if stored else None,
+    }
+
+
+def import_raw(directory, raw_path, chunk_seconds=CHUNK_SECONDS):
+    # Converts an uncompressed RECORD_DTYPE file (the former raw.bin) into
+    # the archive, chunked by time as if it had been written live
+    records = np.fromfile(raw_path, dtype=RECORD_DTYPE)
+    newest = last_time(directory)
+    if newest is not None:
+        records = records[records['time'] > newest]
+    if len(records) == 0:
+        return 0
+    writer = ArchiveWriter(directory, chunk_seconds)
+    buckets = np.floor((records['time'] - records['time'][0]) / chunk_seconds).astype(np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1, [len(records)]))
+    for lo, hi in zip(starts[:-1], starts[1:]):
+        writer.append(records[lo:hi])
+        writer.flush()
+    writer.close()
+    return len(records)
+
+
+if __name__ == '__main__':
+    # python archive.py stats <device> | import <device>
+    from history import history_dir
+    if len(sys.argv) != 3 or sys.argv[1] not in ('stats', 'import'):
+        sys.exit("usage: archive.py stats|import <device>")
+    directory = history_dir(sys.argv[2])
+    if sys.argv[1] == 'import':
+        raw_path = os.path.join(directory, 'raw.bin')
+        n = import_raw(directory, raw_path)
+        print(f"Imported {n} samples from {raw_path}; it can be deleted once checked")
+    print(stats(directory))
@@ -0,0 +1,30 @@
+// Clientside rendering of the gauges and the alert popup from the compact
+// live-state record the server publishes (latest values, alert, forecast).
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    live: {
+        withValue: function (fig, value) {
+            if (!fig || !fig.data || !fig.data.length || value === undefined) {
+                return window.dash_clientside.no_update;
+            }
+            var trace = Object.assign({}, fig.data[0], {value: value});
+            if (trace.gauge && trace.gauge.threshold) {
+                var threshold = Object.assign({}, trace.gauge.threshold, {value: value});
+                trace.gauge = Object.assign({}, trace.gauge, {threshold: threshold});
+            }
+            return Object.assign({}, fig, {data: [trace]});
+        },
+
+        render_gauges: function (state, phFig, condFig) {
+            var live = window.dash_clientside.live;
+            if (!state) {
+                return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+            }
+            return [live.withValue(phFig, state.ph), live.withValue(condFig, state.conductivity)];
+        },
+
+        render_popup: function (state, styles) {
+            var status = state ? state.status : 'normal';
+            return [state ? state.message : '', styles[status] || styles.normal];
+        }
+    }
+});
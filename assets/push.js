@@ -0,0 +1,42 @@
+// Server push for the dashboards (see push.py). One EventSource per tab
+// follows the selected skid; each event is applied in the browser without
+// a round trip to the server.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    push: {
+        connect: function (deviceId) {
+            if (window._pushSource) {
+                window._pushSource.close();
+            }
+            var source = new EventSource('/stream/' + encodeURIComponent(deviceId));
+            source.onmessage = function (e) {
+                dash_clientside.set_props('push-update', {data: JSON.parse(e.data)});
+            };
+            window._pushSource = source;
+            return 'push:' + deviceId;
+        },
+
+        apply: function (update, cursor) {
+            var skip = window.dash_clientside.no_update;
+            var none = [skip, skip, skip];
+            if (!update || !cursor || cursor.device !== update.device) {
+                return none;
+            }
+            if (!update.reset && update.head <= cursor.head) {
+                return none;  // already in the full figure
+            }
+            if (update.reset || update.prev !== cursor.head) {
+                // Out of step: ask the server for a full refresh
+                dash_clientside.set_props('interval-component', {n_intervals: Date.now()});
+                return none;
+            }
+
+            // Gauges and popup follow live-state (see live_state.js)
+            var live = !cursor.range || cursor.range === 'live';
+            return [
+                live ? update.extend : skip,
+                update.state,
+                Object.assign({}, cursor, {head: update.head})
+            ];
+        }
+    }
+});
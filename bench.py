@@ -0,0 +1,304 @@
+import argparse
+import base64
+import gc
+import gzip
+import importlib
+import json
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from plotly.utils import PlotlyJSONEncoder
+
+# Benchmark harness: drives the real ingestion path (SerialReader -> ring
+# store + history) and the dashboard callbacks with PhSimulator data at a
+# configurable rate and number of channels, and reports throughput, latency
+# percentiles, payload sizes and memory.
+#
+#   python bench.py --channels 8 --rate 100 --duration 60
+#   python bench.py --memory-samples 2000000   also checks that memory stays
+#                                              flat over millions of samples
+#
+# Runs in a scratch directory so real stores are never touched.
+
+from sensor import PhSimulator
+from ring_store import open_store
+from serial_reader import SerialReader
+from history import HistoryWriter, history_dir
+from alerts import AlertEngine
+from aggregates import AggregateSink, WINDOWS
+from calibration import Calibration
+from replay import ReplayPort, ReplayClock
+from payload import chart_columns
+from result_cache import ResultCache
+import archive
+import ring_store
+
+
+def summary(samples):
+    # Latency percentiles in milliseconds
+    if not samples:
+        return {}
+    ms = np.asarray(samples) * 1000
+    return {
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p90_ms': round(float(np.percentile(ms, 90)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'max_ms': round(float(ms.max()), 3),
+    }
+
+
+def bench_ingest(channels, rate, duration, batch, realtime, protocol='json'):
+    # `batch` readings arrive per serial read, per channel
+    devices = [f'bench{i}' for i in range(channels)]
+    simulators = [PhSimulator(seed=i) for i in range(channels)]
+    ports = [ReplayPort(115200) for _ in devices]
+    writers = [HistoryWriter(device_id) for device_id in devices]
+    stores = [open_store(device_id) for device_id in devices]
+    readers = [SerialReader(port, store, Calibration(), protocol=protocol,
+                            sinks=(writer, AlertEngine(store=store, device_id=device_id)))
+               for device_id, port, writer, store in zip(devices, ports, writers, stores)]
+
+    steps = max(1, int(rate * duration) // batch)
+    period = batch / rate
+    latencies = []
+    wire_bytes = 0
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    for step in range(steps):
+        for simulator, port, reader in zip(simulators, ports, readers):
+            if protocol == 'binary':
+                data = b''.join(simulator.serial_frame() for _ in range(batch))
+            else:
+                data = ''.join(simulator.serial_line() for _ in range(batch)).encode()
+            wire_bytes += len(data)
+            port.feed(data)
+            t0 = time.perf_counter()
+            while reader.poll():
+                pass
+            latencies.append(time.perf_counter() - t0)
+        if realtime:
+            delay = start + (step + 1) * period - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    for writer in writers:
+        writer.close()
+
+    samples = sum(reader.samples for reader in readers)
+    archived = sum(archive.stats(history_dir(device_id))['bytes'] for device_id in devices)
+    return devices, {
+        'samples': samples,
+        'parse_errors': sum(reader.parse_errors for reader in readers),
+        'missing_frames': sum(reader.missing_frames for reader in readers),
+        'wire_bytes_per_sample': round(wire_bytes / max(samples, 1), 1),
+        'archive_bytes_per_sample': round(archived / max(samples, 1), 3),
+        'throughput_per_s': round(samples / elapsed, 1),
+        'read_batch_latency': summary(latencies),
+        'traced_peak_kb': round(peak / 1024, 1),
+    }
+
+
+def bench_dashboard(module_name, device_id, ticks, new_per_tick):
+    module = importlib.import_module(module_name)
+    callback = getattr(module, 'update_graph', None) or module.update_graph_live
+    module.live.push = False  # measure the per-client polling path
+    # Every tick computes: no reuse between ticks, nor from earlier runs
+    # through the shared tier in /dev/shm
+    module.live.results = ResultCache(module_name, max_entries=0, shared_tier=False)
+
+    store = open_store(device_id)
+    simulator = PhSimulator(seed=1234)
+    calibration = Calibration()
+
+    load_times = []
+    for _ in range(ticks):
+        t0 = time.perf_counter()
+        module.live.load_data(device_id)
+        load_times.append(time.perf_counter() - t0)
+
+    def tick(cursor):
+        t0 = time.perf_counter()
+        outputs = callback(0, device_id, 'live', cursor)
+        elapsed = time.perf_counter() - t0
+        payload = json.dumps(outputs, cls=PlotlyJSONEncoder)
+        return outputs, elapsed, len(payload)
+
+    full_times, full_sizes = [], []
+    for _ in range(ticks):
+        outputs, elapsed, size = tick(None)
+        full_times.append(elapsed)
+        full_sizes.append(size)
+
+    cursor = outputs[-1]
+    stream_times, stream_sizes = [], []
+    for _ in range(ticks):
+        for _ in range(new_per_tick):
+            ph_values, conductivity_values = calibration.apply([simulator.next()])
+            store.extend([time.time()], ph_values, conductivity_values)
+        outputs, elapsed, size = tick(cursor)
+        cursor = outputs[-1]
+        stream_times.append(elapsed)
+        stream_sizes.append(size)
+
+    return {
+        'load_data': summary(load_times),
+        'full_tick': summary(full_times),
+        'full_payload_bytes': int(np.mean(full_sizes)),
+        'stream_tick': summary(stream_times),
+        'stream_payload_bytes': int(np.mean(stream_sizes)),
+    }
+
+
+def decode_payload(text):
+    # Stand-in for the browser's work on a response: JSON parse, then the
+    # typed arrays plotly.js would decode
+    def walk(value):
+        if isinstance(value, dict):
+            if 'bdata' in value:
+                return np.frombuffer(base64.b64decode(value['bdata']), dtype=value['dtype'])
+            return {k: walk(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [walk(v) for v in value]
+        return value
+    return walk(json.loads(text))
+
+
+def bench_payloads(module_name, device_id, ticks):
+    # Full chart responses as JSON lists versus compact typed arrays
+    module = importlib.import_module(module_name)
+    callback = getattr(module, 'update_graph', None) or module.update_graph_live
+    module.live.results = ResultCache(module_name, max_entries=0, shared_tier=False)
+    results = {}
+    for compact in (False, True):
+        module.live.compact = compact
+        sizes, gzipped, decode_times = [], [], []
+        for _ in range(ticks):
+            text = json.dumps(callback(0, device_id, 'live', None), cls=PlotlyJSONEncoder)
+            sizes.append(len(text))
+            gzipped.append(len(gzip.compress(text.encode(), 5)))
+            t0 = time.perf_counter()
+            decode_payload(text)
+            decode_times.append(time.perf_counter() - t0)
+        results['compact' if compact else 'json'] = {
+            'payload_bytes': int(np.mean(sizes)),
+            'gzip_bytes': int(np.mean(gzipped)),
+            'decode': summary(decode_times),
+        }
+    plain, compact = results['json'], results['compact']
+    results['size_reduction'] = round(plain['payload_bytes'] / compact['payload_bytes'], 2)
+    results['gzip_size_reduction'] = round(plain['gzip_bytes'] / compact['gzip_bytes'], 2)
+    return results
+
+
+def bench_memory(samples, batch, protocol='json', rate=1.0, render_every=10, points=1000):
+    # Bounded-memory check: `samples` readings at the collector's `rate` (in
+    # data time) through SerialReader into the store and every sink, with a
+    # chart rendered from the store every `render_every` reads. Once the
+    # ring and the longest rolling window are full, traced memory should
+    # stay flat; `growth_bytes_per_1k_samples` is what it still grows by.
+    device_id = 'memory0'
+    simulator = PhSimulator(seed=7)
+    port = ReplayPort(115200)
+    clock = ReplayClock()
+    store = open_store(device_id)
+    writer = HistoryWriter(device_id)
+    sinks = (writer, AlertEngine(store=store, device_id=device_id), AggregateSink(device_id))
+    reader = SerialReader(port, store, Calibration(), clock=clock, sinks=sinks, protocol=protocol)
+
+    # A pool of reads to cycle through, so generating data stays out of it
+    chunks = []
+    for _ in range(1000):
+        if protocol == 'binary':
+            chunks.append(b''.join(simulator.serial_frame() for _ in range(batch)))
+        else:
+            chunks.append(''.join(simulator.serial_line() for _ in range(batch)).encode())
+
+    steps = max(1, samples // batch)
+    warmup = min(steps // 2, int(max(store.capacity, WINDOWS[-1] * rate) // batch) + 1)
+    checkpoints = []
+    collections = 0
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    for step in range(steps):
+        if step == warmup:
+            gc.collect()
+            baseline, _ = tracemalloc.get_traced_memory()
+            collections = -sum(stat['collections'] for stat in gc.get_stats())
+        clock.now = 1.7e9 + (step + 1) * batch / rate
+        port.feed(chunks[step % len(chunks)])
+        while reader.poll():
+            pass
+        if step % render_every == 0:
+            records, _ = store.snapshot(points)
+            chart_columns(records['time'], records['ph'], records['conductivity'], [], [])
+        if step >= warmup and (step - warmup) % max(1, (steps - warmup) // 10) == 0:
+            checkpoints.append(round(tracemalloc.get_traced_memory()[0] / 1024, 1))
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    collections += sum(stat['collections'] for stat in gc.get_stats())
+    writer.close()
+
+    measured = max(1, (steps - warmup) * batch)
+    return {
+        'samples': reader.samples,
+        'warmup_samples': warmup * batch,
+        'throughput_per_s': round(reader.samples / elapsed, 1),
+        'traced_kb': checkpoints,
+        'traced_peak_kb': round(peak / 1024, 1),
+        'growth_bytes_per_1k_samples': round((current - baseline) * 1000 / measured, 2),
+        'gc_collections_per_1k_samples': round(collections * 1000 / measured, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingestion and dashboard benchmark')
+    parser.add_argument('--channels', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=100, help='samples/s per channel')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of data per channel')
+    parser.add_argument('--batch', type=int, default=10, help='readings per serial read')
+    parser.add_argument('--realtime', action='store_true', help='pace ingestion at --rate')
+    parser.add_argument('--protocol', choices=('json', 'binary'), default='json', help='serial format')
+    parser.add_argument('--dashboard', default='main', help="'main' or '12dash'")
+    parser.add_argument('--ticks', type=int, default=100)
+    parser.add_argument('--new-per-tick', type=int, default=1)
+    parser.add_argument('--memory-samples', type=int, default=0,
+                        help='also run the bounded-memory check over this many samples')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    os.chdir(tempfile.mkdtemp(prefix='cis-bench-'))
+    # Benchmark devices stay out of the live store directory
+    ring_store.STORE_DIR = 'sensor_data'
+
+    devices, ingest = bench_ingest(args.channels, args.rate, args.duration, args.batch, args.realtime,
+                                   args.protocol)
+    dashboard = bench_dashboard(args.dashboard, devices[0], args.ticks, args.new_per_tick)
+    payloads = bench_payloads(args.dashboard, devices[0], args.ticks)
+
+    results = {
+        'config': vars(args),
+        'ingest': ingest,
+        'dashboard': dashboard,
+        'payloads': payloads,
+        'memory': bench_memory(args.memory_samples, args.batch, args.protocol) if args.memory_samples else None,
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    print(json.dumps(results, indent=2))
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import json
+import os
+import numpy as np
+
+# Calibration and derived quantities, applied to whole batches of raw probe
+# readings by the collector (and the simulator) before they are stored. The
+# dashboards take their channel names and units from here.
+#
+# Per-probe settings come from calibration.json, keyed by device ID with an
+# optional "default" entry:
+#
+#   {"skid1": {"version": 3,
+#              "ph": {"points": [[4.02, 4.0], [6.97, 7.0], [10.1, 10.0]]},
+#              "temperature": 22.0}}
+#
+#   ph           "points": [raw, true] pairs, piecewise linear and extended
+#                along the end segments; or "slope" and "offset"
+#   temperature  probe temperature (°C) when no temperature channel is read;
+#                pH is compensated from 25 °C with the Nernst slope
+#   version      the probe's calibration number, recorded in the store
+#
+# MODEL_VERSION changes whenever the formulas below do.
+
+CALIBRATION_FILE = 'calibration.json'
+
+MODEL_VERSION = 1
+
+REFERENCE_TEMPERATURE = 25.0  # °C
+KELVIN = 273.15
+
+CHANNELS = {
+    'ph': {'label': 'pH', 'unit': ''},
+    'conductivity': {'label': 'Conductivity', 'unit': 'µS/cm'},
+}
+
+
+def channel_label(channel):
+    return CHANNELS.get(channel, {}).get('label', channel)
+
+
+def channel_title(channel):
+    # Axis / gauge title with the unit
+    unit = CHANNELS.get(channel, {}).get('unit')
+    return f"{channel_label(channel)} ({unit})" if unit else channel_label(channel)
+
+
+def load_calibration(device_id, path=CALIBRATION_FILE):
+    cfg = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            table = json.load(f)
+        cfg = table.get(device_id, table.get('default', {}))
+    return Calibration(cfg)
+
+
+class Calibration:
+    def __init__(self, cfg=None):
+        cfg = cfg or {}
+        self.version = int(cfg.get('version', 0))
+        self.temperature = float(cfg.get('temperature', REFERENCE_TEMPERATURE))
+
+        ph = cfg.get('ph', {})
+        if 'points' in ph:
+            points = np.array(sorted(ph['points']), dtype=np.float64)
+            if len(points) < 2:
+                raise ValueError("a pH calibration curve needs at least two points")
+            self._raw, self._true = points[:, 0], points[:, 1]
+        else:
+            slope = float(ph.get('slope', 1.0))
+            offset = float(ph.get('offset', 0.0))
+            self._raw = np.array([0.0, 1.0])
+            self._true = np.array([offset, offset + slope])
+        # Slopes of the end segments, for readings outside the curve
+        self._low_slope = (self._true[1] - self._true[0]) / (self._raw[1] - self._raw[0])
+        self._high_slope = (self._true[-1] - self._true[-2]) / (self._raw[-1] - self._raw[-2])
+
+    def calibrate_ph(self, raw):
+        x, y = self._raw, self._true
+        ph = np.interp(raw, x, y)
+        ph = np.where(raw < x[0], y[0] + (raw - x[0]) * self._low_slope, ph)
+        return np.where(raw > x[-1], y[-1] + (raw - x[-1]) * self._high_slope, ph)
+
+    def apply(self, raw_ph, temperature=None):
+        # (ph, conductivity) arrays for a batch of raw pH readings; pass a
+        # temperature array when the probe reports one
+        raw = np.asarray(raw_ph, dtype=np.float64)
+        ph = self.calibrate_ph(raw)
+
+        if temperature is not None or self.temperature != REFERENCE_TEMPERATURE:
+            t = self.temperature if temperature is None else np.asarray(temperature, dtype=np.float64)
+            ph = 7.0 + (ph - 7.0) * (REFERENCE_TEMPERATURE + KELVIN) / (t + KELVIN)
+
+        # Example model: conductivity falls as pH rises (µS/cm at 25 °C)
+        conductivity = np.maximum(0.0, 100.0 - 5.0 * ph)
+        return ph, conductivity
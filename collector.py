@@ -0,0 +1,223 @@
+import json
+import os
+import re
+import signal
+import sys
+import threading
+import time
+import numpy as np
+import serial
+from serial.tools import list_ports
+from ring_store import open_store, DEFAULT_CAPACITY
+from serial_reader import SerialReader, HostClock
+from history import HistoryWriter
+from alerts import AlertEngine, load_rules
+from aggregates import AggregateSink, WINDOWS
+from calibration import load_calibration, MODEL_VERSION
+from replay import CaptureWriter
+import archive
+import metrics
+
+# Optional device list: {"skid1": {"port": "/dev/ttyACM0", "baudrate": 9600}, ...}
+# Without it, every /dev/ttyACM* and /dev/ttyUSB* port is picked up.
+# "protocol" may be "json", "binary" (framing.py) or "auto" (the default).
+# "capture": a file path records the raw serial bytes for replay.py.
+CONFIG_FILE = 'skids.json'
+
+DEFAULT_BAUDRATE = 9600
+RETRY_INTERVAL = 5     # seconds between reconnect attempts
+ERROR_PAUSE = 1        # seconds to wait after an unexpected error while reading
+REPORT_INTERVAL = 10   # seconds between stats lines
+METRICS_PORT = 9101    # Prometheus scrape port (None to disable)
+
+CONNECTED = metrics.gauge('collector_device_connected', 'Serial port open', ['device'])
+
+
+class Terminated(Exception):
+    # SIGTERM (systemctl stop, shutdown) as an exception in the main thread
+    pass
+
+
+def _terminate(signum, frame):
+    raise Terminated
+
+
+def load_config(path=CONFIG_FILE):
+    with open(path) as f:
+        return json.load(f)
+
+
+def discover_devices():
+    devices = {}
+    for port in list_ports.comports():
+        if not re.search(r'ttyACM|ttyUSB', port.device):
+            continue
+        # The USB serial number survives re-plugging into another socket
+        device_id = port.serial_number or os.path.basename(port.device)
+        device_id = re.sub(r'[^A-Za-z0-9_.-]', '_', device_id)
+        devices[device_id] = {'port': port.device}
+    return devices
+
+
+class DeviceWorker:
+    # Reads one serial device into its own store, reconnecting when the
+    # port goes away (USB unplug, Arduino reset)
+
+    def __init__(self, device_id, port, baudrate, store, clock, protocol='auto', rules=None,
+                 capture=None):
+        self.device_id = device_id
+        self.port_name = port
+        self.baudrate = baudrate
+        self.store = store
+        self.history = HistoryWriter(device_id)
+        if store.head == 0:
+            self._refill()
+        self.alerts = AlertEngine(rules, store=store, device_id=device_id)
+        self.aggregates = AggregateSink(device_id)
+        self.clock = clock
+        self._seed_aggregates()
+        self.calibration = load_calibration(device_id)
+        store.set_calibration(MODEL_VERSION, self.calibration.version)
+        self.capture = CaptureWriter(capture) if capture else None
+        self.reader = SerialReader(None, store, self.calibration, clock=clock,
+                                   sinks=(self.history, self.alerts, self.aggregates), device_id=device_id,
+                                   protocol=protocol, capture=self.capture)
+        self._connected_metric = CONNECTED.labels(device_id)
+        self.connected = False
+        self._thread = None
+
+    def _refill(self):
+        # An empty store (tmpfs after a reboot) starts from the newest
+        # archived samples, so the dashboards do not come up blank
+        records = archive.read_last(self.history.directory, self.store.capacity)
+        if len(records):
+            self.store.extend(records['time'], records['ph'], records['conductivity'])
+            print(f"[{self.device_id}] store refilled with {len(records)} archived samples")
+
+    def _seed_aggregates(self):
+        # The rolling windows start from the samples already in the store,
+        # not empty, after a restart
+        records = self.store.latest()
+        if len(records):
+            times = records['time']
+            first = np.searchsorted(times, times[-1] - max(WINDOWS), side='right')
+            self.aggregates.extend(times[first:], records['ph'][first:], records['conductivity'][first:])
+            self._age_aggregates()
+
+    def _age_aggregates(self):
+        # Without samples the windows would keep showing the last ones they
+        # saw; age them against the clock instead
+        self.aggregates.advance(self.clock.to_wall(time.monotonic()))
+
+    def start(self, stop_event):
+        self._thread = threading.Thread(target=self._run, args=(stop_event,),
+                                        name=f'collector-{self.device_id}', daemon=True)
+        self._thread.start()
+
+    def join(self):
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, stop_event):
+        while not stop_event.is_set():
+            try:
+                with serial.Serial(self.port_name, self.baudrate, timeout=1) as port:
+                    self.reader.attach(port)
+                    self.connected = True
+                    self._connected_metric.set(1)
+                    while not stop_event.is_set():
+                        try:
+                            if not self.reader.poll():
+                                self._age_aggregates()
+                        except (serial.SerialException, OSError):
+                            raise
+                        except Exception as e:
+                            # A bad batch or a failing sink must not end the
+                            # worker; keep the port and carry on
+                            print(f"[{self.device_id}] error reading {self.port_name}: {e!r}")
+                            stop_event.wait(ERROR_PAUSE)
+            except (serial.SerialException, OSError) as e:
+                print(f"[{self.device_id}] serial error on {self.port_name}: {e}")
+            except Exception as e:
+                print(f"[{self.device_id}] unexpected error on {self.port_name}: {e!r}")
+            self.connected = False
+            self._connected_metric.set(0)
+            self._age_aggregates()
+            stop_event.wait(RETRY_INTERVAL)
+
+
+class Collector:
+    # Reads N serial devices concurrently, one worker thread each (the
+    # threads spend their time blocked in the serial driver, outside the
+    # GIL), writing every device into its own store keyed by device ID
+
+    def __init__(self, devices, capacity=DEFAULT_CAPACITY):
+        self.clock = HostClock()
+        self.workers = {}
+        self._stop = threading.Event()
+        rules = load_rules()
+        for device_id, cfg in devices.items():
+            store = open_store(device_id, capacity=capacity)
+            self.workers[device_id] = DeviceWorker(
+                device_id, cfg['port'], cfg.get('baudrate', DEFAULT_BAUDRATE), store, self.clock,
+                cfg.get('protocol', 'auto'), rules, cfg.get('capture'))
+
+    def start(self):
+        for worker in self.workers.values():
+            worker.start(self._stop)
+
+    def stop(self):
+        self._stop.set()
+        for worker in self.workers.values():
+            worker.join()
+            worker.store.flush()
+            worker.history.close()
+            if worker.capture is not None:
+                worker.capture.close()
+
+    def report(self, last_counts):
+        for device_id, worker in self.workers.items():
+            reader = worker.reader
+            rate = (reader.samples - last_counts.get(device_id, 0)) / REPORT_INTERVAL
+            last_counts[device_id] = reader.samples
+            latency = f"{reader.last_latency:.4f}" if reader.last_latency is not None else "-"
+            print(f"[{device_id}] {'up' if worker.connected else 'down'} "
+                  f"{reader.samples} samples ({rate:.1f}/s), "
+                  f"{reader.parse_errors} parse errors, {reader.missing_frames} missing frames, "
+                  f"latency last={latency} max={reader.max_latency:.4f}s")
+
+    def run(self):
+        if METRICS_PORT:
+            metrics.serve(METRICS_PORT)
+        # Stopping flushes the buffered archive chunk and rollups, so a
+        # service stop must get here as well as Ctrl-C
+        signal.signal(signal.SIGTERM, _terminate)
+        self.start()
+        last_counts = {}
+        try:
+            while True:
+                time.sleep(REPORT_INTERVAL)
+                self.report(last_counts)
+                for worker in self.workers.values():
+                    worker.store.flush()
+                    if worker.capture is not None:
+                        worker.capture.flush()
+        except (KeyboardInterrupt, Terminated):
+            pass
+        finally:
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            self.stop()
+            print("Stopped")
+
+
+if __name__ == '__main__':
+    config_path = sys.argv[1] if len(sys.argv) > 1 else CONFIG_FILE
+    if os.path.exists(config_path):
+        devices = load_config(config_path)
+    else:
+        devices = discover_devices()
+    if not devices:
+        sys.exit("No serial devices configured or found.")
+    for device_id, cfg in devices.items():
+        print(f"Collecting {device_id} from {cfg['port']}")
+    Collector(devices).run()
@@ -0,0 +1,397 @@
+import argparse
+import json
+import os
+import signal
+import threading
+import time
+from ring_store import open_store, DEFAULT_DEVICE, TornRead
+from sensor import PhSimulator
+from alerts import STATUSES
+import metrics
+
+# Dosing pump control, as its own service with a fixed-period loop:
+#
+#   python dosing.py skid1            reads the skid's ring store
+#   python dosing.py --simulate 3600  closed loop against PhSimulator, on a
+#                                     simulated clock (no waiting, mock pump)
+#
+# Each period the loop takes the latest pH, runs the controller and writes
+# the pump pin on changes only. It runs whether or not a dashboard is open.
+# Ticks are scheduled on absolute deadlines (start + k * period), so jitter
+# does not accumulate; a tick that starts late is measured, and one that
+# overruns the next deadline is counted as a miss and skipped. Without a
+# fresh reading the pump is switched off: a reading is fresh while the
+# store head keeps advancing, timed on this process's monotonic clock, so
+# wall-clock steps on either side do not matter. It is also held off while
+# the skid's alert (published in the store by the collector's alert engine)
+# is at the lockout level.
+#
+# Settings per device come from dosing.json, like calibration.json:
+#
+#   {"skid1": {"mode": "pid", "setpoint": 8.0, "direction": "lower",
+#              "kp": 2.0, "ki": 0.01, "kd": 0.0, "cycle": 10, "pin": 17}}
+#
+#   mode        "hysteresis": on once pH is `band` past the setpoint, off
+#               when back at it; "pid": duty cycle 0..1, turned into on-time
+#               within each `cycle` seconds (time-proportioned relay)
+#   direction   "lower" doses to bring pH down, "raise" to bring it up
+#   pin         BCM pin of the pump relay; "active_low" for low-side relays
+#   max_on      longest the pump may run without a break (seconds)
+#   min_off     how long that break lasts (seconds)
+#   lockout     alert status that holds the pump off, "warning" or
+#               "critical"; null to dose through alerts
+
+DOSING_FILE = 'dosing.json'
+
+PERIOD = 1.0         # seconds between control ticks
+MAX_AGE = 5.0        # seconds without a new sample before the reading is too old to act on
+METRICS_PORT = 9102  # Prometheus scrape port (None to disable)
+
+DEFAULTS = {
+    'mode': 'hysteresis',
+    'setpoint': 8.0,
+    'band': 0.1,
+    'direction': 'lower',
+    'kp': 2.0, 'ki': 0.01, 'kd': 0.0,
+    'cycle': 10.0,
+    'pin': 17,
+    'active_low': False,
+    'max_on': 300.0,
+    'min_off': 60.0,
+    'lockout': 'critical',
+}
+
+JITTER = metrics.histogram('dosing_loop_jitter_seconds', 'Control tick start after its deadline', ['device'])
+STEP_SECONDS = metrics.histogram('dosing_loop_step_seconds', 'Control tick work time', ['device'])
+MISSES = metrics.counter('dosing_deadline_misses_total', 'Control ticks skipped after an overrun', ['device'])
+STALE = metrics.counter('dosing_stale_ticks_total', 'Ticks without a fresh pH reading', ['device'])
+LOCKOUTS = metrics.counter('dosing_lockout_ticks_total', 'Ticks with the pump held off by an alert', ['device'])
+OUTPUT = metrics.gauge('dosing_output', 'Controller output (duty 0..1)', ['device'])
+PUMP_ON = metrics.gauge('dosing_pump_on', 'Pump relay state', ['device'])
+
+
+def load_settings(device_id, path=DOSING_FILE):
+    cfg = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            table = json.load(f)
+        cfg = table.get(device_id, table.get('default', {}))
+    return {**DEFAULTS, **cfg}
+
+
+class HysteresisController:
+    # On once the error passes `band`, off when it is back to zero
+    time_proportioned = False
+
+    def __init__(self, setpoint, band, direction='lower'):
+        self.setpoint = setpoint
+        self.band = band
+        self.sign = 1.0 if direction == 'lower' else -1.0
+        self.on = False
+
+    def update(self, ph, dt):
+        error = self.sign * (ph - self.setpoint)
+        if error > self.band:
+            self.on = True
+        elif error <= 0:
+            self.on = False
+        return 1.0 if self.on else 0.0
+
+
+class PidController:
+    # Duty cycle 0..1 from a PID on the pH error. The derivative acts on the
+    # measurement (no kick on setpoint changes) and the integral stops while
+    # the output is saturated in the direction it would push.
+    time_proportioned = True
+
+    def __init__(self, setpoint, kp, ki, kd, direction='lower'):
+        self.setpoint = setpoint
+        self.kp, self.ki, self.kd = kp, ki, kd
+        self.sign = 1.0 if direction == 'lower' else -1.0
+        self.integral = 0.0
+        self._last = None
+
+    def update(self, ph, dt):
+        error = self.sign * (ph - self.setpoint)
+        derivative = 0.0 if self._last is None or dt <= 0 else self.sign * (ph - self._last) / dt
+        self._last = ph
+        unclamped = self.kp * error + self.ki * (self.integral + error * dt) + self.kd * derivative
+        if 0.0 < unclamped < 1.0 or (unclamped >= 1.0 and error < 0) or (unclamped <= 0.0 and error > 0):
+            self.integral += error * dt
+        output = self.kp * error + self.ki * self.integral + self.kd * derivative
+        return min(1.0, max(0.0, output))
+
+
+def make_controller(settings):
+    if settings['mode'] == 'hysteresis':
+        return HysteresisController(settings['setpoint'], settings['band'], settings['direction'])
+    if settings['mode'] == 'pid':
+        return PidController(settings['setpoint'], settings['kp'], settings['ki'], settings['kd'],
+                             settings['direction'])
+    raise ValueError(f"unknown dosing mode {settings['mode']!r}")
+
+
+def gpio_pump(pin, active_low=False):
+    # set_pump(on) for the relay on `pin`, or a mock without RPi.GPIO
+    try:
+        import RPi.GPIO as GPIO
+    except ImportError:
+        print("RPi.GPIO not available, dosing pump will be mocked.")
+
+        def set_pump(on):
+            print(f"[MOCK GPIO] Dosing pump {'on' if on else 'off'}")
+        return set_pump
+
+    GPIO.setwarnings(False)
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setup(pin, GPIO.OUT, initial=active_low)
+
+    def set_pump(on):
+        GPIO.output(pin, on != active_low)
+    return set_pump
+
+
+class StoreSource:
+    # Latest pH from a device's ring store, as (age in seconds, pH). The age
+    # is the time since the store head last moved, on `clock`, not the
+    # sample timestamp: that comes from the collector's wall clock, which
+    # may be off by a clock step. Until the head has been seen to move the
+    # reading is unknown (None).
+    def __init__(self, device_id, clock=time.monotonic, lockout='critical'):
+        self.store = open_store(device_id, readonly=True)
+        self.clock = clock
+        self.lockout_level = None if lockout is None else STATUSES.index(lockout)
+        self._head = None
+        self._advanced = None  # clock time the head was last seen moving
+
+    def read(self):
+        try:
+            records, head = self.store.snapshot(1)
+        except TornRead:
+            return None
+        now = self.clock()
+        if self._head is not None and head != self._head:
+            self._advanced = now
+        self._head = head
+        if self._advanced is None or len(records) == 0:
+            return None
+        return now - self._advanced, float(records['ph'][-1])
+
+    def locked_out(self):
+        # True while the skid's alert is at or above the lockout level, or
+        # cannot be read
+        if self.lockout_level is None:
+            return False
+        try:
+            level, _ = self.store.alert
+        except TornRead:
+            return True
+        return level >= self.lockout_level
+
+
+class SimulatedPlant:
+    # PhSimulator as the disturbance plus the pump's effect: while on, pH
+    # moves by `gain` per second (down for 'lower'); the effect decays with
+    # time constant `tau`. Use its pump() as the pump and read() as the source.
+    def __init__(self, direction='lower', gain=0.01, tau=120.0, period=PERIOD, seed=None):
+        self.simulator = PhSimulator(seed=seed)
+        self.rate = -gain if direction == 'lower' else gain
+        self.tau = tau
+        self.period = period
+        self.effect = 0.0
+        self.on = False
+        self.on_seconds = 0.0
+
+    def pump(self, on):
+        self.on = on
+
+    def read(self):
+        if self.on:
+            self.effect += self.rate * self.period
+            self.on_seconds += self.period
+        self.effect -= self.effect * self.period / self.tau
+        return 0.0, self.simulator.next() + self.effect
+
+
+class ControlLoop:
+    # Fixed-period loop: source.read() -> controller -> set_pump(on).
+    # `lockout()`, if given, holds the pump off while it returns True.
+    # `clock` and `sleep` can be replaced to run on simulated time.
+
+    def __init__(self, read, controller, set_pump, period=PERIOD, cycle=10.0, max_age=MAX_AGE,
+                 max_on=DEFAULTS['max_on'], min_off=DEFAULTS['min_off'], device_id='', clock=time.monotonic,
+                 sleep=time.sleep, lockout=None):
+        self.read = read
+        self.lockout = lockout
+        self.controller = controller
+        self.set_pump = set_pump
+        self.period = period
+        self.cycle_ticks = max(1, round(cycle / period))
+        self.max_age = max_age
+        self.max_on_ticks = max(1, round(max_on / period)) if max_on else None
+        self.min_off_ticks = max(1, round(min_off / period))
+        self.clock = clock
+        self.sleep = sleep
+
+        self.ticks = 0
+        self.deadline_misses = 0
+        self.stale_ticks = 0
+        self.lockout_ticks = 0
+        self.max_jitter = 0.0
+        self.pump_on = None
+        self.switches = 0
+        self.output = 0.0
+        self._duty = 0.0
+        self._on_ticks = 0
+        self._rest_ticks = 0  # left of a forced break
+
+        self._jitter_metric = JITTER.labels(device_id)
+        self._step_metric = STEP_SECONDS.labels(device_id)
+        self._miss_metric = MISSES.labels(device_id)
+        self._stale_metric = STALE.labels(device_id)
+        self._lockout_metric = LOCKOUTS.labels(device_id)
+        self._output_metric = OUTPUT.labels(device_id)
+        self._pump_metric = PUMP_ON.labels(device_id)
+
+    def step(self):
+        reading = self.read()
+        if reading is None or reading[0] > self.max_age:
+            # No fresh reading: fail safe
+            self.stale_ticks += 1
+            self._stale_metric.inc()
+            self.output = 0.0
+            on = False
+        elif self.lockout is not None and self.lockout():
+            # The controller is not run either, so its integral does not
+            # wind up against a pump it cannot switch on
+            self.lockout_ticks += 1
+            self._lockout_metric.inc()
+            self.output = 0.0
+            on = False
+        else:
+            self.output = self.controller.update(reading[1], self.period)
+            if self.controller.time_proportioned:
+                # Duty is taken at the start of each relay cycle
+                phase = self.ticks % self.cycle_ticks
+                if phase == 0:
+                    self._duty = self.output
+                on = phase < round(self._duty * self.cycle_ticks)
+            else:
+                on = self.output > 0
+            if on and self.max_on_ticks and self._on_ticks >= self.max_on_ticks:
+                self._rest_ticks = self.min_off_ticks  # forced break after `max_on`
+        if self._rest_ticks:
+            on = False
+            self._rest_ticks -= 1
+        self._on_ticks = self._on_ticks + 1 if on else 0
+        self._output_metric.set(self.output)
+        if on != self.pump_on:
+            self.set_pump(on)
+            self.pump_on = on
+            self.switches += 1
+            self._pump_metric.set(1 if on else 0)
+        self.ticks += 1
+
+    def run(self, stop=None, ticks=None):
+        # Until `stop` (a threading.Event) is set, or for `ticks` periods
+        deadline = self.clock()
+        end = None if ticks is None else self.ticks + ticks
+        while not (stop is not None and stop.is_set()) and (end is None or self.ticks < end):
+            started = self.clock()
+            jitter = started - deadline
+            self._jitter_metric.observe(jitter)
+            self.max_jitter = max(self.max_jitter, jitter)
+            self.step()
+            done = self.clock()
+            self._step_metric.observe(done - started)
+
+            deadline += self.period
+            if done > deadline:
+                missed = int((done - deadline) // self.period) + 1
+                self.deadline_misses += missed
+                self._miss_metric.inc(missed)
+                deadline += missed * self.period
+            wait = deadline - self.clock()
+            if wait > 0:
+                self.sleep(wait)
+
+    def stats(self):
+        return {
+            'ticks': self.ticks,
+            'deadline_misses': self.deadline_misses,
+            'stale_ticks': self.stale_ticks,
+            'lockout_ticks': self.lockout_ticks,
+            'max_jitter_ms': round(self.max_jitter * 1000, 3),
+            'pump_on': self.pump_on,
+            'switches': self.switches,
+            'output': round(self.output, 3),
+        }
+
+
+class SimulatedClock:
+    # Monotonic clock that only moves when slept on
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def try_realtime(priority=10):
+    # SCHED_FIFO for the calling thread, if allowed (root or CAP_SYS_NICE)
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        return True
+    except (AttributeError, OSError):
+        return False
+
+
+def simulate(settings, seconds, seed=1234):
+    plant = SimulatedPlant(settings['direction'], seed=seed)
+    clock = SimulatedClock()
+    loop = ControlLoop(plant.read, make_controller(settings), plant.pump, cycle=settings['cycle'],
+                       max_on=settings['max_on'], min_off=settings['min_off'], device_id='simulated',
+                       clock=clock, sleep=clock.sleep)
+    loop.run(ticks=int(seconds / PERIOD))
+    return {**loop.stats(), 'ph': round(plant.simulator.ph_value + plant.effect, 3),
+            'pump_seconds': plant.on_seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dosing pump control loop')
+    parser.add_argument('device', nargs='?', default=DEFAULT_DEVICE)
+    parser.add_argument('--simulate', type=float, metavar='SECONDS',
+                        help='run against the simulator on simulated time')
+    args = parser.parse_args()
+
+    settings = load_settings(args.device)
+    if args.simulate:
+        print(json.dumps(simulate(settings, args.simulate), indent=2))
+        return
+
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+    if not try_realtime():
+        print("Real-time scheduling not available, running at normal priority")
+    set_pump = gpio_pump(settings['pin'], settings['active_low'])
+    source = StoreSource(args.device, lockout=settings['lockout'])
+    loop = ControlLoop(source.read, make_controller(settings), set_pump,
+                       cycle=settings['cycle'], max_on=settings['max_on'], min_off=settings['min_off'],
+                       device_id=args.device, lockout=source.locked_out)
+    stop = threading.Event()
+    # A service stop ends the loop too, so the pump is switched off below
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    try:
+        loop.run(stop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        set_pump(False)
+        print(f"Stopped: {loop.stats()}")
+
+
+if __name__ == '__main__':
+    main()
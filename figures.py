@@ -0,0 +1,70 @@
+import hashlib
+import json
+import os
+import plotly
+import plotly.graph_objs as go
+from plotly.utils import PlotlyJSONEncoder
+
+# Prebuilt figures for the dashboards. Plotly validates every property of a
+# graph_objs figure when it is built, which is most of a callback's time on a
+# Raspberry Pi. A FigureTemplate is built and validated once, kept as the
+# plain dict plotly would send, and each tick only puts the data arrays into
+# a shallow copy of it.
+#
+# The first figure built in a process also loads plotly's validators and
+# templates, a large part of start-up time. cached_figure() keeps built
+# figures on disk so later starts skip building them altogether.
+
+EMPTY_FIGURE = {'data': [], 'layout': {}}
+
+FIGURE_CACHE_DIR = 'figure_cache'
+
+
+def _cache_key(build, args):
+    # Changes with the builder's code, its arguments and the plotly version
+    code = build.__code__
+    digest = hashlib.sha1(code.co_code)
+    digest.update(repr((code.co_consts, code.co_names, args, plotly.__version__)).encode())
+    return digest.hexdigest()
+
+
+def cached_figure(name, build, *args):
+    # Plain dict of go.Figure(build(*args)), from the cache when up to date
+    key = _cache_key(build, args)
+    path = os.path.join(FIGURE_CACHE_DIR, name + '.json')
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+        if cached.get('key') == key:
+            return cached['figure']
+    except (OSError, ValueError):
+        pass
+
+    figure = go.Figure(build(*args)).to_dict()
+    try:
+        os.makedirs(FIGURE_CACHE_DIR, exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'key': key, 'figure': figure}, f, cls=PlotlyJSONEncoder)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"Figure cache not written: {e}")
+    return figure
+
+
+class FigureTemplate:
+    def __init__(self, figure):
+        # A go.Figure or the plain dict of one (see cached_figure)
+        spec = figure if isinstance(figure, dict) else go.Figure(figure).to_dict()
+        self.traces = spec['data']
+        self.layout = spec['layout']  # shared by every render, never modified
+
+    def render(self, *columns):
+        # One (x, y) pair per trace, in trace order
+        data = []
+        for trace, (x, y) in zip(self.traces, columns):
+            trace = dict(trace)
+            trace['x'] = x
+            trace['y'] = y
+            data.append(trace)
+        return {'data': data, 'layout': self.layout}
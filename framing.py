@@ -0,0 +1,145 @@
+import binascii
+import struct
+import numpy as np
+
+# Binary frames for the Arduino serial link, as an alternative to the
+# {'pH': value} text lines. Little-endian, no padding:
+#
+#   offset  size  field
+#   0       2     sync      0xA5 0x5A
+#   2       1     length    payload bytes (4 * channels)
+#   3       2     seq       uint16, +1 per frame, wraps
+#   5       4*n   values    float32 per channel, pH first
+#   5+4n    2     crc       CRC-16/CCITT-FALSE over length, seq and values
+#
+# Firmware side (one channel):
+#
+#   struct __attribute__((packed)) Frame {
+#     uint8_t sync[2]; uint8_t length; uint16_t seq; float ph; uint16_t crc;
+#   };
+#
+# The sync bytes never occur in the text format, which is how a reader in
+# 'auto' mode tells old and new firmware apart.
+
+SYNC = b'\xa5\x5a'
+HEADER_SIZE = 5
+CRC_SIZE = 2
+CRC_INIT = 0xFFFF
+
+# A sequence jump larger than this is a firmware restart, not lost frames
+MAX_GAP = 0x7FFF
+
+# Table for the MSB-first CRC, used to check many frames at once
+_CRC_TABLE = np.array([binascii.crc_hqx(bytes([i]), 0) for i in range(256)], dtype=np.uint16)
+
+
+def frame_size(channels=1):
+    return HEADER_SIZE + 4 * channels + CRC_SIZE
+
+
+def frame_dtype(channels=1):
+    return np.dtype([
+        ('sync', 'u1', (2,)),
+        ('length', 'u1'),
+        ('seq', '<u2'),
+        ('values', '<f4', (channels,)),
+        ('crc', '<u2'),
+    ])
+
+
+def crc16(data):
+    return binascii.crc_hqx(data, CRC_INIT)
+
+
+def encode_frame(seq, *values):
+    # One frame as the firmware would send it (simulator, benchmarks)
+    body = struct.pack(f'<BH{len(values)}f', 4 * len(values), seq & 0xFFFF, *values)
+    return SYNC + body + struct.pack('<H', crc16(body))
+
+
+def _crc_rows(rows):
+    # CRC of every row of a 2-D uint8 array, one column at a time
+    crc = np.full(len(rows), CRC_INIT, dtype=np.uint16)
+    for j in range(rows.shape[1]):
+        crc = (crc << 8) ^ _CRC_TABLE[(crc >> 8) ^ rows[:, j]]
+    return crc
+
+
+class FrameDecoder:
+    # Streaming decoder: decode() takes everything buffered so far and
+    # returns the valid frames in it as arrays. Runs of back-to-back frames
+    # are checked as one block; after a bad frame it searches for the next
+    # sync bytes.
+
+    def __init__(self, channels=1):
+        self.channels = channels
+        self.size = frame_size(channels)
+        self.dtype = frame_dtype(channels)
+        self.last_seq = None
+
+    def reset(self):
+        # New connection: the sequence starts over
+        self.last_seq = None
+
+    def decode(self, buffer):
+        # Returns (seq, values, ends, consumed, missing, errors):
+        #   seq, values  uint16 (n,) and float32 (n, channels) of valid frames
+        #   ends         offset in buffer just past each frame
+        #   consumed     bytes the caller can drop; the rest is a partial frame
+        #   missing      frames lost according to the sequence numbers
+        #   errors       bad frames or bytes skipped to find a sync
+        size = self.size
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        blocks, block_ends = [], []
+        errors = 0
+        pos = 0
+        resync = False
+        while True:
+            start = buffer.find(SYNC, pos)
+            if start < 0:
+                # Keep a trailing first sync byte, drop the rest
+                consumed = len(buffer) - 1 if buffer.endswith(SYNC[:1]) else len(buffer)
+                if consumed > pos and not resync:
+                    errors += 1
+                break
+            if start > pos and not resync:
+                errors += 1
+            resync = False
+            count = (len(buffer) - start) // size
+            if count == 0:
+                consumed = start
+                break
+            rows = data[start:start + count * size].reshape(count, size)
+            ok = (rows[:, 0] == SYNC[0]) & (rows[:, 1] == SYNC[1]) & (rows[:, 2] == size - HEADER_SIZE - CRC_SIZE)
+            crc = rows[:, -2].astype(np.uint16) | (rows[:, -1].astype(np.uint16) << 8)
+            ok &= _crc_rows(rows[:, 2:-2]) == crc
+            bad = np.flatnonzero(~ok)
+            good = count if len(bad) == 0 else int(bad[0])
+            if good:
+                blocks.append(rows[:good])
+                block_ends.append(start + size * np.arange(1, good + 1))
+            pos = start + good * size
+            if good == count:
+                consumed = pos
+                break
+            # Bad frame: resync from the byte after its sync
+            errors += 1
+            pos += 1
+            resync = True
+
+        if not blocks:
+            return (np.empty(0, np.uint16), np.empty((0, self.channels), np.float32),
+                    np.empty(0, np.int64), consumed, 0, errors)
+
+        frames = np.concatenate(blocks).view(self.dtype).reshape(-1)
+        seq = frames['seq']
+        ends = np.concatenate(block_ends)
+
+        prev = np.empty(len(seq), dtype=np.int64)
+        prev[1:] = seq[:-1]
+        prev[0] = int(seq[0]) - 1 if self.last_seq is None else self.last_seq
+        gaps = ((seq - prev) & 0xFFFF) - 1
+        missing = int(gaps[(gaps > 0) & (gaps <= MAX_GAP)].sum())
+        self.last_seq = int(seq[-1])
+
+        return seq, frames['values'], ends, consumed, missing, errors
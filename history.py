@@ -0,0 +1,312 @@
+import os
+import numpy as np
+from ring_store import RECORD_DTYPE, TornRead, open_store, store_path
+import archive
+
+# Long-term history per device, next to the live ring stores:
+#
+#   history/<device>/samples.*      every sample, compressed (archive.py)
+#   history/<device>/rollup_<w>.bin min/max/mean per w-second bucket
+#
+# Rollups are computed as data arrives, so any time range can be served as
+# a bounded number of points without scanning the raw samples. A raw.bin
+# from before the archive is converted with `python archive.py import <device>`.
+
+HISTORY_DIR = 'history'
+
+# Bucket widths (seconds) of the precomputed levels, finest first
+ROLLUP_WIDTHS = (10, 60, 600, 3600)
+
+# Completed rollup rows are written out every this many seconds of data
+# time, in step with the archive chunks, so the SD card sees few small
+# writes. Data time, not wall time: a replay or backfill at full speed
+# would otherwise hold every row it makes until the wall clock catches up.
+FLUSH_INTERVAL = archive.CHUNK_SECONDS
+
+# Raw ranges up to this many samples are downsampled with LTTB; beyond that
+# the min/max rollups are used
+LTTB_LIMIT = 50000
+
+ROLLUP_DTYPE = np.dtype([
+    ('time', '<f8'),       # bucket start
+    ('count', '<u4'),
+    ('ph_min', '<f4'),
+    ('ph_max', '<f4'),
+    ('ph_mean', '<f4'),
+    ('conductivity_min', '<f4'),
+    ('conductivity_max', '<f4'),
+    ('conductivity_mean', '<f4'),
+])
+
+CHANNELS = ('ph', 'conductivity')
+
+
+def history_dir(device_id):
+    store_path(device_id)  # validates the id
+    if device_id in ('.', '..'):
+        # Valid as a ring file name, but not as a directory
+        raise ValueError(f"invalid device id: {device_id!r}")
+    return os.path.join(HISTORY_DIR, device_id)
+
+
+def _rollup_path(directory, width):
+    return os.path.join(directory, f'rollup_{width}.bin')
+
+
+class _Bucket:
+    # Open (not yet complete) rollup bucket for one level
+    def __init__(self):
+        self.start = None
+        self.count = 0
+        self.min = {}
+        self.max = {}
+        self.sum = {}
+
+
+class HistoryWriter:
+    # Appends samples to the archive and maintains the rollup levels.
+    # Used as an extra sink of the collector, next to the ring store.
+    #
+    # Note: the bucket open at shutdown is not written, so a restart loses
+    # that bucket from the rollups (the raw samples are kept).
+
+    def __init__(self, device_id, widths=ROLLUP_WIDTHS, flush_interval=FLUSH_INTERVAL):
+        self.directory = history_dir(device_id)
+        os.makedirs(self.directory, exist_ok=True)
+        self.widths = widths
+        self.flush_interval = flush_interval
+
+        self._archive = archive.ArchiveWriter(self.directory)
+        self._rollups = {w: open(_rollup_path(self.directory, w), 'ab') for w in widths}
+        self._buckets = {w: _Bucket() for w in widths}
+        self._pending_rollups = {w: [] for w in widths}
+        self._newest = None      # data time of the newest sample
+        self._last_flush = None  # data time of the last rollup write
+
+    def extend(self, times, ph_values, conductivity_values):
+        if len(times) == 0:
+            return
+        # The archive's buffered copy doubles as the batch for the rollups
+        batch = self._archive.append_columns(times, ph_values, conductivity_values)
+
+        for width in self.widths:
+            self._roll(width, batch)
+
+        if self._last_flush is None:
+            self._last_flush = float(times[0])
+        self._newest = float(times[-1])
+        if self._newest - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def _roll(self, width, batch):
+        # Batches are time ordered, so each bucket is one run of equal ids
+        ids = np.floor(batch['time'] / width)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(ids)) + 1))
+        bucket = self._buckets[width]
+
+        for i, start in enumerate(starts):
+            end = starts[i + 1] if i + 1 < len(starts) else len(batch)
+            bucket_start = ids[start] * width
+            if bucket.start != bucket_start:
+                if bucket.start is not None and bucket.count:
+                    self._pending_rollups[width].append(self._close(bucket))
+                bucket.start = bucket_start
+                bucket.count = 0
+            part = batch[start:end]
+            for channel in CHANNELS:
+                values = part[channel]
+                lo, hi, total = float(values.min()), float(values.max()), float(values.sum())
+                if bucket.count:
+                    bucket.min[channel] = min(bucket.min[channel], lo)
+                    bucket.max[channel] = max(bucket.max[channel], hi)
+                    bucket.sum[channel] += total
+                else:
+                    bucket.min[channel], bucket.max[channel], bucket.sum[channel] = lo, hi, total
+            bucket.count += end - start
+
+    def _close(self, bucket):
+        row = [bucket.start, bucket.count]
+        for channel in CHANNELS:
+            row += [bucket.min[channel], bucket.max[channel], bucket.sum[channel] / bucket.count]
+        return tuple(row)
+
+    def flush(self):
+        # Rollup rows only; the archive writes a chunk once it spans its
+        # interval, or on close
+        for width, rows in self._pending_rollups.items():
+            if rows:
+                self._rollups[width].write(np.array(rows, dtype=ROLLUP_DTYPE).tobytes())
+                self._rollups[width].flush()
+                rows.clear()
+        self._last_flush = self._newest
+
+    def close(self):
+        self.flush()
+        self._archive.close()
+        for f in self._rollups.values():
+            f.close()
+
+
+def _read(path, dtype):
+    # Read-only view of an append-only file; ignores a partly written tail
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return np.empty(0, dtype=dtype)
+    n = size // dtype.itemsize
+    if n == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(n,))
+
+
+def _time_slice(records, start, end):
+    times = records['time']
+    lo = np.searchsorted(times, start, side='left')
+    hi = np.searchsorted(times, end, side='right')
+    return records[lo:hi]
+
+
+def lttb(x, y, n_out):
+    # Largest-Triangle-Three-Buckets: indices of n_out points that keep the
+    # visual shape of (x, y)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Average of the next bucket (or the last point)
+        if i + 2 < len(edges):
+            nlo, nhi = edges[i + 1], edges[i + 2]
+            avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        bx, by = x[lo:hi], y[lo:hi]
+        area = np.abs((x[a] - avg_x) * (by - y[a]) - (x[a] - bx) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+
+def _unarchived(device_id, after, start, end):
+    # Samples newer than the archive (still buffered by the collector), from
+    # the ring store
+    try:
+        store = open_store(device_id, readonly=True)
+        records, _ = store.snapshot()
+    except (OSError, ValueError, TornRead):
+        return np.empty(0, dtype=RECORD_DTYPE)
+    records = np.array(_time_slice(records, max(start, np.nextafter(after, np.inf)), end))
+    store.close()
+    return records
+
+
+def iter_raw(device_id, start=None, end=None):
+    # Samples of one device in [start, end] (all by default), in time order,
+    # one archive chunk at a time; memory stays bounded for any range
+    directory = history_dir(device_id)
+    start = -np.inf if start is None else start
+    end = np.inf if end is None else end
+    yield from archive.iter_range(directory, start, end)
+    newest = archive.last_time(directory)
+    if newest is None or newest < end:
+        recent = _unarchived(device_id, -np.inf if newest is None else newest, start, end)
+        if len(recent):
+            yield recent
+
+
+def raw_records(device_id, start=None, end=None):
+    # Samples of one device in [start, end] (all by default); only the
+    # archive chunks overlapping the range are decompressed
+    parts = list(iter_raw(device_id, start, end))
+    return np.concatenate(parts) if parts else np.empty(0, dtype=RECORD_DTYPE)
+
+
+def rollups(device_id, width, start, end):
+    # Rollup rows of one level with bucket starts in [start, end], as a
+    # read-only view
+    if width not in ROLLUP_WIDTHS:
+        raise ValueError(f"no rollup level of {width} s")
+    return _time_slice(_read(_rollup_path(history_dir(device_id), width), ROLLUP_DTYPE), start, end)
+
+
+def raw_count(device_id, start, end):
+    # len(raw_records(...)) without decompressing the whole range
+    directory = history_dir(device_id)
+    count = archive.count_range(directory, start, end)
+    newest = archive.last_time(directory)
+    if newest is None or newest < end:
+        count += len(_unarchived(device_id, -np.inf if newest is None else newest, start, end))
+    return count
+
+
+def coarsen(rows, width, max_rows):
+    # Rollup rows merged into buckets of a multiple of `width` seconds, at
+    # most max_rows of them (at least 3): min of the mins, max of the maxes,
+    # count-weighted mean. Returns (rows, merged width).
+    max_rows = max(int(max_rows), 3)
+    span = float(rows['time'][-1] - rows['time'][0]) if len(rows) else 0.0
+    # A span of n widths touches at most n + 2 buckets of the merged grid
+    factor = max(1, int(np.ceil(span / width / (max_rows - 2))))
+    while True:
+        merged = width * factor
+        ids = np.floor(rows['time'] / merged)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(ids)) + 1)) if len(rows) else np.empty(0, np.int64)
+        if len(starts) <= max_rows:
+            break
+        factor += 1
+
+    out = np.empty(len(starts), dtype=ROLLUP_DTYPE)
+    if not len(starts):
+        return out, merged
+    counts = rows['count'].astype(np.float64)
+    total = np.add.reduceat(counts, starts)
+    out['time'] = ids[starts] * merged
+    out['count'] = total
+    for channel in CHANNELS:
+        out[channel + '_min'] = np.minimum.reduceat(rows[channel + '_min'], starts)
+        out[channel + '_max'] = np.maximum.reduceat(rows[channel + '_max'], starts)
+        weighted = np.add.reduceat(rows[channel + '_mean'].astype(np.float64) * counts, starts)
+        out[channel + '_mean'] = weighted / np.maximum(total, 1)
+    return out, merged
+
+
+def query(device_id, start, end, max_points=1000):
+    # Samples of one device in [start, end] as at most ~max_points points:
+    # returns (columns, level) where columns has 'time', 'ph' and
+    # 'conductivity' arrays and level is 'raw', 'lttb' or the bucket width
+    # Counted from the archive index, so long ranges never decompress
+    if raw_count(device_id, start, end) <= LTTB_LIMIT:
+        raw = raw_records(device_id, start, end)
+        if len(raw) <= max_points:
+            return {name: np.asarray(raw[name]) for name in RECORD_DTYPE.names}, 'raw'
+
+        times = raw['time']
+        # Pick points on the pH shape; conductivity follows the same samples
+        keep = lttb(times - times[0], raw['ph'].astype(np.float64), max_points)
+        return {name: np.asarray(raw[name][keep]) for name in RECORD_DTYPE.names}, 'lttb'
+
+    # Min/max per bucket, two points each, from the finest level that fits;
+    # past the coarsest level, its rows are merged into wider buckets
+    for width in ROLLUP_WIDTHS:
+        buckets = rollups(device_id, width, start, end)
+        if 2 * len(buckets) <= max_points or width == ROLLUP_WIDTHS[-1]:
+            break
+    if 2 * len(buckets) > max_points:
+        buckets, width = coarsen(buckets, width, max_points // 2)
+
+    n = len(buckets)
+    columns = {'time': np.empty(2 * n)}
+    columns['time'][0::2] = buckets['time']
+    columns['time'][1::2] = buckets['time'] + width / 2
+    for channel in CHANNELS:
+        values = np.empty(2 * n, dtype=np.float32)
+        values[0::2] = buckets[channel + '_min']
+        values[1::2] = buckets[channel + '_max']
+        columns[channel] = values
+    return columns, width
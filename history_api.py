@@ -0,0 +1,172 @@
+import json
+import os
+import time
+from datetime import datetime, timezone
+import numpy as np
+from flask import Response, abort, request
+from history import iter_raw, rollups, history_dir, ROLLUP_WIDTHS, CHANNELS
+from ring_store import list_devices
+import metrics
+
+# Range queries over the sensor history as HTTP/JSON, served by the
+# dashboards next to the Dash app, for shift reports and historian exports:
+#
+#   GET /api/history/<device>?start=...&end=...&channel=ph&resolution=raw
+#
+#   start, end   epoch seconds or ISO 8601 (UTC unless an offset is given);
+#                default: the last hour
+#   channel      'ph', 'conductivity' or a comma-separated list (default all)
+#   resolution   'raw' for every sample, or a rollup width in seconds
+#                (ROLLUP_WIDTHS) for count/min/max/mean rows per bucket
+#   format       'json' (default) or 'csv'
+#
+#   GET /api/devices
+#
+# The archive index and the rollup files are sorted by time, so a range is
+# found with binary searches. Rows are streamed as they are read, one
+# archive chunk or ROWS_PER_BLOCK rollup rows at a time, so an export of
+# months of samples is never held in memory at once.
+
+DEFAULT_SPAN = 3600
+ROWS_PER_BLOCK = 4096
+DECIMALS = 4  # channel values are float32; more digits are noise
+
+QUERY_SECONDS = metrics.histogram('history_query_seconds', 'History range query time, until the last row is sent',
+                                  ['resolution'])
+QUERY_ROWS = metrics.counter('history_query_rows_total', 'Rows sent by history range queries', ['resolution'])
+
+
+def parse_time(text, default):
+    if not text:
+        return default
+    try:
+        value = float(text)
+    except ValueError:
+        pass
+    else:
+        # float() also takes 'nan' and 'inf', which JSON cannot carry
+        if not np.isfinite(value):
+            abort(400, description=f"bad time {text!r}: use epoch seconds or ISO 8601")
+        return value
+    try:
+        moment = datetime.fromisoformat(text.replace('Z', '+00:00'))
+    except ValueError:
+        abort(400, description=f"bad time {text!r}: use epoch seconds or ISO 8601")
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def parse_query(args):
+    # (start, end, channels, resolution, format) from the query string
+    end = parse_time(args.get('end'), time.time())
+    start = parse_time(args.get('start'), end - DEFAULT_SPAN)
+    if start > end:
+        abort(400, description="start is after end")
+
+    channels = [c for c in args.get('channel', '').split(',') if c] or list(CHANNELS)
+    unknown = [c for c in channels if c not in CHANNELS]
+    if unknown:
+        abort(400, description=f"unknown channel {unknown[0]!r}; one of {', '.join(CHANNELS)}")
+
+    resolution = args.get('resolution', 'raw')
+    if resolution != 'raw':
+        try:
+            resolution = int(resolution)
+        except ValueError:
+            resolution = None
+        if resolution not in ROLLUP_WIDTHS:
+            abort(400, description=f"resolution is 'raw' or one of {', '.join(map(str, ROLLUP_WIDTHS))}")
+
+    fmt = args.get('format', 'json')
+    if fmt not in ('json', 'csv'):
+        abort(400, description="format is 'json' or 'csv'")
+    return start, end, channels, resolution, fmt
+
+
+def columns_for(channels, resolution):
+    if resolution == 'raw':
+        return list(channels)
+    return ['count'] + [f'{c}_{stat}' for c in channels for stat in ('min', 'max', 'mean')]
+
+
+def blocks(device_id, start, end, resolution):
+    # Record arrays in time order; rollup rows are time-sliced views
+    if resolution == 'raw':
+        yield from iter_raw(device_id, start, end)
+        return
+    rows = rollups(device_id, resolution, start, end)
+    for lo in range(0, len(rows), ROWS_PER_BLOCK):
+        yield rows[lo:lo + ROWS_PER_BLOCK]
+
+
+def block_table(block, columns):
+    # (times, 2-D float64 values) of one block, values rounded for output
+    values = np.empty((len(block), len(columns)))
+    for j, name in enumerate(columns):
+        values[:, j] = block[name]
+    if columns[0] == 'count':
+        values[:, 1:] = np.round(values[:, 1:], DECIMALS)
+    else:
+        values = np.round(values, DECIMALS)
+    return np.round(block['time'].astype(np.float64), 3), values
+
+
+def stream_json(device_id, start, end, columns, resolution, table_blocks):
+    head = {'device': device_id, 'start': start, 'end': end, 'resolution': resolution,
+            'columns': ['time'] + columns}
+    yield json.dumps(head)[:-1] + ', "rows": ['
+    first = True
+    for times, values in table_blocks:
+        rows = np.column_stack((times, values)).tolist()
+        text = json.dumps(rows)[1:-1]
+        yield text if first else ', ' + text
+        first = False
+    yield ']}\n'
+
+
+def stream_csv(columns, table_blocks):
+    yield ','.join(['time'] + columns) + '\n'
+    for times, values in table_blocks:
+        stamps = (times * 1000).astype('datetime64[ms]').astype(str)
+        lines = [stamp + 'Z,' + ','.join(map(repr, row)) for stamp, row in zip(stamps, values.tolist())]
+        yield '\n'.join(lines) + '\n'
+
+
+def register(server, prefix='/api'):
+    def history_view(device_id):
+        try:
+            directory = history_dir(device_id)
+        except ValueError:
+            abort(404)
+        # Known by its history, or by its live store alone (replays without history)
+        if not os.path.isdir(directory) and device_id not in list_devices():
+            abort(404, description=f"unknown device {device_id!r}")
+        start, end, channels, resolution, fmt = parse_query(request.args)
+        columns = columns_for(channels, resolution)
+        label = str(resolution)
+        started = time.perf_counter()
+
+        def table_blocks():
+            rows = 0
+            try:
+                for block in blocks(device_id, start, end, resolution):
+                    rows += len(block)
+                    yield block_table(block, columns)
+            finally:
+                QUERY_ROWS.labels(label).inc(rows)
+                QUERY_SECONDS.labels(label).observe(time.perf_counter() - started)
+
+        if fmt == 'csv':
+            body = stream_csv(columns, table_blocks())
+            mimetype = 'text/csv'
+        else:
+            body = stream_json(device_id, start, end, columns, resolution, table_blocks())
+            mimetype = 'application/json'
+        return Response(body, mimetype=mimetype, headers={'Cache-Control': 'no-cache'})
+
+    def devices_view():
+        return Response(json.dumps(list_devices()), mimetype='application/json')
+
+    server.add_url_rule(f'{prefix}/history/<device_id>', 'history_query', history_view)
+    server.add_url_rule(f'{prefix}/devices', 'history_devices', devices_view)
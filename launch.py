@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+import metrics
+
+# Production launch for the dashboards, with boot timing.
+#
+# Dashboards run without the debug reloader (which imports everything twice)
+# unless DASHBOARD_DEBUG=1. Start-up is logged and exported as metrics, from
+# process start to app ready, first layout served and first chart rendered,
+# plus system uptime at the first render (power-on to display).
+
+DEBUG_ENV = 'DASHBOARD_DEBUG'
+
+READY_SECONDS = metrics.gauge('dashboard_boot_ready_seconds', 'Process start to app ready to serve')
+FIRST_LAYOUT_SECONDS = metrics.gauge('dashboard_boot_first_layout_seconds', 'Process start to first layout served')
+FIRST_RENDER_SECONDS = metrics.gauge('dashboard_boot_first_render_seconds',
+                                     'Process start to first callback response')
+UPTIME_AT_RENDER = metrics.gauge('dashboard_boot_uptime_at_first_render_seconds',
+                                 'System uptime when the first callback response was sent')
+
+_imported = time.perf_counter()
+
+
+def system_uptime():
+    try:
+        with open('/proc/uptime') as f:
+            return float(f.read().split()[0])
+    except (OSError, ValueError):
+        return None
+
+
+def process_age():
+    # Seconds since this process started (Linux); elsewhere since this
+    # module was imported
+    try:
+        with open('/proc/self/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        started = int(fields[19]) / os.sysconf('SC_CLK_TCK')  # starttime, field 22
+        return system_uptime() - started
+    except (OSError, ValueError, IndexError, TypeError):
+        return time.perf_counter() - _imported
+
+
+def track_boot(app):
+    from flask import request
+
+    ready = process_age()
+    READY_SECONDS.set(ready)
+    print(f"Dashboard ready {ready:.2f}s after process start")
+    seen = set()
+
+    @app.server.after_request
+    def _boot_timing(response):
+        if len(seen) < 2 and response.status_code == 200:
+            if request.path.endswith('/_dash-layout') and 'layout' not in seen:
+                seen.add('layout')
+                FIRST_LAYOUT_SECONDS.set(process_age())
+            elif request.path.endswith('/_dash-update-component') and 'render' not in seen:
+                seen.add('render')
+                age = process_age()
+                FIRST_RENDER_SECONDS.set(age)
+                uptime = system_uptime()
+                if uptime is not None:
+                    UPTIME_AT_RENDER.set(uptime)
+                print(f"First update served {age:.2f}s after process start"
+                      + (f", {uptime:.1f}s after power-on" if uptime is not None else ""))
+        return response
+
+
+def run(app, host='0.0.0.0', port=8050, warm=None):
+    # `warm` runs on a background thread while the server starts, to do the
+    # first render's expensive work before a browser asks for it
+    debug = os.environ.get(DEBUG_ENV) == '1'
+    track_boot(app)
+    if warm is not None:
+        threading.Thread(target=warm, name='warm-up', daemon=True).start()
+    app.run(host=host, port=port, debug=debug, use_reloader=debug, threaded=True)
@@ -0,0 +1,379 @@
+import threading
+import time
+import numpy as np
+from dash import html, no_update
+from dash.exceptions import PreventUpdate
+from ring_store import open_store, list_devices, TornRead
+from aggregates import open_aggregates, window_label, CHANNELS
+from calibration import channel_label
+from history import query
+from trend import StoreTrend
+from actuator import TowerLightActuator, worst_status
+from alerts import AlertEngine, STATUSES
+from figures import EMPTY_FIGURE
+from result_cache import ResultCache
+from payload import chart_columns, to_datetime, epoch_ms
+import metrics
+
+CALLBACK_SECONDS = metrics.histogram('dashboard_callback_seconds', 'Dashboard update callback time', ['mode'])
+STAGE_SECONDS = metrics.histogram('dashboard_stage_seconds', 'Time per dashboard callback stage', ['stage'])
+
+# Helpers for the streaming dashboard mode: each browser keeps a cursor in a
+# dcc.Store (the store head it last saw) and only receives records written
+# since then. A full figure is sent on the first tick, after a reset of the
+# store, or when the client fell behind by more than one chart window.
+# Cursors and cached results also carry the store's nonce: a recreated store
+# (replay.py) counts its head from 0 again.
+
+
+# Main chart ranges: 'live' streams the ring store, the others are served
+# from the long-term history (history.py), downsampled to HISTORY_POINTS
+HISTORY_RANGES = {'live': None, '1h': 3600, '24h': 86400, '7d': 7 * 86400, '30d': 30 * 86400}
+HISTORY_POINTS = 1000
+HISTORY_REFRESH = 10  # seconds between history chart refreshes when polling
+
+# Seconds a skid's status keeps counting for the tower light after its last
+# viewer went away
+STATUS_TTL = 30
+
+_stores = {}
+_aggregates = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(device_id):
+    # Read-only store per device, opened once per process and again when
+    # the file was recreated (replay.py)
+    with _stores_lock:
+        store = _stores.get(device_id)
+        if store is None or store.replaced():
+            store = _stores[device_id] = open_store(device_id, readonly=True)
+        return store
+
+
+def get_aggregates(device_id):
+    # Read-only rolling aggregates per device (aggregates.py), opened once
+    # and again when the file was recreated
+    with _stores_lock:
+        aggregates = _aggregates.get(device_id)
+        if aggregates is None or aggregates.replaced():
+            aggregates = _aggregates[device_id] = open_aggregates(device_id, readonly=True)
+        return aggregates
+
+
+def stats_table(device_id, now=None):
+    # Rolling statistics panel: one row per window, as published by the
+    # collector, so the cost does not depend on the window length
+    try:
+        rows, newest = get_aggregates(device_id).read()
+    except (OSError, ValueError, TornRead):
+        return html.Div("No statistics yet")
+    if not rows['count'].any():
+        return html.Div("No statistics yet")
+    # The collector ages the windows while no samples arrive; a window
+    # shorter than the time since the newest sample has nothing current
+    # even if the collector is not running to age it
+    age = max((time.time() if now is None else now) - newest, 0.0)
+    header = [html.Th('Window'), html.Th('Samples')] + [
+        html.Th(f"{channel_label(channel)} {stat}") for channel in CHANNELS for stat in ('min', 'max', 'mean', 'σ')]
+    body = []
+    for row in rows:
+        count = int(row['count']) if age < row['window'] else 0
+        cells = [html.Td(window_label(int(row['window']))), html.Td(count)]
+        for channel in CHANNELS:
+            for stat in ('min', 'max', 'mean', 'std'):
+                cells.append(html.Td(f"{row[f'{channel}_{stat}']:.3f}" if count else '-'))
+        body.append(html.Tr(cells))
+    caption = html.Caption(f"Newest sample {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(newest))}, "
+                           f"{age:.0f} s ago", style={'captionSide': 'bottom', 'fontSize': '12px'})
+    return html.Table([caption, html.Thead(html.Tr(header)), html.Tbody(body)],
+                      style={'width': '100%', 'textAlign': 'center', 'fontSize': '14px'})
+
+
+def device_options():
+    return [{'label': device_id, 'value': device_id} for device_id in list_devices()]
+
+
+class StageTimer:
+    # Splits one callback run into stages for dashboard_stage_seconds
+    def __init__(self):
+        self.start = self.last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        STAGE_SECONDS.labels(stage).observe(now - self.last)
+        self.last = now
+
+    def done(self, mode):
+        CALLBACK_SECONDS.labels(mode).observe(time.perf_counter() - self.start)
+
+
+def range_options():
+    return [{'label': key, 'value': key} for key in HISTORY_RANGES]
+
+
+def history_due(cursor, now):
+    at = (cursor or {}).get('at')
+    return at is None or now - at >= HISTORY_REFRESH
+
+
+def read_stream(store, cursor, window, device_id=None):
+    # Returns (data, new, head, full):
+    #   data - latest `window` records (for the fit and full figures)
+    #   new  - records the client has not seen yet
+    #   full - True when the client needs complete figures
+    # Raises ring_store.TornRead if no consistent snapshot could be taken.
+    data, head = store.snapshot(window)
+    cursor = cursor or {}
+    last = cursor.get('head')
+    full = (last is None or last > head or head - last >= window
+            or cursor.get('device') != device_id or cursor.get('store') != store.nonce)
+    if full:
+        new = data
+    else:
+        new = data[len(data) - (head - last):]
+    return data, new, head, full
+
+
+def extend_payload(new, pred_x, pred_y, window, compact=False):
+    # extendData for traces [pH, conductivity, prediction]. The prediction is
+    # a straight line, so it is sent as two points and capped at two, which
+    # replaces the previous line instead of growing it. Times match the full
+    # figure: epoch milliseconds when `compact`, else dates.
+    dates = epoch_ms if compact else to_datetime
+    times = dates(new['time'])
+    update = {
+        'x': [times, times, dates(pred_x)],
+        'y': [new['ph'], new['conductivity'], pred_y],
+    }
+    max_points = {'x': [window, window, 2], 'y': [window, window, 2]}
+    return [update, [0, 1, 2], max_points]
+
+
+def live_state(data, alert_status, alert_message, forecast):
+    # Compact record the browser renders the gauges and popup from
+    return {
+        'time': float(data['time'][-1]),
+        'ph': round(float(data['ph'][-1]), 3),
+        'conductivity': round(float(data['conductivity'][-1]), 2),
+        'status': alert_status,
+        'message': alert_message,
+        'forecast': forecast,
+    }
+
+
+class LiveChart:
+    # The main chart pipeline shared by the dashboards: per-skid trend
+    # prediction and alert status, full figures, streaming extends and the
+    # history ranges. Each result is computed once per new sample by the
+    # first client (or worker) to ask and reused by the rest.
+    #
+    # `template` is the figures.FigureTemplate with traces [pH,
+    # conductivity, prediction]; `horizon` is the prediction line as (from,
+    # to) seconds after the newest sample; `namespace` names the result
+    # cache. `compact` and `push` follow the dashboard's COMPACT_PAYLOADS
+    # and PUSH_UPDATES settings. `watching`, if set, returns the skids with
+    # push subscribers (push.PushHub.devices).
+
+    def __init__(self, namespace, template, window, horizon, set_tower_light, compact=True, push=True,
+                 trend_forgetting=1.0):
+        self.template = template
+        self.window = window
+        self.horizon = horizon
+        self.compact = compact
+        self.push = push
+        self.trend_forgetting = trend_forgetting
+        self.trends = {}
+
+        # One worker owns the tower light pins for every client; it shows
+        # the worst status of all skids being watched. A skid drops out
+        # STATUS_TTL after its last poll, unless it has push subscribers.
+        self.tower_light = TowerLightActuator(set_tower_light)
+        self.skid_status = {}  # device_id -> (status, monotonic time last watched)
+        self.watching = None
+        self._status_lock = threading.Lock()
+        self._expiry = None
+
+        # Same rules as the collector, for the popup text and the critical limit
+        self.alert_rules = AlertEngine()
+        self.results = ResultCache(namespace)
+
+    def get_trend(self, device_id):
+        # Streaming pH trend over the chart window, shared by all clients
+        trend = self.trends.get(device_id)
+        if trend is None:
+            trend = self.trends.setdefault(device_id, StoreTrend('ph', window=self.window,
+                                                                 forgetting=self.trend_forgetting))
+        return trend
+
+    def load_data(self, device_id):
+        try:
+            return get_store(device_id).snapshot(self.window)[0]
+        except (OSError, ValueError, TornRead) as e:
+            print(f"Error loading data: {e}")
+            return []
+
+    def build_figure(self, times, ph_values, conductivity_values, future, pred):
+        return self.template.render(*chart_columns(times, ph_values, conductivity_values, future, pred,
+                                                   compact=self.compact))
+
+    def history_figure(self, device_id, start, end):
+        cols, level = query(device_id, start, end, HISTORY_POINTS)
+        return self.build_figure(cols['time'], cols['ph'], cols['conductivity'], [], [])
+
+    def compute_tick(self, device_id, store, head, data, alert):
+        # Trend prediction and alert status for the latest data of one skid
+        times = data['time']
+
+        # Alerts are evaluated per sample by the collector (alerts.py)
+        level, rule = alert
+        alert_status = STATUSES[level]
+        alert_message = self.alert_rules.message(level, rule)
+        threshold_critical = self.alert_rules.limit('ph')
+
+        future = []
+        pred = []
+        forecast = {'max': None, 'crossing': None}
+        trend = self.get_trend(device_id)
+        fit = trend.update(store, head)
+        if len(times) > 10 and fit is not None:
+            slope, intercept = fit
+            # Straight-line prediction, sent as its two ends; its max is at one of them
+            future = times[-1] + np.array(self.horizon, dtype=np.float64)
+            pred = slope * future + intercept
+
+            crossing = None
+            if threshold_critical is not None:
+                crossing = trend.estimator.crossing_time(threshold_critical, times[-1])
+            forecast = {
+                'max': round(float(max(pred)), 3),
+                'crossing': None if crossing is None else round(float(crossing - times[-1]), 1),
+            }
+
+        return alert_status, alert_message, future, pred, forecast
+
+    def evaluate(self, device_id, store, head, data):
+        # The collector publishes the alert after the samples, so it is part of the key
+        alert = store.alert
+        result = self.results.get(('tick', device_id, store.nonce, head, alert),
+                                  lambda: self.compute_tick(device_id, store, head, data, alert), shared=True)
+        with self._status_lock:
+            self.skid_status[device_id] = (result[0], time.monotonic())
+        self.show_status()
+        return result
+
+    def touch(self, device_id):
+        # A client looked at the skid without anything new to evaluate
+        with self._status_lock:
+            if device_id in self.skid_status:
+                self.skid_status[device_id] = (self.skid_status[device_id][0], time.monotonic())
+
+    def show_status(self):
+        # Hand the worst status of the watched skids to the GPIO worker; it
+        # only writes on transitions
+        now = time.monotonic()
+        watched = set(self.watching()) if self.watching is not None else set()
+        with self._status_lock:
+            for device_id, (status, seen) in list(self.skid_status.items()):
+                if device_id in watched:
+                    self.skid_status[device_id] = (status, now)
+                elif now - seen > STATUS_TTL:
+                    del self.skid_status[device_id]
+            statuses = [status for status, _ in self.skid_status.values()]
+            if self._expiry is None:
+                self._expiry = threading.Thread(target=self._expire, name='status-expiry', daemon=True)
+                self._expiry.start()
+        self.tower_light.request(worst_status(statuses))
+
+    def _expire(self):
+        # Drops skids nobody watches any more, also when no callbacks come
+        while True:
+            time.sleep(STATUS_TTL / 3)
+            try:
+                self.show_status()
+            except Exception as e:
+                print(f"Tower light status update failed: {e}")
+
+    def push_update(self, device_id, store, new, data, prev, head):
+        # push.PushHub compute: once per new sample, sent to every push client
+        alert_status, alert_message, future, pred, forecast = self.evaluate(device_id, store, head, data)
+        return {
+            'extend': extend_payload(new, future, pred, self.window, self.compact),
+            'state': live_state(data, alert_status, alert_message, forecast),
+        }
+
+    def update(self, device_id, range_key, cursor):
+        # Outputs (figure, extendData, live state, cursor) for a client tick
+        if self.push or (cursor and cursor.get('range') != range_key):
+            # Push mode only calls this on page load, skid or range change
+            # and resync; push does the rest
+            cursor = None
+        timer = StageTimer()
+        try:
+            store = get_store(device_id)
+            data, new, head, full = read_stream(store, cursor, self.window, device_id)
+        except TornRead:
+            # Writer kept the store busy: keep what is shown, retry next tick
+            raise PreventUpdate
+        except (OSError, ValueError) as e:
+            print(f"Error loading data: {e}")
+            data = []
+        if len(data) == 0:
+            return EMPTY_FIGURE, no_update, None, None
+
+        # Nothing new since this client's last tick
+        if not full and len(new) == 0:
+            self.touch(device_id)
+            raise PreventUpdate
+
+        times = data['time']
+        timer.mark('read')
+
+        alert_status, alert_message, future, pred, forecast = self.evaluate(device_id, store, head, data)
+        state = live_state(data, alert_status, alert_message, forecast)
+        timer.mark('trend')
+        new_cursor = {'head': head, 'device': device_id, 'range': range_key, 'store': store.nonce}
+
+        # Longer ranges come from the history, downsampled, instead of streaming
+        span = HISTORY_RANGES.get(range_key)
+        fig_history = no_update
+        if span:
+            now = time.time()
+            new_cursor['at'] = (cursor or {}).get('at')
+            if full or history_due(cursor, now):
+                # Shared by every client within the same refresh period
+                fig_history = self.results.get(
+                    ('history', device_id, store.nonce, range_key, int(times[-1] // HISTORY_REFRESH),
+                     self.compact),
+                    lambda: self.history_figure(device_id, times[-1] - span, times[-1]), shared=True)
+                new_cursor['at'] = now
+            timer.mark('history')
+
+        if full:
+            if span:
+                figure = fig_history
+            else:
+                figure = self.results.get(
+                    ('figure', device_id, store.nonce, head, self.compact),
+                    lambda: self.build_figure(times, data['ph'], data['conductivity'], future, pred), shared=True)
+            timer.mark('figure')
+            timer.done('full')
+            return figure, no_update, state, new_cursor
+
+        # Streaming tick: only the new points and the live state
+        if span:
+            extend = no_update
+        else:
+            extend = self.results.get(('extend', device_id, store.nonce, cursor['head'], head, self.compact),
+                                      lambda: extend_payload(new, future, pred, self.window, self.compact))
+        timer.mark('figure')
+        timer.done('stream')
+        return fig_history, extend, state, new_cursor
+
+    def warm_up(self):
+        # Catch the trends up before the first browser connects
+        for device_id in list_devices():
+            try:
+                self.get_trend(device_id).update(get_store(device_id))
+            except (OSError, ValueError):
+                pass
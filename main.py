@@ -1,9 +1,15 @@
 from dash import Dash, dcc, html
-from dash.dependencies import Output, Input
+from dash.dependencies import Output, Input, State, ClientsideFunction
 import plotly.graph_objs as go
-import json
-import numpy as np
-import threading
+from ring_store import DEFAULT_DEVICE
+from live_view import LiveChart, device_options, stats_table, range_options
+from push import PushHub
+from calibration import channel_label, channel_title
+from figures import FigureTemplate, cached_figure
+from payload import register_compression
+import launch
+import metrics
+import history_api
 
 # --- GPIO Setup ---
 try:
@@ -35,6 +41,95 @@ except ImportError:
 
 app = Dash(__name__)
 
+# Push updates to the browsers over SSE as samples arrive (see push.py);
+# False falls back to polling every second
+PUSH_UPDATES = True
+
+ALERT_STATUSES = ('normal', 'warning', 'critical')
+
+STATS_REFRESH = 5000  # ms between rolling statistics panel refreshes
+
+# Full charts as typed arrays within a byte budget, and gzipped responses
+# (see payload.py); False sends plain JSON number and date lists
+COMPACT_PAYLOADS = True
+
+
+# Gauges are sent once with the layout and then updated in the browser from
+# the live-state record (assets/live_state.js)
+def build_pressure_gauge(value):
+    fig = go.Figure(go.Indicator(
+        mode="gauge+number",
+        value=value,
+        gauge={
+            'axis': {'range': [900, 1040], 'tickwidth': 2, 'tickcolor':"blue"},
+            'bar': {'color': "blue"},
+            'bgcolor': 'white',
+            'borderwidth': 2,
+            'bordercolor': "blue",
+            'steps': [
+                {'range': [900, 970], 'color': 'lightblue'},
+                {'range': [970, 1010], 'color': 'deepskyblue'},
+                {'range': [1010, 1040], 'color': 'dodgerblue'}
+            ],
+            'threshold': {
+                'line': {'color': "red", 'width': 4},
+                'thickness': 0.75,
+                'value': value
+            }
+        },
+        title={'text': "PH value", 'font': {'color': 'blue', 'size': 18}}
+    ))
+    fig.update_layout(paper_bgcolor='white', margin=dict(t=0, b=0, l=0, r=0))
+    return fig
+
+
+def build_temperature_gauge(value, title):
+    fig = go.Figure(go.Indicator(
+        mode="gauge+number",
+        value=value,
+        gauge={
+            'axis': {'range': [25, 100], 'tickwidth': 2, 'tickcolor': "goldenrod"},
+            'bar': {'color': "goldenrod"},
+            'bgcolor': 'white',
+            'borderwidth': 2,
+            'bordercolor': "goldenrod",
+            'steps': [
+                {'range': [25, 50], 'color': 'khaki'},
+                {'range': [50, 80], 'color': 'gold'},
+                {'range': [80, 100], 'color': 'darkorange'}
+            ],
+            'threshold': {
+                'line': {'color': "red", 'width': 4},
+                'thickness': 0.75,
+                'value': value
+            }
+        },
+        title={'text': title, 'font': {'color': 'goldenrod', 'size': 18}}
+    ))
+    fig.update_layout(paper_bgcolor='white', margin=dict(t=0, b=0, l=0, r=0))
+    return fig
+
+
+def popup_style_for(alert_status):
+    if alert_status in ['warning', 'critical']:
+        return {
+            'position': 'fixed',
+            'top': '20px',
+            'right': '20px',
+            'backgroundColor': 'rgba(255,0,0,0.85)',
+            'color': 'white',
+            'padding': '15px 25px',
+            'borderRadius': '8px',
+            'fontWeight': 'bold',
+            'fontSize': '16px',
+            'zIndex': 9999,
+            'display': 'block',
+            'boxShadow': '0 4px 15px rgba(255,0,0,0.5)',
+            'userSelect': 'none'
+        }
+    return {'display': 'none'}
+
+
 app.layout = html.Div([
     html.H1(
         "The Smart Chemical Injection System",
@@ -50,6 +145,24 @@ app.layout = html.Div([
         }
     ),
 
+    # Skid selector, overlaid on the header
+    dcc.Dropdown(
+        id='skid-select',
+        options=device_options(),
+        value=DEFAULT_DEVICE,
+        clearable=False,
+        style={'position': 'absolute', 'top': '2vh', 'left': '20px', 'width': '180px'}
+    ),
+
+    # Main chart time range, overlaid on the header
+    dcc.RadioItems(
+        id='range-select',
+        options=range_options(),
+        value='live',
+        inline=True,
+        style={'position': 'absolute', 'top': '3vh', 'right': '20px', 'color': 'white'}
+    ),
+
     html.Div([
         html.Div([
             dcc.Graph(
@@ -80,6 +193,7 @@ app.layout = html.Div([
                 html.H4("Current Pressure", style={'color': 'blue', 'textAlign': 'center', 'marginBottom': '12px', 'userSelect': 'none'}),
                 dcc.Graph(
                     id='pressure-gauge',
+                    figure=cached_figure('main-ph-gauge', build_pressure_gauge, None),
                     style={'height': '100%', 'width': '100%', 'cursor':'default'},
                     config={'displayModeBar': False, 'staticPlot': True}
                 )
@@ -98,9 +212,11 @@ app.layout = html.Div([
             }),
 
             html.Div([
-                html.H4("Current Temperature", style={'color':'goldenrod', 'textAlign': 'center', 'marginBottom': '12px', 'userSelect': 'none'}),
+                html.H4(f"Current {channel_label('conductivity')}", style={'color':'goldenrod', 'textAlign': 'center', 'marginBottom': '12px', 'userSelect': 'none'}),
                 dcc.Graph(
                     id='temperature-gauge',
+                    figure=cached_figure('main-cond-gauge', build_temperature_gauge, None,
+                                         channel_title('conductivity')),
                     style={'height': '100%', 'width': '100%', 'cursor':'default'},
                     config={'displayModeBar': False, 'staticPlot': True}
                 )
@@ -116,6 +232,22 @@ app.layout = html.Div([
                 'flexDirection': 'column',
                 'userSelect': 'none'
             }),
+
+            html.Div([
+                html.H4("Rolling Statistics", style={'color': 'blue', 'textAlign': 'center', 'marginBottom': '12px', 'userSelect': 'none'}),
+                html.Div(id='stats-panel')
+            ], style={
+                'backgroundColor': 'white',
+                'padding': '15px',
+                'borderRadius': '10px',
+                'boxShadow': '0 4px 8px rgba(0,0,0,0.1)',
+                'marginLeft': '10px',
+                'height': '100%',
+                'boxSizing': 'border-box',
+                'flex': '1',
+                'overflow': 'auto',
+                'userSelect': 'none'
+            }),
         ], style={
             'display': 'flex',
             'flex': '1',
@@ -151,7 +283,14 @@ app.layout = html.Div([
         }
     ),
 
-    dcc.Interval(id='interval-component', interval=1000, n_intervals=0)
+    dcc.Store(id='stream-cursor'),
+    dcc.Store(id='live-state'),
+    dcc.Store(id='popup-styles', data={status: popup_style_for(status) for status in ALERT_STATUSES}),
+    dcc.Store(id='push-update'),
+    html.Div(id='push-status', style={'display': 'none'}),
+    dcc.Interval(id='interval-component', interval=1000, n_intervals=0, disabled=PUSH_UPDATES),
+    dcc.Interval(id='skid-refresh', interval=10000, n_intervals=0),
+    dcc.Interval(id='stats-refresh', interval=STATS_REFRESH, n_intervals=0)
 ], style={
     'margin': '0',
     'padding': '0',
@@ -162,40 +301,16 @@ app.layout = html.Div([
 })
 
 
-def load_data():
-    try:
-        with open('sensor_data.json') as f:
-            data = json.load(f)
-        return data
-    except Exception as e:
-        print(f"Error loading data: {e}")
-        return []
-
+PLOT_POINTS = 200  # points shown on the main chart
 
-def gpio_control_thread(status):
-    set_tower_light(status)
+# Set < 1 to weight recent samples more in the streaming pH trend
+TREND_FORGETTING = 1.0
 
 
-@app.callback(
-    Output('pressure-temp-graph', 'figure'),
-    Output('pressure-gauge', 'figure'),
-    Output('temperature-gauge', 'figure'),
-    Output('warning-popup', 'children'),
-    Output('warning-popup', 'style'),
-    Input('interval-component', 'n_intervals')
-)
-def update_graph_live(n):
-    data = load_data()
-    if not data:
-        empty_fig = go.Figure()
-        return empty_fig, empty_fig, empty_fig, "", {'display': 'none'}
-
-    times = np.array([d['time'] for d in data])
-    pressures = np.array([d['ph'] for d in data])
-    temperatures = np.array([d['contectivity'] for d in data])
-
+# Trace styles and layout are validated once (and cached across restarts);
+# each tick only fills in the arrays
+def graph_template(conductivity_label, conductivity_title):
     trace_pressure = go.Scatter(
-        x=times, y=pressures,
         mode='lines+markers',
         name='PH value',
         line=dict(color='blue'),
@@ -204,48 +319,24 @@ def update_graph_live(n):
     )
 
     trace_temperature = go.Scatter(
-        x=times, y=temperatures,
         mode='lines+markers',
-        name='Contectivity (Ohm)',
+        name=conductivity_label,
         yaxis='y2',
         line=dict(color='goldenrod'),
         marker=dict(color='goldenrod'),
         hoverinfo='skip'
     )
 
-    data_traces = [trace_pressure, trace_temperature]
-
-    threshold_warning = 7 # can be change
-    threshold_critical = 10 # can be change
-
-    alert_status = 'normal'
-    alert_message = ""
-
-    if len(times) > 10:
-        coeffs = np.polyfit(times, pressures, 1)
-        slope, intercept = coeffs
-        future_times = np.arange(times[-1] + 1, times[-1] + 121)
-        preds = slope * future_times + intercept
-        trace_pred = go.Scatter(
-            x=future_times, y=preds,
-            mode='lines',
-            name='Predicted PH Value',
-            line=dict(color='red', dash='dot'),
-            hoverinfo='skip'
-        )
-        data_traces.append(trace_pred)
-
-        max_pred_pressure = max(preds)
-        if max_pred_pressure > threshold_critical:
-            alert_status = 'critical'
-            alert_message = "⚠️ CRITICAL ALERT: The predicted PH value reaches the critical level"
-        elif max_pred_pressure > threshold_warning:
-            alert_status = 'warning'
-            alert_message = "⚠️ Warning: PH values approaching critical levels."
+    trace_pred = go.Scatter(
+        mode='lines',
+        name='Predicted PH Value',
+        line=dict(color='red', dash='dot'),
+        hoverinfo='skip'
+    )
 
     layout = go.Layout(
         title='Sensor Data',
-        xaxis=dict(title='Time (seconds)', showgrid=True, zeroline=False),
+        xaxis=dict(title='Time', type='date', showgrid=True, zeroline=False),
         yaxis=dict(
             title='PH Value',
             color='blue',
@@ -254,7 +345,7 @@ def update_graph_live(n):
             showgrid=True
         ),
         yaxis2=dict(
-            title='Contectivity ( Ohm)',
+            title=conductivity_title,
             overlaying='y',
             side='right',
             color='goldenrod',
@@ -270,79 +361,100 @@ def update_graph_live(n):
         dragmode=False,
     )
 
-    fig_graph = go.Figure(data=data_traces, layout=layout)
+    return go.Figure(data=[trace_pressure, trace_temperature, trace_pred], layout=layout)
 
-    fig_pressure_gauge = go.Figure(go.Indicator(
-        mode="gauge+number",
-        value=pressures[-1],
-        gauge={
-            'axis': {'range': [900, 1040], 'tickwidth': 2, 'tickcolor':"blue"},
-            'bar': {'color': "blue"},
-            'bgcolor': 'white',
-            'borderwidth': 2,
-            'bordercolor': "blue",
-            'steps': [
-                {'range': [900, 970], 'color': 'lightblue'},
-                {'range': [970, 1010], 'color': 'deepskyblue'},
-                {'range': [1010, 1040], 'color': 'dodgerblue'}
-            ],
-            'threshold': {
-                'line': {'color': "red", 'width': 4},
-                'thickness': 0.75,
-                'value': pressures[-1]
-            }
-        },
-        title={'text': "PH value", 'font': {'color': 'blue', 'size': 18}}
-    ))
-    fig_pressure_gauge.update_layout(paper_bgcolor='white', margin=dict(t=0, b=0, l=0, r=0))
 
-    fig_temperature_gauge = go.Figure(go.Indicator(
-        mode="gauge+number",
-        value=temperatures[-1],
-        gauge={
-            'axis': {'range': [25, 100], 'tickwidth': 2, 'tickcolor': "goldenrod"},
-            'bar': {'color': "goldenrod"},
-            'bgcolor': 'white',
-            'borderwidth': 2,
-            'bordercolor': "goldenrod",
-            'steps': [
-                {'range': [25, 50], 'color': 'khaki'},
-                {'range': [50, 80], 'color': 'gold'},
-                {'range': [80, 100], 'color': 'darkorange'}
-            ],
-            'threshold': {
-                'line': {'color': "red", 'width': 4},
-                'thickness': 0.75,
-                'value': temperatures[-1]
-            }
-        },
-        title={'text': "Temperature (°C)", 'font': {'color': 'goldenrod', 'size': 18}}
-    ))
-    fig_temperature_gauge.update_layout(paper_bgcolor='white', margin=dict(t=0, b=0, l=0, r=0))
+GRAPH_TEMPLATE = FigureTemplate(cached_figure('main-graph', graph_template, channel_label('conductivity'),
+                                             channel_title('conductivity')))
 
-    threading.Thread(target=gpio_control_thread, args=(alert_status,), daemon=True).start()
 
-    if alert_status in ['warning', 'critical']:
-        popup_style = {
-            'position': 'fixed',
-            'top': '20px',
-            'right': '20px',
-            'backgroundColor': 'rgba(255,0,0,0.85)',
-            'color': 'white',
-            'padding': '15px 25px',
-            'borderRadius': '8px',
-            'fontWeight': 'bold',
-            'fontSize': '16px',
-            'zIndex': 9999,
-            'display': 'block',
-            'boxShadow': '0 4px 15px rgba(255,0,0,0.5)',
-            'userSelect': 'none'
-        }
-    else:
-        popup_style = {'display': 'none'}
+# Trend, alert status, figures and history per new sample (live_view.py);
+# the prediction line covers the next 120 s
+live = LiveChart('main', GRAPH_TEMPLATE, PLOT_POINTS, (1, 120), set_tower_light,
+                 compact=COMPACT_PAYLOADS, push=PUSH_UPDATES, trend_forgetting=TREND_FORGETTING)
+
 
-    return fig_graph, fig_pressure_gauge, fig_temperature_gauge, alert_message, popup_style
+@app.callback(
+    Output('pressure-temp-graph', 'figure'),
+    Output('pressure-temp-graph', 'extendData'),
+    Output('live-state', 'data'),
+    Output('stream-cursor', 'data'),
+    Input('interval-component', 'n_intervals'),
+    Input('skid-select', 'value'),
+    Input('range-select', 'value'),
+    State('stream-cursor', 'data')
+)
+def update_graph_live(n, device_id, range_key, cursor):
+    return live.update(device_id, range_key, cursor)
+
+
+app.clientside_callback(
+    ClientsideFunction(namespace='live', function_name='render_gauges'),
+    Output('pressure-gauge', 'figure'),
+    Output('temperature-gauge', 'figure'),
+    Input('live-state', 'data'),
+    State('pressure-gauge', 'figure'),
+    State('temperature-gauge', 'figure')
+)
+
+app.clientside_callback(
+    ClientsideFunction(namespace='live', function_name='render_popup'),
+    Output('warning-popup', 'children'),
+    Output('warning-popup', 'style'),
+    Input('live-state', 'data'),
+    State('popup-styles', 'data')
+)
+
+
+# Prometheus-style metrics for scraping at /metrics
+metrics.register_flask(app.server)
+
+# Time-range queries and exports over the history at /api/history/<skid>
+history_api.register(app.server)
+
+if COMPACT_PAYLOADS:
+    register_compression(app.server)
+
+if PUSH_UPDATES:
+    push_hub = PushHub(live.push_update, PLOT_POINTS)
+    push_hub.register(app.server)
+    live.watching = push_hub.devices
+
+    app.clientside_callback(
+        ClientsideFunction(namespace='push', function_name='connect'),
+        Output('push-status', 'children'),
+        Input('skid-select', 'value')
+    )
+
+    app.clientside_callback(
+        ClientsideFunction(namespace='push', function_name='apply'),
+        Output('pressure-temp-graph', 'extendData', allow_duplicate=True),
+        Output('live-state', 'data', allow_duplicate=True),
+        Output('stream-cursor', 'data', allow_duplicate=True),
+        Input('push-update', 'data'),
+        State('stream-cursor', 'data'),
+        prevent_initial_call=True
+    )
+
+
+@app.callback(
+    Output('skid-select', 'options'),
+    Input('skid-refresh', 'n_intervals')
+)
+def refresh_skids(n):
+    return device_options()
+
+
+@app.callback(
+    Output('stats-panel', 'children'),
+    Input('stats-refresh', 'n_intervals'),
+    Input('skid-select', 'value')
+)
+def refresh_stats(n, device_id):
+    # Rolling aggregates are maintained by the collector; this only reads them
+    return stats_table(device_id)
 
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0')
+    # Development server with reloader: DASHBOARD_DEBUG=1 python main.py
+    launch.run(app, warm=live.warm_up)
@@ -0,0 +1,110 @@
+import base64
+import gzip
+import numpy as np
+from history import lttb
+import metrics
+
+# Compact callback payloads for low-bandwidth clients (HMI tablets on plant
+# Wi-Fi):
+#
+#   - chart series are sent as typed arrays, {'dtype': 'f4', 'bdata': <base64>},
+#     which plotly.js (2.28+) decodes directly instead of parsing number
+#     lists; times go as float64 epoch milliseconds, which a date axis takes
+#     as is, instead of ISO date strings
+#   - a full chart is thinned with LTTB to stay within a byte budget
+#   - JSON responses are gzipped when the client accepts it
+#
+# Streaming extendData ticks keep plain lists: they carry a point or two,
+# and Plotly.extendTraces does not decode typed-array specs. Their times are
+# epoch milliseconds too (live_view.extend_payload), so the traces they
+# extend hold one kind of x value. The chart templates set the x axis type
+# to 'date', which plotly.js would otherwise not infer from numbers.
+
+PAYLOAD_BUDGET = 32 * 1024   # bytes of series data per full chart
+COMPRESS_MIN_BYTES = 1024    # smaller responses are sent as they are
+COMPRESS_LEVEL = 5
+
+THINNED = metrics.counter('dashboard_payload_thinned_total', 'Charts thinned to fit the payload budget')
+COMPRESSED_BYTES = metrics.counter('dashboard_compressed_bytes_total', 'Response bytes before and after gzip',
+                                   ['stage'])
+
+
+def to_datetime(times):
+    # Store times are epoch seconds; a Plotly time axis wants dates
+    return (np.asarray(times, dtype=np.float64) * 1000).astype('datetime64[ms]')
+
+
+def epoch_ms(times):
+    # Store times as the epoch milliseconds a date axis ('type': 'date') takes
+    return np.asarray(times, dtype=np.float64) * 1000.0
+
+
+def typed_array(values, dtype='f4'):
+    array = np.ascontiguousarray(values, dtype='<' + dtype)
+    return {'dtype': dtype, 'bdata': base64.b64encode(array.tobytes()).decode('ascii')}
+
+
+def time_array(times):
+    # Epoch seconds as epoch milliseconds for a Plotly date axis
+    return typed_array(epoch_ms(times), 'f8')
+
+
+def _base64_size(nbytes):
+    return 4 * -(-nbytes // 3)
+
+
+def _encoded_size(points, series):
+    # Bytes of base64 for `points` points: an f8 time and an f4 value array per series
+    return series * (_base64_size(8 * points) + _base64_size(4 * points))
+
+
+def fit_budget(times, series, budget=PAYLOAD_BUDGET):
+    # Thins (times, [y, ...]) so that, as typed arrays with one time array
+    # per series, it fits in `budget` bytes; points are picked on the shape
+    # of the first series
+    max_points = int(budget // (len(series) * (8 + 4) * 4 / 3))
+    while max_points > 0 and _encoded_size(max_points, len(series)) > budget:
+        # base64 pads every array to whole 4-character groups
+        max_points -= 1
+    if len(times) <= max_points:
+        return times, series
+    THINNED.inc()
+    times = np.asarray(times, dtype=np.float64)
+    keep = lttb(times - times[0], np.asarray(series[0], dtype=np.float64), max_points)
+    return times[keep], [np.asarray(values)[keep] for values in series]
+
+
+def chart_columns(times, ph_values, conductivity_values, future, pred, compact=True, budget=PAYLOAD_BUDGET):
+    # (x, y) per trace [pH, conductivity, prediction] for FigureTemplate.render
+    if not compact:
+        x, future_x = to_datetime(times), to_datetime(future)
+        return (x, ph_values), (x, conductivity_values), (future_x, pred)
+    times, (ph_values, conductivity_values) = fit_budget(times, [ph_values, conductivity_values], budget)
+    x = time_array(times)
+    return ((x, typed_array(ph_values)), (x, typed_array(conductivity_values)),
+            (time_array(future), typed_array(pred)))
+
+
+def register_compression(server):
+    # gzip JSON responses (callbacks, layout) for clients that accept it.
+    # Streamed responses (push events, history exports) are left alone.
+    from flask import request
+
+    @server.after_request
+    def _compress(response):
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or response.mimetype != 'application/json'
+                or 'Content-Encoding' in response.headers
+                or 'gzip' not in request.headers.get('Accept-Encoding', '')):
+            return response
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_BYTES:
+            return response
+        packed = gzip.compress(body, COMPRESS_LEVEL)
+        COMPRESSED_BYTES.labels('raw').inc(len(body))
+        COMPRESSED_BYTES.labels('gzip').inc(len(packed))
+        response.set_data(packed)
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Content-Length'] = str(len(packed))
+        response.vary.add('Accept-Encoding')
+        return response
@@ -0,0 +1,143 @@
+import json
+import queue
+import threading
+import time
+from flask import Response, abort
+from plotly.utils import PlotlyJSONEncoder
+from ring_store import TornRead
+from live_view import get_store
+import metrics
+
+# Server push for the dashboards: one producer thread per process watches
+# the stores, computes each update once when new samples arrive and fans the
+# same serialized event out to every browser subscribed to that skid over
+# Server-Sent Events. Server work per sample does not depend on the number
+# of viewers.
+
+POLL_INTERVAL = 0.05   # seconds between store head checks
+KEEPALIVE = 15         # seconds between SSE comments on an idle stream
+QUEUE_SIZE = 256       # events buffered per client before it is reset
+
+COMPUTE_SECONDS = metrics.histogram('push_compute_seconds', 'Time to build and serialize one push event')
+EVENTS = metrics.counter('push_events_total', 'Push events produced')
+CLIENTS = metrics.gauge('push_clients', 'Connected push clients')
+RESETS = metrics.counter('push_client_resets_total', 'Clients told to resync after falling behind')
+
+
+class PushHub:
+    def __init__(self, compute, window, poll_interval=POLL_INTERVAL):
+        # compute(device_id, store, new, data, prev, head) -> JSON-able dict
+        self.compute = compute
+        self.window = window
+        self.poll_interval = poll_interval
+        self._subscribers = {}   # device_id -> set of queues
+        self._heads = {}         # device_id -> (store nonce, last head pushed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='push-hub', daemon=True)
+                self._thread.start()
+
+    def subscribe(self, device_id):
+        self.start()
+        q = queue.Queue(QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(device_id, set()).add(q)
+        CLIENTS.inc()
+        return q
+
+    def unsubscribe(self, device_id, q):
+        with self._lock:
+            subs = self._subscribers.get(device_id)
+            if subs is not None and q in subs:
+                subs.discard(q)
+                CLIENTS.inc(-1)
+                if not subs:
+                    del self._subscribers[device_id]
+                    self._heads.pop(device_id, None)
+
+    def devices(self):
+        # Skids with at least one subscriber
+        with self._lock:
+            return list(self._subscribers)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                devices = list(self._subscribers)
+            for device_id in devices:
+                try:
+                    self._poll(device_id)
+                except Exception as e:
+                    print(f"Push update for {device_id} failed: {e}")
+            time.sleep(self.poll_interval)
+
+    def _poll(self, device_id):
+        store = get_store(device_id)
+        try:
+            data, head = store.snapshot(self.window)
+        except TornRead:
+            return  # writer busy, try again on the next poll
+        nonce, prev = self._heads.get(device_id, (None, None))
+        if prev == head and nonce == store.nonce:
+            return
+        self._heads[device_id] = (store.nonce, head)
+        if prev is None:
+            return  # clients got a full figure when they connected
+
+        started = time.perf_counter()
+        if nonce != store.nonce or prev > head or head - prev >= self.window:
+            event = {'device': device_id, 'reset': True}
+        else:
+            new = data[len(data) - (head - prev):]
+            event = self.compute(device_id, store, new, data, prev, head)
+            event.update(device=device_id, prev=prev, head=head)
+        message = json.dumps(event, cls=PlotlyJSONEncoder)
+        COMPUTE_SECONDS.observe(time.perf_counter() - started)
+        EVENTS.inc()
+        self.publish(device_id, message)
+
+    def publish(self, device_id, message):
+        with self._lock:
+            subs = list(self._subscribers.get(device_id, ()))
+        for q in subs:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                # Client is not keeping up: drop its backlog, make it resync
+                RESETS.inc()
+                while not q.empty():
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        break
+                q.put_nowait(json.dumps({'device': device_id, 'reset': True}))
+
+    def register(self, server, route='/stream/<device_id>'):
+        def stream(device_id):
+            try:
+                get_store(device_id)
+            except (OSError, ValueError):
+                abort(404)
+            q = self.subscribe(device_id)
+
+            def events():
+                try:
+                    yield 'retry: 2000\n\n'
+                    while True:
+                        try:
+                            message = q.get(timeout=KEEPALIVE)
+                        except queue.Empty:
+                            yield ': keepalive\n\n'
+                            continue
+                        yield 'data: ' + message + '\n\n'
+                finally:
+                    self.unsubscribe(device_id, q)
+
+            return Response(events(), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+        server.add_url_rule(route, 'push_stream', stream)
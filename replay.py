@@ -0,0 +1,325 @@
+import argparse
+import json
+import os
+import shutil
+import struct
+import time
+import numpy as np
+from ring_store import open_store, store_path, DEFAULT_CAPACITY, RECORD_DTYPE
+from history import HistoryWriter, history_dir, iter_raw
+from alerts import AlertEngine, load_rules, STATUSES
+from aggregates import AggregateSink, aggregate_path
+from serial_reader import SerialReader
+from calibration import load_calibration, MODEL_VERSION
+
+# Replays a recorded session through the live pipeline (ring store, alert
+# rules, rolling aggregates, history) into a scratch device the dashboards
+# can select, at 1x, 100x or maximum speed:
+#
+#   python replay.py capture sessions/skid1.cap --speed 100
+#   python replay.py history skid1 --start 1717200000 --speed max --rules alerts.json
+#
+# Sources:
+#   capture  raw serial bytes recorded by the collector ("capture" in
+#            skids.json), fed through a SerialReader so parsing, framing and
+#            calibration run exactly as they did live
+#   plain    a raw text capture without timestamps (e.g. `cat /dev/ttyACM0`),
+#            one line every 1/--rate seconds from --start (default: the
+#            file's modification time)
+#   history  calibrated samples from a device's history archive, in
+#            batches of --batch samples
+#
+# Sample times come from the recording, never from the host clock, and the
+# batches are fixed by the data, so the store contents and the alert
+# transitions are the same at any speed. Speed only sets how long to wait
+# between batches.
+#
+# The target is wiped first, so it must be a replay-* device other than the
+# source and not one of the collector's skids.
+
+CAPTURE_MAGIC = b'CISCAP1\n'
+# Per chunk: arrival time (epoch seconds), byte count, then the bytes
+CHUNK_HEADER = struct.Struct('<dI')
+
+DEFAULT_BAUDRATE = 9600
+
+TARGET_PREFIX = 'replay-'
+SKIDS_FILE = 'skids.json'  # the collector's device list (collector.CONFIG_FILE)
+
+
+class CaptureWriter:
+    # Appends (arrival time, chunk) records to a capture file
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(CAPTURE_MAGIC)
+
+    def write(self, wall_time, chunk):
+        self._file.write(CHUNK_HEADER.pack(wall_time, len(chunk)) + chunk)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def read_capture(path):
+    # Yields (arrival time, chunk); a partly written last chunk is ignored
+    with open(path, 'rb') as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not a serial capture")
+        while True:
+            header = f.read(CHUNK_HEADER.size)
+            if len(header) < CHUNK_HEADER.size:
+                return
+            wall_time, length = CHUNK_HEADER.unpack(header)
+            chunk = f.read(length)
+            if len(chunk) < length:
+                return
+            yield wall_time, chunk
+
+
+def read_plain(path, rate=1.0, start=0.0):
+    # Yields (time, line) for a text capture, evenly spaced at `rate` lines/s
+    with open(path, 'rb') as f:
+        for i, line in enumerate(f):
+            yield start + i / rate, line
+
+
+def read_history(device_id, start=None, end=None, batch=1):
+    # Yields record arrays of `batch` samples from the long-term history,
+    # streamed one archive chunk at a time so any range fits in memory
+    carry = np.empty(0, dtype=RECORD_DTYPE)
+    for chunk in iter_raw(device_id, start, end):
+        records = np.concatenate((carry, chunk)) if len(carry) else chunk
+        whole = len(records) - len(records) % batch
+        for lo in range(0, whole, batch):
+            yield np.array(records[lo:lo + batch])
+        carry = np.array(records[whole:])
+    if len(carry):
+        yield carry
+
+
+def parse_speed(text):
+    # '1', '100', '100x' -> float; 'max' -> None (no waiting)
+    text = text.strip().lower()
+    if text == 'max':
+        return None
+    speed = float(text.removesuffix('x'))
+    if speed <= 0:
+        raise ValueError("speed must be positive")
+    return speed
+
+
+class ReplayPort:
+    # Stands in for serial.Serial: bytes written with feed() come back from read()
+    def __init__(self, baudrate=DEFAULT_BAUDRATE):
+        self.baudrate = baudrate
+        self._data = bytearray()
+
+    def feed(self, data):
+        self._data += data
+
+    @property
+    def in_waiting(self):
+        return len(self._data)
+
+    def read(self, size):
+        chunk = bytes(self._data[:size])
+        del self._data[:size]
+        return chunk
+
+
+class ReplayClock:
+    # HostClock stand-in: every read is stamped with the recorded arrival
+    # time of the chunk being replayed
+    def __init__(self):
+        self.now = 0.0
+
+    def to_wall(self, mono):
+        return self.now
+
+    def elapsed(self, mono):
+        # Sample spacing follows the recording too, whatever the speed
+        return self.now
+
+
+class Pacer:
+    # Waits until data time `t` is due at `speed` times real time
+    def __init__(self, speed):
+        self.speed = speed
+        self._origin = None
+
+    def wait(self, t):
+        if self.speed is None:
+            return
+        now = time.monotonic()
+        if self._origin is None:
+            self._origin = (now, t)
+        due = self._origin[0] + (t - self._origin[1]) / self.speed
+        if due > now:
+            time.sleep(due - now)
+
+
+def check_target(device_id, source=None, config=SKIDS_FILE):
+    # Only replay-* devices that are neither the source nor a configured
+    # skid may be wiped
+    if not device_id.startswith(TARGET_PREFIX):
+        raise ValueError(f"replay target {device_id!r} must start with {TARGET_PREFIX!r}")
+    if device_id == source:
+        raise ValueError(f"replay target {device_id!r} is the source")
+    if os.path.exists(config):
+        with open(config) as f:
+            if device_id in json.load(f):
+                raise ValueError(f"replay target {device_id!r} is a configured skid in {config}")
+
+
+def reset_device(device_id, source=None):
+    # Replays always start from an empty store and history for the target.
+    # Dashboards notice the new files (live_view.get_store) and reopen them.
+    check_target(device_id, source)
+    for path in (store_path(device_id), aggregate_path(device_id)):
+        if os.path.exists(path):
+            os.remove(path)
+    shutil.rmtree(history_dir(device_id), ignore_errors=True)
+
+
+class Replay:
+    # The collector's per-device pipeline for one replayed session: ring
+    # store, history and alert rules, with alert transitions logged
+
+    def __init__(self, device_id, rules=None, history=True, capacity=None, source=None):
+        reset_device(device_id, source)
+        self.device_id = device_id
+        self.store = open_store(device_id, capacity=capacity or DEFAULT_CAPACITY)
+        self.transitions = []
+        self.alerts = AlertEngine(load_rules(rules) if rules else None, store=self.store,
+                                  device_id=device_id, log=self.transitions)
+        self.history = HistoryWriter(device_id) if history else None
+        self.aggregates = AggregateSink(device_id)
+        self.sinks = ((self.history,) if history else ()) + (self.alerts, self.aggregates)
+        self.samples = 0
+        self.first_time = self.last_time = None
+
+    def run_capture(self, chunks, speed, calibration, protocol='auto', baudrate=DEFAULT_BAUDRATE):
+        # Each recorded chunk is read once, as the collector read it
+        self.store.set_calibration(MODEL_VERSION, calibration.version)
+        port = ReplayPort(baudrate)
+        clock = ReplayClock()
+        reader = SerialReader(port, self.store, calibration, clock=clock, sinks=self.sinks,
+                              device_id=self.device_id, protocol=protocol)
+        pacer = Pacer(speed)
+        started = time.perf_counter()
+        for wall_time, chunk in chunks:
+            pacer.wait(wall_time)
+            clock.now = wall_time
+            port.feed(chunk)
+            while port.in_waiting:
+                reader.poll()
+            if self.first_time is None:
+                self.first_time = wall_time
+            self.last_time = wall_time
+        self.samples = reader.samples
+        return self.finish(started, parse_errors=reader.parse_errors,
+                           missing_frames=reader.missing_frames)
+
+    def run_records(self, batches, speed):
+        # Stored samples are already calibrated: straight to store and sinks
+        pacer = Pacer(speed)
+        started = time.perf_counter()
+        for batch in batches:
+            times = batch['time']
+            pacer.wait(times[-1])
+            ph_values, conductivity_values = batch['ph'], batch['conductivity']
+            self.store.extend(times, ph_values, conductivity_values)
+            for sink in self.sinks:
+                sink.extend(times, ph_values, conductivity_values)
+            if self.first_time is None:
+                self.first_time = float(times[0])
+            self.last_time = float(times[-1])
+            self.samples += len(times)
+        return self.finish(started)
+
+    def finish(self, started, **counts):
+        elapsed = time.perf_counter() - started
+        self.store.flush()
+        if self.history is not None:
+            self.history.close()
+        span = (self.last_time - self.first_time) if self.first_time is not None else 0.0
+        return {
+            'device': self.device_id,
+            'samples': self.samples,
+            **counts,
+            'data_seconds': round(span, 3),
+            'wall_seconds': round(elapsed, 3),
+            'throughput_per_s': round(self.samples / elapsed, 1) if elapsed else None,
+            'effective_speed': round(span / elapsed, 1) if elapsed else None,
+            'alert_transitions': len(self.transitions),
+            'alerts_raised': {status: sum(1 for _, level, _ in self.transitions if level == i)
+                              for i, status in enumerate(STATUSES) if i},
+        }
+
+    def transition_rows(self):
+        return [{'time': t, 'status': STATUSES[level], 'rule': rule,
+                 'message': self.alerts.message(level, rule)}
+                for t, level, rule in self.transitions]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded session through the pipeline')
+    parser.add_argument('source', choices=('capture', 'plain', 'history'))
+    parser.add_argument('path', help='capture file, or device id for history')
+    parser.add_argument('--device', help="target device (default 'replay-<name>'), a replay-* "
+                                         "device that is wiped first")
+    parser.add_argument('--speed', default='1', help="1, 100, ... or 'max'")
+    parser.add_argument('--rules', help='alert rules file (default: alerts.json or built-in)')
+    parser.add_argument('--no-history', action='store_true', help='do not write the target history')
+    parser.add_argument('--calibration', help='device id whose calibration applies to captures')
+    parser.add_argument('--protocol', choices=('auto', 'json', 'binary'), default='auto')
+    parser.add_argument('--baudrate', type=int, default=DEFAULT_BAUDRATE)
+    parser.add_argument('--rate', type=float, default=1.0, help='lines/s of a plain capture')
+    parser.add_argument('--start', type=float, help='first sample time (epoch s)')
+    parser.add_argument('--end', type=float, help='history: last sample time (epoch s)')
+    parser.add_argument('--batch', type=int, default=1, help='history: samples per batch')
+    parser.add_argument('--transitions', help='write the alert transitions to this JSON file')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    try:
+        speed = parse_speed(args.speed)
+    except ValueError:
+        parser.error(f"--speed must be a positive number or 'max', not {args.speed!r}")
+    name = args.path if args.source == 'history' else os.path.splitext(os.path.basename(args.path))[0]
+    source = args.path if args.source == 'history' else None
+    try:
+        replay = Replay(args.device or f'{TARGET_PREFIX}{name}', rules=args.rules, history=not args.no_history,
+                        source=source)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.source == 'history':
+        results = replay.run_records(read_history(args.path, args.start, args.end, args.batch), speed)
+    else:
+        calibration = load_calibration(args.calibration or name)
+        if args.source == 'capture':
+            chunks = read_capture(args.path)
+        else:
+            start = args.start if args.start is not None else os.path.getmtime(args.path)
+            chunks = read_plain(args.path, args.rate, start)
+        results = replay.run_capture(chunks, speed, calibration, args.protocol, args.baudrate)
+
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.transitions:
+        with open(args.transitions, 'w') as f:
+            json.dump(replay.transition_rows(), f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
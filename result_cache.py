@@ -0,0 +1,175 @@
+import fcntl
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+import metrics
+
+# Results shared by every client and worker process of a dashboard. Entries
+# are keyed by what they were computed from, normally the store head (the
+# number of samples written), so the first request after a new sample
+# computes and every other request reuses the result.
+#
+# Two tiers: an LRU dict per process, and files in shared memory (/dev/shm,
+# else a local directory) for workers of a multi-process server. Threads of
+# a process wait for a result another thread is computing; processes do the
+# same through file locks.
+
+MAX_ENTRIES = 512                # per process
+MAX_SHARED_BYTES = 64 * 2**20    # files kept in the shared tier
+MAX_AGE = 300                    # seconds a shared entry is kept
+SWEEP_INTERVAL = 30              # seconds between shared tier sweeps
+LOCK_STRIPES = 64
+
+
+def default_directory():
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else '.'
+    return os.path.join(base, f'cis-result-cache-{os.getuid()}')
+
+
+HITS = metrics.counter('result_cache_hits_total', 'Results reused instead of computed', ['tier'])
+MISSES = metrics.counter('result_cache_misses_total', 'Results computed')
+EVICTIONS = metrics.counter('result_cache_evictions_total', 'Cache entries evicted', ['tier'])
+
+_MISSING = object()
+
+
+class ResultCache:
+    def __init__(self, namespace, max_entries=MAX_ENTRIES, directory=None,
+                 max_shared_bytes=MAX_SHARED_BYTES, max_age=MAX_AGE, shared_tier=True):
+        # max_entries=0 and shared_tier=False compute every time (benchmarks)
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.directory = (directory or default_directory()) if shared_tier else None
+        self.max_shared_bytes = max_shared_bytes
+        self.max_age = max_age
+
+        self._entries = OrderedDict()
+        self._pending = {}  # key -> lock held while the key is computed
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        if self.directory and not self._private_directory():
+            print(f"Result cache: {self.directory} is not private, shared tier disabled")
+            self.directory = None
+
+    def _private_directory(self):
+        # Entries are unpickled, so no other user may write to the directory
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            os.makedirs(os.path.join(self.directory, 'locks'), mode=0o700, exist_ok=True)
+            st = os.stat(self.directory)
+        except OSError:
+            return False
+        return st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+    def get(self, key, compute, shared=False):
+        # Cached result for `key`, else compute() once; `shared` also looks
+        # in and stores to the cross-process tier (value must pickle)
+        value = self._lookup(key)
+        if value is not _MISSING:
+            return value
+        with self._lock:
+            pending = self._pending.setdefault(key, threading.Lock())
+        with pending:
+            value = self._lookup(key)
+            if value is _MISSING:
+                if shared and self.directory:
+                    value = self._compute_shared(key, compute)
+                else:
+                    value = self._compute(compute)
+                with self._lock:
+                    self._entries[key] = value
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                        EVICTIONS.labels('memory').inc()
+            with self._lock:
+                self._pending.pop(key, None)
+        return value
+
+    def _lookup(self, key):
+        with self._lock:
+            value = self._entries.get(key, _MISSING)
+            if value is not _MISSING:
+                self._entries.move_to_end(key)
+                HITS.labels('memory').inc()
+        return value
+
+    def _compute(self, compute):
+        MISSES.inc()
+        return compute()
+
+    def _compute_shared(self, key, compute):
+        digest = hashlib.sha1(repr((self.namespace, key)).encode()).hexdigest()
+        path = os.path.join(self.directory, digest + '.pkl')
+        value = self._load(path)
+        if value is not _MISSING:
+            return value
+
+        stripe = int(digest[:8], 16) % LOCK_STRIPES
+        with open(os.path.join(self.directory, 'locks', f'{stripe}.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Another worker may have written it while we waited
+                value = self._load(path)
+                if value is not _MISSING:
+                    return value
+                value = self._compute(compute)
+                tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+                try:
+                    with open(tmp, 'wb') as f:
+                        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    os.replace(tmp, path)
+                except OSError as e:
+                    print(f"Result cache write failed: {e}")
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        if time.monotonic() - self._last_sweep >= SWEEP_INTERVAL:
+            self.sweep()
+        return value
+
+    def _load(self, path):
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return _MISSING
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return _MISSING
+        HITS.labels('shared').inc()
+        return value
+
+    def sweep(self):
+        # Drop shared entries older than max_age, then the oldest until the
+        # tier fits in max_shared_bytes
+        if not self.directory:
+            return
+        self._last_sweep = time.monotonic()
+        now = time.time()
+        files = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith(('.pkl', '.tmp')):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in files:
+            if now - mtime <= self.max_age and total <= self.max_shared_bytes:
+                break
+            try:
+                os.remove(path)
+                EVICTIONS.labels('shared').inc()
+            except FileNotFoundError:
+                pass
+            total -= size
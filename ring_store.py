@@ -0,0 +1,268 @@
+import os
+import re
+import time
+import numpy as np
+
+# One store file per device (skid), shared by the collector and the dashboards.
+# Stores (and the rolling aggregates next to them) are working copies: the
+# history archive (history.py) is the durable record and the collector
+# refills an empty store from it. So they live in RAM (tmpfs), where the
+# page writes of every sample cost the SD card nothing. CIS_STORE_DIR puts
+# them elsewhere.
+STORE_DIR_ENV = 'CIS_STORE_DIR'
+
+
+def default_store_dir():
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm/cis-sensor-data'
+    return 'sensor_data'
+
+
+STORE_DIR = os.environ.get(STORE_DIR_ENV) or default_store_dir()
+DEFAULT_DEVICE = 'skid1'
+
+# Enough for three days of 1 Hz samples
+DEFAULT_CAPACITY = 3 * 24 * 3600
+
+MAGIC = b'CISRING1'
+HEADER_SIZE = 64
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('capacity', '<u8'),
+    ('record_size', '<u8'),
+    ('head', '<u8'),       # total number of records ever written
+    ('generation', '<u8'), # odd while a write is in progress (seqlock)
+    ('alert_level', '<u4'),  # 0 normal, 1 warning, 2 critical (alerts.py)
+    ('alert_rule', '<i4'),   # index of the rule behind it, -1 for none
+    ('calibration_model', '<u2'),    # calibration.MODEL_VERSION of the writer
+    ('calibration_version', '<u2'),  # the probe's calibration number
+    ('nonce', '<u8'),      # random, set when the store is created
+])
+
+# Attempts snapshot() makes before giving up on a busy writer
+SNAPSHOT_RETRIES = 100
+
+
+class TornRead(Exception):
+    # A reader could not get a consistent snapshot of the store
+    pass
+
+RECORD_DTYPE = np.dtype([
+    ('time', '<f8'),
+    ('ph', '<f4'),
+    ('conductivity', '<f4'),
+])
+
+
+def store_path(device_id):
+    if not re.fullmatch(r'[A-Za-z0-9_.-]+', device_id):
+        raise ValueError(f"invalid device id: {device_id!r}")
+    return os.path.join(STORE_DIR, device_id + '.ring')
+
+
+def list_devices():
+    try:
+        names = os.listdir(STORE_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted(name[:-5] for name in names if name.endswith('.ring'))
+
+
+def open_store(device_id, capacity=DEFAULT_CAPACITY, readonly=False):
+    if not readonly:
+        os.makedirs(STORE_DIR, exist_ok=True)
+    return RingStore(store_path(device_id), capacity=capacity, readonly=readonly)
+
+
+class RingStore:
+    # Fixed-size ring of (time, ph, conductivity) records in a memory-mapped file.
+    #
+    # Every record is written twice, at slot i and i + capacity, so the latest
+    # N records are always one contiguous block and readers get a plain NumPy
+    # view without copying or stitching two halves together.
+    #
+    # Writes are bracketed by a generation counter (a seqlock): it is odd
+    # while records and head are being updated. snapshot() reads the head
+    # between two equal, even generations, so a reader never takes a head
+    # whose records are not all in place; a view stays valid until the
+    # writer laps it (capacity - n more records).
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY, readonly=False):
+        self.path = path
+        self.readonly = readonly
+
+        if readonly:
+            self._map = np.memmap(path, dtype=np.uint8, mode='r')
+        else:
+            size = HEADER_SIZE + 2 * capacity * RECORD_DTYPE.itemsize
+            if os.path.exists(path):
+                # Recreating it would truncate the data and pull the pages
+                # from under the dashboards' mappings
+                existing = os.path.getsize(path)
+                if existing != size:
+                    found = (existing - HEADER_SIZE) / (2 * RECORD_DTYPE.itemsize)
+                    raise ValueError(f"{path} holds {found:g} records, not {capacity}; "
+                                     f"open it with that capacity or move it away")
+                self._map = np.memmap(path, dtype=np.uint8, mode='r+')
+            else:
+                self._map = np.memmap(path, dtype=np.uint8, mode='w+', shape=(size,))
+
+        self._header = self._map[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)
+
+        if not readonly and self._header['magic'][0] != MAGIC:
+            self._header['magic'] = MAGIC
+            self._header['capacity'] = capacity
+            self._header['record_size'] = RECORD_DTYPE.itemsize
+            self._header['head'] = 0
+            self._header['nonce'] = 0
+        if not readonly and self._header['nonce'][0] == 0:
+            # Tells results computed from this store apart from those of an
+            # earlier store of the same device, whose heads started at 0 too
+            self._header['nonce'] = int.from_bytes(os.urandom(8), 'little') or 1
+
+        if self._header['magic'][0] != MAGIC:
+            raise ValueError(f"{path} is not a sensor ring store")
+        if not readonly and self.generation % 2:
+            # A writer died mid-write; its batch was never published
+            self._header['generation'] += 1
+        if int(self._header['record_size'][0]) != RECORD_DTYPE.itemsize:
+            raise ValueError(f"{path} has an incompatible record layout")
+
+        self.capacity = int(self._header['capacity'][0])
+        self._records = self._map[HEADER_SIZE:].view(RECORD_DTYPE)
+        # Held open to tell when the file is deleted (inode numbers are reused)
+        self._file = open(path, 'rb')
+
+    def replaced(self):
+        # True once the file was deleted (replay.py recreates it): this
+        # mapping still shows the old one
+        return os.fstat(self._file.fileno()).st_nlink == 0
+
+    @property
+    def nonce(self):
+        return int(self._header['nonce'][0])
+
+    @property
+    def head(self):
+        return int(self._header['head'][0])
+
+    @property
+    def generation(self):
+        return int(self._header['generation'][0])
+
+    def __len__(self):
+        return min(self.head, self.capacity)
+
+    def append(self, time, ph, conductivity):
+        head = self.head
+        slot = head % self.capacity
+        record = (time, ph, conductivity)
+        generation = self._begin()
+        self._records[slot] = record
+        self._records[slot + self.capacity] = record
+        # Publish only after both copies are in place
+        self._publish(generation, head + 1)
+
+    def extend(self, times, ph_values, conductivity_values):
+        n = len(times)
+        if n == 0:
+            return
+        head = self.head
+        cap = self.capacity
+
+        # Only the last `capacity` records of a batch can survive
+        if n > cap:
+            skip = n - cap
+            times = times[skip:]
+            ph_values = ph_values[skip:]
+            conductivity_values = conductivity_values[skip:]
+            head += skip
+            n = cap
+
+        # Columns go straight into the mapped records, without a batch copy
+        slot = head % cap
+        first = min(n, cap - slot)
+        generation = self._begin()
+        for name, values in (('time', times), ('ph', ph_values), ('conductivity', conductivity_values)):
+            column = self._records[name]
+            for offset in (0, cap):
+                column[offset + slot:offset + slot + first] = values[:first]
+                if first < n:
+                    column[offset:offset + n - first] = values[first:]
+
+        self._publish(generation, head + n)
+
+    def _begin(self):
+        generation = self.generation + 1
+        self._header['generation'] = generation
+        return generation
+
+    def _publish(self, generation, head):
+        self._header['head'] = head
+        self._header['generation'] = generation + 1
+
+    def latest(self, n=None, head=None):
+        # Zero-copy view of the latest n records, oldest first.
+        # Pass `head` to read relative to a head value seen earlier.
+        if head is None:
+            head = self.head
+        available = min(head, self.capacity)
+        if n is None or n > available:
+            n = available
+        end = head % self.capacity + self.capacity if head >= self.capacity else head
+        return self._records[end - n:end]
+
+    def set_alert(self, level, rule):
+        # Latest alert level and rule, published like a write
+        generation = self._begin()
+        self._header['alert_level'] = level
+        self._header['alert_rule'] = rule
+        self._publish(generation, self.head)
+
+    def set_calibration(self, model, version):
+        self._header['calibration_model'] = model
+        self._header['calibration_version'] = version
+
+    @property
+    def calibration(self):
+        # (model, version) of the calibration the stored values went through
+        return int(self._header['calibration_model'][0]), int(self._header['calibration_version'][0])
+
+    @property
+    def alert(self):
+        # (level, rule) as last published by the alert engine
+        return self._consistent(lambda: (int(self._header['alert_level'][0]),
+                                         int(self._header['alert_rule'][0])))
+
+    def snapshot(self, n=None, copy=False):
+        # Consistent (records, head): zero-copy view of the latest n records
+        # and the head it ends at. With copy=True the records are copied
+        # inside the generation check, for readers that hold on to them while
+        # the writer may lap the ring. Raises TornRead if the writer stays busy.
+        def read():
+            head = self.head
+            records = self.latest(n, head=head)
+            return (records.copy() if copy else records), head
+        return self._consistent(read)
+
+    def _consistent(self, read):
+        # Runs read() between two equal, even generations
+        for _ in range(SNAPSHOT_RETRIES):
+            generation = self.generation
+            if generation % 2 == 0:
+                result = read()
+                if self.generation == generation:
+                    return result
+            time.sleep(0)
+        raise TornRead(f"{self.path}: no consistent snapshot after {SNAPSHOT_RETRIES} attempts")
+
+    def flush(self):
+        if not self.readonly:
+            self._map.flush()
+
+    def close(self):
+        # The mapping is released once the last view onto it goes away
+        self.flush()
+        self._file.close()
+        del self._records, self._header, self._map
@@ -1,64 +1,92 @@
-import json
 import time
 import random
-
-# JSON file path
-JSON_FILE = 'sensor_data.json'
+from framing import encode_frame
+from ring_store import open_store, DEFAULT_DEVICE
+from alerts import AlertEngine
+from aggregates import AggregateSink
+from calibration import load_calibration, MODEL_VERSION
 
 # Mock pH parameters
-ph_value = 7.6
-style = 0
-step = 0.015  # Smooth fast updates
-count = 0
-
-def calculate_conductivity(ph):
-    # Example: conductivity decreases as pH increases
-    conductivity = max(0, 100 - (ph * 5))  # µS/cm
-    return round(conductivity, 2)  # 2 decimals
-
-try:
-    while True:
-        # Change style every 20 readings
-        if count % 20 == 0:
-            style = random.randint(0, 4)  # 0-4
-        count += 1
+START_PH = 7.6
+STEP = 0.015  # Smooth fast updates
+STYLE_PERIOD = 20  # readings per behaviour style
+
+
+class PhSimulator:
+    # Mock pH probe cycling through five behaviour styles. Pass a seed for a
+    # reproducible sequence (benchmarks, replays).
+
+    def __init__(self, ph_value=START_PH, step=STEP, period=STYLE_PERIOD, seed=None):
+        self.ph_value = ph_value
+        self.step = step
+        self.period = period
+        self.style = 0
+        self.count = 0
+        self.random = random.Random(seed)
+
+    def next(self):
+        rnd = self.random
+        step = self.step
+
+        # Change style every `period` readings
+        if self.count % self.period == 0:
+            self.style = rnd.randint(0, 4)  # 0-4
+        self.count += 1
 
         # Update pH based on style
-        if style == 0:  # linear increase
+        ph_value = self.ph_value
+        if self.style == 0:  # linear increase
             ph_value += step
             if ph_value > 8.5:
                 ph_value = 7.6
-        elif style == 1:  # linear decrease
+        elif self.style == 1:  # linear decrease
             ph_value -= step
             if ph_value < 7.6:
                 ph_value = 8.5
-        elif style == 2:  # random jumps
-            ph_value = 7.6 + random.random() * 0.9  # 7.6 -> 8.5
-        elif style == 3:  # oscillating
-            ph_value += random.choice([-step, step])
+        elif self.style == 2:  # random jumps
+            ph_value = 7.6 + rnd.random() * 0.9  # 7.6 -> 8.5
+        elif self.style == 3:  # oscillating
+            ph_value += rnd.choice([-step, step])
             ph_value = max(7.6, min(8.5, ph_value))
-        elif style == 4:  # slow drift + noise
-            ph_value += random.uniform(-0.005, 0.005)
+        elif self.style == 4:  # slow drift + noise
+            ph_value += rnd.uniform(-0.005, 0.005)
             ph_value = max(7.6, min(8.5, ph_value))
 
-        # Calculate conductivity
-        conductivity_value = calculate_conductivity(ph_value)
+        self.ph_value = ph_value
+        return round(ph_value, 3)
+
+    def serial_line(self):
+        # The reading as the Arduino would send it
+        return "{'pH': %.3f}\r\n" % self.next()
+
+    def serial_frame(self):
+        # The reading as a binary frame (framing.py), numbered by reading
+        return encode_frame(self.count, self.next())
+
+
+if __name__ == '__main__':
+    store = open_store(DEFAULT_DEVICE)
+    alerts = AlertEngine(store=store, device_id=DEFAULT_DEVICE)
+    aggregates = AggregateSink(DEFAULT_DEVICE)
+    calibration = load_calibration(DEFAULT_DEVICE)
+    store.set_calibration(MODEL_VERSION, calibration.version)
+    simulator = PhSimulator()
 
-        # Create JSON data point (only latest value)
-        data_point = {
-            "time": count,
-            "ph": round(ph_value, 3),
-            "conductivity": conductivity_value
-        }
+    try:
+        while True:
+            times = [time.time()]
+            ph_values, conductivity_values = calibration.apply([simulator.next()])
 
-        # Overwrite JSON file with **only the latest reading**
-        with open(JSON_FILE, 'w') as f:
-            json.dump(data_point, f, indent=2)
+            # Append to the ring store the dashboards read
+            store.extend(times, ph_values, conductivity_values)
+            alerts.extend(times, ph_values, conductivity_values)
+            aggregates.extend(times, ph_values, conductivity_values)
 
-        print(f"Logged data: {data_point}")
+            print(f"Logged data: ph={ph_values[0]:.3f} conductivity={conductivity_values[0]:.2f}")
 
-        time.sleep(1)  # Adjust interval as needed
+            time.sleep(1)  # Adjust interval as needed
 
-except KeyboardInterrupt:
-    # Stop immediately on keyboard input
-    print("Keyboard interrupt detected. Stopping.")
+    except KeyboardInterrupt:
+        # Stop immediately on keyboard input
+        store.flush()
+        print("Keyboard interrupt detected. Stopping.")
@@ -0,0 +1,293 @@
+import json
+import re
+import threading
+import time
+import numpy as np
+from framing import SYNC, FrameDecoder
+import metrics
+
+SAMPLES = metrics.counter('collector_samples_total', 'Samples ingested', ['device'])
+PARSE_ERRORS = metrics.counter('collector_parse_errors_total', 'Lines that failed to parse', ['device'])
+DROPPED = metrics.counter('collector_dropped_lines_total', 'Lines without a pH value or line ending', ['device'])
+STAGE_SECONDS = metrics.histogram('collector_stage_seconds', 'Time per ingestion stage', ['stage'])
+LATENCY = metrics.histogram('collector_latency_seconds', 'Bytes received to stored', ['device'])
+MISSING = metrics.counter('collector_missing_frames_total', 'Binary frames lost, from sequence gaps', ['device'])
+CLOCK_STEPS = metrics.counter('collector_clock_steps_total', 'System clock steps the host clock re-anchored to')
+
+PROTOCOLS = ('auto', 'json', 'binary')
+
+CLOCK_STEP = 1.0  # seconds the system clock may drift from the host clock before re-anchoring
+
+# Sample times that would go back (the clock stepped back, or is behind the
+# store after a restart) continue from the previous sample instead, and the
+# lag this puts on them is taken off at this fraction of elapsed time
+CLOCK_SLEW = 0.1
+MIN_SPACING = 0.001  # seconds between samples whose true spacing is unknown
+
+# The firmware's usual line, matched on the raw bytes without decoding it or
+# building a dict; anything else goes through parse_line
+PH_LINE = re.compile(rb"\s*\{\s*'pH'\s*:\s*(-?[0-9]+(?:\.[0-9]*)?)\s*\}\s*")
+
+
+class HostClock:
+    # Wall-clock timestamps derived from time.monotonic(), so samples are
+    # evenly spaced while NTP slews the system clock. When the system clock
+    # moves away by more than `step` seconds (stepped by NTP after booting
+    # without an RTC, or set by hand) the offset is re-anchored to it.
+
+    def __init__(self, step=CLOCK_STEP):
+        self.step = step
+        self.steps = 0
+        self._wall0 = time.time()
+        self._mono0 = time.monotonic()
+        self._lock = threading.Lock()
+
+    def to_wall(self, mono):
+        drift = time.time() - (self._wall0 + (time.monotonic() - self._mono0))
+        if abs(drift) > self.step:
+            with self._lock:
+                # Shared by the device workers: only the first one re-anchors
+                drift = time.time() - (self._wall0 + (time.monotonic() - self._mono0))
+                if abs(drift) > self.step:
+                    print(f"System clock stepped by {drift:+.3f} s, re-anchoring sample times")
+                    self._wall0 += drift
+                    self.steps += 1
+                    CLOCK_STEPS.inc()
+        return self._wall0 + (mono - self._mono0)
+
+    def elapsed(self, mono):
+        # Steady time for spacing samples, unaffected by clock steps
+        return mono
+
+
+def parse_line(line):
+    # Arduino sends JSON-like {'pH': value} lines; returns the pH or None.
+    # Raises ValueError or TypeError on anything else.
+    data = json.loads(line.replace("'", "\""))
+    if not isinstance(data, dict):
+        raise ValueError(f"not a reading: {line!r}")
+    if 'pH' in data:
+        return float(data['pH'])
+    return None
+
+
+class SerialReader:
+    # Drains a serial port on its own thread as fast as data arrives.
+    #
+    # Every chunk read from the port is stamped with the host monotonic time
+    # when it arrived. Lines inside a chunk are back-dated by the time the
+    # bytes after them took on the wire, then parsed as one batch and written
+    # to the store with a single extend().
+    #
+    # `protocol` is 'json' for {'pH': value} lines, 'binary' for frames (see
+    # framing.py) or 'auto', which reads lines until frame sync bytes show up.
+    # Raw readings go through `calibration` (calibration.py) as one batch.
+    # With a `capture` (replay.CaptureWriter) every chunk is also recorded
+    # with its arrival time, for replaying the session later.
+
+    def __init__(self, port, store, calibration, clock=None, max_read=4096, sinks=(),
+                 device_id='', protocol='auto', capture=None):
+        if protocol not in PROTOCOLS:
+            raise ValueError(f"unknown protocol {protocol!r}")
+        self.port = port
+        self.store = store
+        self.sinks = sinks  # more extend(times, ph, conductivity) targets
+        self.calibration = calibration
+        self.clock = clock or HostClock()
+        self.max_read = max_read
+        self.protocol = protocol
+        self.mode = 'binary' if protocol == 'binary' else 'json'
+        self.decoder = FrameDecoder()
+        self.capture = capture
+
+        self.samples = 0
+        self.parse_errors = 0
+        self.missing_frames = 0
+        self.last_latency = None   # seconds from bytes received to stored
+        self.max_latency = 0.0
+
+        self._buffer = b''
+        self._last_time = self._stored_time()
+        self._last_mono = None   # monotonic time of the last sample
+        self._lag = 0.0          # seconds added to the clock, slewing to 0
+        self._last_poll = 0.0
+        self._running = False
+        self._thread = None
+
+        self._samples_metric = SAMPLES.labels(device_id)
+        self._errors_metric = PARSE_ERRORS.labels(device_id)
+        self._dropped_metric = DROPPED.labels(device_id)
+        self._latency_metric = LATENCY.labels(device_id)
+        self._missing_metric = MISSING.labels(device_id)
+        self._read_timer = STAGE_SECONDS.labels('read')
+        self._parse_timer = STAGE_SECONDS.labels('parse')
+        self._store_timer = STAGE_SECONDS.labels('store')
+        self._sink_timer = STAGE_SECONDS.labels('sinks')
+
+    def _stored_time(self):
+        # Newest time already in the store. Samples are never stamped before
+        # it, so a restart with the clock behind (not yet synced) cannot put
+        # times out of order in the store and the history archive.
+        latest = getattr(self.store, 'latest', None)
+        records = latest(1) if latest is not None else ()
+        if len(records) == 0:
+            return 0.0
+        newest = float(records['time'][-1])
+        if newest > time.time():
+            print(f"System clock is {newest - time.time():.1f} s behind the stored samples; "
+                  "sample times continue from the newest stored one until it catches up")
+        return newest
+
+    def attach(self, port):
+        # Switch to a (re)opened port; a partial line from the old one is lost
+        # and the firmware may have changed, so 'auto' looks again
+        self.port = port
+        self._buffer = b''
+        self.mode = 'binary' if self.protocol == 'binary' else 'json'
+        self.decoder.reset()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='serial-reader', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while self._running:
+            try:
+                self.poll()
+            except Exception as e:
+                print("Error reading serial:", e)
+                time.sleep(1)
+
+    def poll(self):
+        # Blocks for at most the port timeout waiting for the first byte,
+        # then takes everything already buffered by the OS
+        self._last_poll = time.monotonic()
+        waiting = self.port.in_waiting
+        chunk = self.port.read(min(max(waiting, 1), self.max_read))
+        if not chunk:
+            return 0
+        received = time.monotonic()
+        if self.capture is not None:
+            self.capture.write(self.clock.to_wall(received), chunk)
+        if waiting:
+            # Only reads that did not wait for data say something about cost
+            self._read_timer.observe(received - self._last_poll)
+
+        data = self._buffer + chunk
+        if self.mode == 'json' and self.protocol == 'auto':
+            sync = data.find(SYNC)
+            if sync >= 0:
+                # New firmware: finish the text lines before the first frame
+                self.mode = 'binary'
+                lines = data[:sync].split(b'\n')
+                lines[-1:] = [lines[-1]] if lines[-1].strip() else []
+                n = self.ingest(lines, received, len(data) - sync)
+                return n + self.ingest_frames(data[sync:], received)
+        if self.mode == 'binary':
+            return self.ingest_frames(data, received)
+
+        lines = data.split(b'\n')
+        self._buffer = lines.pop()
+        if len(self._buffer) > self.max_read:
+            # No line ending in sight, the stream is garbage
+            self._buffer = b''
+            self.parse_errors += 1
+            self._dropped_metric.inc()
+        return self.ingest(lines, received, len(self._buffer))
+
+    def ingest(self, lines, received, tail=0):
+        # `tail` is the number of bytes received after the last line
+        started = time.perf_counter()
+        byte_time = 10.0 / getattr(self.port, 'baudrate', 9600)  # 8N1
+        after = tail
+        offsets = []
+        values = []
+        for raw in reversed(lines):
+            delay = after * byte_time
+            after += len(raw) + 1
+            match = PH_LINE.fullmatch(raw)
+            if match is not None:
+                values.append(float(match.group(1)))
+                offsets.append(delay)
+                continue
+            line = raw.decode('utf-8', errors='replace').strip()
+            if not line:
+                continue
+            try:
+                ph = parse_line(line)
+            except (ValueError, TypeError):
+                self.parse_errors += 1
+                self._errors_metric.inc()
+                continue
+            if ph is not None:
+                values.append(ph)
+                offsets.append(delay)
+            else:
+                self._dropped_metric.inc()
+
+        if not values:
+            return 0
+        return self._write(np.array(values[::-1]), np.array(offsets[::-1]), received, started)
+
+    def ingest_frames(self, data, received):
+        # Decodes every complete frame in `data`; keeps a partial one
+        started = time.perf_counter()
+        seq, values, ends, consumed, missing, errors = self.decoder.decode(data)
+        self._buffer = data[consumed:]
+        if errors:
+            self.parse_errors += errors
+            self._errors_metric.inc(errors)
+        if missing:
+            self.missing_frames += missing
+            self._missing_metric.inc(missing)
+        if len(seq) == 0:
+            return 0
+        byte_time = 10.0 / getattr(self.port, 'baudrate', 9600)  # 8N1
+        offsets = (len(data) - ends) * byte_time
+        return self._write(values[:, 0].astype(np.float64), offsets, received, started)
+
+    def _write(self, raw_values, offsets, received, started):
+        # Timestamps, calibration, then the store and the sinks
+        n = len(raw_values)
+        times = self.clock.to_wall(received) - offsets
+        steady = self.clock.elapsed(received)
+        first, last = steady - float(offsets[0]), steady - float(offsets[-1])
+        if self._lag:
+            elapsed = last - self._last_mono
+            self._lag = max(0.0, self._lag - CLOCK_SLEW * elapsed)
+            times += self._lag
+        if times[0] <= self._last_time:
+            # Never step back behind the previous sample: continue from it
+            # at the true spacing (bursty USB delivery, clock steps)
+            gap = first - self._last_mono if self._last_mono is not None else 0.0
+            shift = self._last_time - times[0] + max(gap, MIN_SPACING)
+            self._lag += shift
+            times += shift
+        self._last_time = times[-1]
+        self._last_mono = last
+        ph_values, conductivity_values = self.calibration.apply(raw_values)
+        parsed = time.perf_counter()
+        self._parse_timer.observe(parsed - started)
+
+        self.store.extend(times, ph_values, conductivity_values)
+        stored = time.perf_counter()
+        self._store_timer.observe(stored - parsed)
+
+        if self.sinks:
+            for sink in self.sinks:
+                sink.extend(times, ph_values, conductivity_values)
+            self._sink_timer.observe(time.perf_counter() - stored)
+
+        latency = time.monotonic() - received
+        self._latency_metric.observe(latency)
+        self._samples_metric.inc(n)
+        self.samples += n
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        return n
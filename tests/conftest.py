@@ -0,0 +1,14 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # History (history/) and the stores, normally on tmpfs, under tmp_path
+    import ring_store
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(ring_store, 'STORE_DIR', 'sensor_data')
+    return tmp_path
@@ -0,0 +1,106 @@
+import time
+import pytest
+import actuator
+from actuator import TowerLightActuator, worst_status
+
+
+class FakeGpio:
+    # set_tower_light stand-in recording writes; the first `failures` raise
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.attempts = []
+        self.written = []
+
+    def __call__(self, status):
+        self.attempts.append(status)
+        if self.failures:
+            self.failures -= 1
+            raise OSError("pin write failed")
+        self.written.append(status)
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+@pytest.fixture
+def light():
+    lights = []
+
+    def make(gpio, debounce=0.05):
+        light = TowerLightActuator(gpio, debounce=debounce)
+        lights.append(light)
+        return light
+    yield make
+    for light in lights:
+        light.stop()
+
+
+def test_repeats_are_written_once(light):
+    gpio = FakeGpio()
+    tower = light(gpio)
+    for _ in range(5):
+        tower.request('warning')
+    assert wait_for(lambda: tower.current == 'warning')
+    time.sleep(0.05)
+    assert gpio.written == ['warning']
+
+
+def test_escalation_is_immediate_and_de_escalation_debounced(light):
+    gpio = FakeGpio()
+    tower = light(gpio, debounce=0.2)
+    tower.request('normal')
+    tower.request('critical')
+    assert wait_for(lambda: tower.current == 'critical', timeout=0.1)
+    tower.request('normal')
+    time.sleep(0.05)
+    assert tower.current == 'critical'
+    assert wait_for(lambda: tower.current == 'normal')
+    assert gpio.written == ['normal', 'critical', 'normal']
+
+
+def test_flapping_within_debounce_is_not_written(light):
+    gpio = FakeGpio()
+    tower = light(gpio, debounce=0.2)
+    tower.request('critical')
+    assert wait_for(lambda: tower.current == 'critical')
+    tower.request('normal')
+    tower.request('critical')
+    time.sleep(0.3)
+    assert gpio.written == ['critical']
+
+
+def test_failed_write_is_retried(light, monkeypatch):
+    monkeypatch.setattr(actuator, 'RETRY_SECONDS', 0.01)
+    gpio = FakeGpio(failures=1)
+    tower = light(gpio)
+    tower.request('critical')
+    assert wait_for(lambda: tower.current == 'critical')
+    assert gpio.attempts == ['critical', 'critical']
+    assert tower.stats()['errors'] == 1
+    # Later identical requests are still dropped, the light is right
+    tower.request('critical')
+    time.sleep(0.05)
+    assert gpio.written == ['critical']
+
+
+def test_retry_gives_way_to_a_new_status(light, monkeypatch):
+    monkeypatch.setattr(actuator, 'RETRY_SECONDS', 0.2)
+    gpio = FakeGpio(failures=1)
+    tower = light(gpio, debounce=0.0)
+    tower.request('warning')
+    assert wait_for(lambda: gpio.attempts == ['warning'])
+    tower.request('critical')
+    assert wait_for(lambda: tower.current == 'critical', timeout=0.1)
+    time.sleep(0.3)
+    assert gpio.written == ['critical']
+
+
+def test_worst_status():
+    assert worst_status(['normal', 'critical', 'warning']) == 'critical'
+    assert worst_status([]) == 'normal'
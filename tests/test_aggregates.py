@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from aggregates import RollingAggregates, AggregateSink
+
+
+def brute_force(times, values, now, width, buckets):
+    # The samples a window covers: its last `buckets` buckets up to `now`
+    first = (int(now // width) - buckets + 1) * width
+    inside = times >= first
+    return values[inside]
+
+
+@pytest.mark.parametrize('batch', [1, 13])
+def test_matches_brute_force(batch):
+    rng = np.random.default_rng(5)
+    n = 4000
+    times = 1.7e9 + np.cumsum(rng.choice([0.25, 0.5, 1.0, 7.0], n, p=[0.3, 0.3, 0.35, 0.05]))
+    ph = (8.0 + np.cumsum(rng.normal(0, 0.01, n))).astype(np.float32)
+    conductivity = rng.uniform(0, 100, n).astype(np.float32)
+    windows, buckets = (10, 50, 600), 20
+    aggregates = RollingAggregates(windows, buckets=buckets)
+
+    for step, lo in enumerate(range(0, n, batch)):
+        hi = min(lo + batch, n)
+        aggregates.extend(times[lo:hi], ph[lo:hi], conductivity[lo:hi])
+        if step % 37 and hi < n:
+            continue
+        now = times[hi - 1]
+        for row, seconds in zip(aggregates.rows(), windows):
+            assert row['window'] == seconds
+            for channel, column in (('ph', ph), ('conductivity', conductivity)):
+                expected = brute_force(times[:hi], column[:hi].astype(np.float64), now,
+                                       seconds / buckets, buckets)
+                assert row['count'] == len(expected)
+                assert row[f'{channel}_min'] == expected.min()
+                assert row[f'{channel}_max'] == expected.max()
+                assert row[f'{channel}_mean'] == pytest.approx(expected.mean(), rel=1e-12)
+                std = expected.std(ddof=1) if len(expected) > 1 else 0.0
+                assert row[f'{channel}_std'] == pytest.approx(std, rel=1e-9, abs=1e-12)
+
+
+def test_empty_window_rows():
+    rows = RollingAggregates((10,)).rows()
+    assert rows['count'].tolist() == [0]
+
+
+def test_windows_age_without_samples():
+    rng = np.random.default_rng(6)
+    times = 1.7e9 + np.arange(0, 700, 0.5)
+    ph = rng.uniform(6, 9, len(times)).astype(np.float32)
+    conductivity = rng.uniform(0, 100, len(times)).astype(np.float32)
+    windows, buckets = (10, 50, 600), 20
+    aggregates = RollingAggregates(windows, buckets=buckets)
+    aggregates.extend(times, ph, conductivity)
+
+    # No samples for 30 s: the 10 s window is empty, the others lost their oldest buckets
+    now = times[-1] + 30
+    aggregates.advance(now)
+    for row, seconds in zip(aggregates.rows(), windows):
+        expected = brute_force(times, ph.astype(np.float64), now, seconds / buckets, buckets)
+        assert row['count'] == len(expected)
+        if len(expected):
+            assert row['ph_min'] == expected.min()
+            assert row['ph_max'] == expected.max()
+            assert row['ph_mean'] == pytest.approx(expected.mean(), rel=1e-12)
+
+    # Samples carry on after the gap
+    aggregates.extend(now + np.arange(3.0), np.full(3, 7.0, np.float32), np.zeros(3, np.float32))
+    row = aggregates.rows()[0]
+    assert row['count'] == 3
+    assert row['ph_mean'] == 7.0
+
+
+def test_stats_table_shows_the_newest_sample():
+    from live_view import stats_table
+    sink = AggregateSink('skid1')
+    times = 1.7e9 + np.arange(120.0)
+    sink.extend(times, np.full(120, 7.0, np.float32), np.zeros(120, np.float32))
+
+    def counts(table):
+        return [tr.children[1].children for tr in table.children[2].children]
+
+    table = stats_table('skid1', now=times[-1] + 1)
+    assert counts(table) == [60, 120, 120, 120]
+    assert table.children[0].children.endswith(", 1 s ago")
+    # Published rows nobody aged (the collector stopped) go blank once stale
+    assert counts(stats_table('skid1', now=times[-1] + 120)) == [0, 120, 120, 120]
@@ -0,0 +1,57 @@
+from functools import lru_cache
+import numpy as np
+import pytest
+from alerts import AlertEngine
+
+# One rule of each type; scores and levels are all per sample
+RULES = [
+    {'type': 'band', 'channel': 'ph', 'side': 'above', 'warning': 8.2, 'critical': 8.4, 'hysteresis': 0.02},
+    {'type': 'band', 'channel': 'ph', 'side': 'below', 'warning': 7.8, 'critical': 7.6, 'hysteresis': 0.02},
+    {'type': 'rate', 'channel': 'ph', 'window': 10, 'warning': 0.01, 'critical': 0.03},
+    {'type': 'ewma', 'channel': 'conductivity', 'alpha': 0.05, 'warning': 15, 'critical': 30},
+    {'type': 'cusum', 'channel': 'ph', 'target': 8.0, 'slack': 0.05, 'warning': 2.0, 'critical': 5.0},
+    {'type': 'forecast', 'channel': 'ph', 'warning': 8.3, 'critical': 8.45, 'window': 60, 'horizon': 60,
+     'hysteresis': 0.02},
+    {'type': 'forecast', 'channel': 'ph', 'side': 'below', 'warning': 7.7, 'critical': 7.55,
+     'window': 60, 'horizon': 60},
+]
+
+
+def signal(n=3000, seed=3):
+    rng = np.random.default_rng(seed)
+    times = 1.7e9 + np.cumsum(rng.uniform(0.5, 1.5, n))
+    ph = 8.0 + 0.5 * np.sin(np.arange(n) / 150) + rng.normal(0, 0.02, n)
+    conductivity = 50 + np.cumsum(rng.normal(0, 2, n))
+    return times, ph.astype(np.float32), conductivity.astype(np.float32)
+
+
+@lru_cache
+def run(batch):
+    times, ph, conductivity = signal()
+    log = []
+    engine = AlertEngine(RULES, log=log)
+    for lo in range(0, len(times), batch):
+        engine.extend(times[lo:lo + batch], ph[lo:lo + batch], conductivity[lo:lo + batch])
+    return log, (engine.level, engine.rule)
+
+
+def test_signal_raises_alerts():
+    log, _ = run(1)
+    assert {level for _, level, _ in log} >= {1, 2}
+    assert len({rule for _, _, rule in log}) > 2
+
+
+@pytest.mark.parametrize('batch', [7, 64, 1000, 3000])
+def test_results_do_not_depend_on_batch_size(batch):
+    assert run(batch) == run(1)
+
+
+def test_evaluate_matches_extend():
+    times, ph, conductivity = signal()
+    levels, rules = AlertEngine(RULES).evaluate(times, {'ph': ph, 'conductivity': conductivity})
+    log = []
+    changes = np.flatnonzero(np.diff(levels.astype(int), prepend=0) | np.diff(rules, prepend=-1))
+    expected = [(float(times[i]), int(levels[i]), int(rules[i])) for i in changes]
+    engine = AlertEngine(RULES, log=log)
+    engine.extend(times, ph, conductivity)
+    assert log == expected
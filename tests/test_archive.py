@@ -0,0 +1,105 @@
+import os
+import numpy as np
+from ring_store import RECORD_DTYPE
+from archive import (ArchiveWriter, encode_chunk, decode_chunk, read_range, read_last, _read_index,
+                     DATA_FILE, INDEX_FILE, INDEX_DTYPE)
+
+
+def make_records(n, start=1.7e9, seed=0):
+    rng = np.random.default_rng(seed)
+    records = np.empty(n, dtype=RECORD_DTYPE)
+    # Mostly steady 1 s steps with some jitter and a pause
+    steps = np.where(rng.random(n) < 0.1, rng.uniform(0.5, 30.0, n), 1.0)
+    records['time'] = np.round(start + np.cumsum(steps), 3)
+    records['ph'] = np.round(8.0 + np.cumsum(rng.normal(0, 0.01, n)), 3)
+    records['conductivity'] = np.round(rng.uniform(0, 100, n), 3)
+    return records
+
+
+def test_chunk_round_trip_quantized():
+    records = make_records(1000)
+    decoded = decode_chunk(encode_chunk(records))
+    assert decoded.dtype == RECORD_DTYPE
+    np.testing.assert_allclose(decoded['time'], records['time'], rtol=0, atol=5e-4)
+    for channel in ('ph', 'conductivity'):
+        np.testing.assert_allclose(decoded[channel], records[channel], rtol=0, atol=1e-3)
+
+
+def test_chunk_round_trip_exact_floats():
+    records = make_records(500, seed=1)
+    records['ph'] += np.float32(1e-4)
+    decoded = decode_chunk(encode_chunk(records, quantum={}))
+    np.testing.assert_array_equal(decoded['ph'], records['ph'])
+    np.testing.assert_array_equal(decoded['conductivity'], records['conductivity'])
+
+
+def test_single_sample_chunk():
+    records = make_records(1)
+    decoded = decode_chunk(encode_chunk(records))
+    assert len(decoded) == 1
+    assert abs(decoded['time'][0] - records['time'][0]) < 5e-4
+
+
+def write_chunks(directory, records, size):
+    writer = ArchiveWriter(directory)
+    for lo in range(0, len(records), size):
+        writer.append(records[lo:lo + size])
+        writer.flush()
+    writer.close()
+
+
+def test_writer_range_reads():
+    records = make_records(1000)
+    write_chunks('archive', records, 100)
+    assert len(_read_index('archive')) == 10
+    start, end = records['time'][150], records['time'][720]
+    np.testing.assert_allclose(read_range('archive', start, end)['time'], records['time'][150:721])
+
+
+def test_recover_drops_partial_index_entry():
+    records = make_records(300)
+    write_chunks('archive', records, 100)
+    index_path = os.path.join('archive', INDEX_FILE)
+    with open(index_path, 'ab') as f:
+        f.write(b'\x01' * (INDEX_DTYPE.itemsize // 2))
+    ArchiveWriter('archive').close()
+    assert os.path.getsize(index_path) == 3 * INDEX_DTYPE.itemsize
+    assert len(read_range('archive')) == 300
+
+
+def test_recover_drops_entry_past_data_and_orphan_bytes():
+    records = make_records(300)
+    write_chunks('archive', records, 100)
+    data_path = os.path.join('archive', DATA_FILE)
+    index = np.array(_read_index('archive'))
+    # The last chunk only partly reached the disk
+    with open(data_path, 'r+b') as f:
+        f.truncate(int(index['offset'][-1] + index['length'][-1]) - 5)
+    writer = ArchiveWriter('archive')
+    assert len(_read_index('archive')) == 2
+    assert os.path.getsize(data_path) == int(index['offset'][1] + index['length'][1])
+    # Writing resumes after the last whole chunk
+    writer.append(records[200:])
+    writer.close()
+    np.testing.assert_allclose(read_range('archive')['time'], records['time'])
+
+
+def test_recover_drops_chunk_without_entry():
+    records = make_records(200)
+    write_chunks('archive', records, 100)
+    data_path = os.path.join('archive', DATA_FILE)
+    size = os.path.getsize(data_path)
+    with open(data_path, 'ab') as f:
+        f.write(encode_chunk(make_records(50, start=2e9)))
+    ArchiveWriter('archive').close()
+    assert os.path.getsize(data_path) == size
+    assert len(read_range('archive')) == 200
+
+
+def test_read_last():
+    records = make_records(1000)
+    write_chunks('archive', records, 128)
+    for n in (1, 100, 128, 129, 1000, 5000):
+        last = read_last('archive', n)
+        np.testing.assert_allclose(last['time'], records['time'][-n:])
+    assert len(read_last('empty', 10)) == 0
@@ -0,0 +1,67 @@
+import json
+import numpy as np
+import pytest
+from calibration import Calibration, load_calibration, channel_title, KELVIN
+
+
+def test_identity_by_default():
+    ph, conductivity = Calibration().apply([4.0, 7.0, 10.0])
+    np.testing.assert_allclose(ph, [4.0, 7.0, 10.0])
+    np.testing.assert_allclose(conductivity, [80.0, 65.0, 50.0])
+
+
+def test_slope_and_offset():
+    ph, _ = Calibration({'ph': {'slope': 1.1, 'offset': -0.5}}).apply([0.0, 7.0])
+    np.testing.assert_allclose(ph, [-0.5, 7.2])
+
+
+def test_points_interpolate_and_extend_the_end_segments():
+    calibration = Calibration({'ph': {'points': [[6.97, 7.0], [4.02, 4.0], [10.1, 10.0]]}})
+    ph, _ = calibration.apply([4.02, 5.495, 6.97, 10.1, 3.02, 11.1])
+    expected_low = 4.0 - 1.0 * (3.0 / 2.95)
+    expected_high = 10.0 + 1.0 * (3.0 / 3.13)
+    np.testing.assert_allclose(ph, [4.0, 5.5, 7.0, 10.0, expected_low, expected_high])
+
+
+def test_curve_needs_two_points():
+    with pytest.raises(ValueError):
+        Calibration({'ph': {'points': [[7.0, 7.0]]}})
+
+
+def test_nernst_temperature_compensation():
+    # At 50 °C the electrode slope is (50 + 273.15) / (25 + 273.15) of the
+    # 25 °C one, so readings are pulled back towards 7 by its inverse
+    calibration = Calibration({'temperature': 50.0})
+    ph, _ = calibration.apply([4.0, 7.0, 10.0])
+    factor = (25.0 + KELVIN) / (50.0 + KELVIN)
+    np.testing.assert_allclose(ph, [7.0 - 3.0 * factor, 7.0, 7.0 + 3.0 * factor])
+
+
+def test_per_sample_temperature():
+    calibration = Calibration()
+    ph, _ = calibration.apply([10.0, 10.0, 10.0], temperature=[25.0, 0.0, 50.0])
+    assert ph[0] == pytest.approx(10.0)
+    assert ph[1] > 10.0 > ph[2]
+
+
+def test_batch_matches_one_at_a_time():
+    calibration = Calibration({'ph': {'points': [[4.02, 4.0], [6.97, 7.0], [10.1, 10.0]]}, 'temperature': 30.0})
+    raw = np.linspace(2.0, 12.0, 101)
+    ph, conductivity = calibration.apply(raw)
+    single = np.array([calibration.apply([value])[0][0] for value in raw])
+    np.testing.assert_array_equal(ph, single)
+    assert np.all(conductivity >= 0)
+
+
+def test_load_calibration(tmp_path):
+    path = tmp_path / 'calibration.json'
+    path.write_text(json.dumps({'skid1': {'version': 3, 'ph': {'offset': 0.1}},
+                                'default': {'version': 1}}))
+    assert load_calibration('skid1', str(path)).version == 3
+    assert load_calibration('skid2', str(path)).version == 1
+    assert load_calibration('skid1', str(tmp_path / 'missing.json')).version == 0
+
+
+def test_channel_title():
+    assert channel_title('conductivity') == 'Conductivity (µS/cm)'
+    assert channel_title('ph') == 'pH'
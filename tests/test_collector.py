@@ -0,0 +1,43 @@
+import time
+import numpy as np
+from collector import DeviceWorker
+from history import HistoryWriter
+from ring_store import open_store
+from aggregates import open_aggregates
+from serial_reader import HostClock
+
+
+def test_empty_store_is_refilled_from_the_archive():
+    times = 1.7e9 + np.arange(500, dtype=np.float64)
+    writer = HistoryWriter('skid1')
+    writer.extend(times, np.full(500, 8.0, np.float32), np.zeros(500, np.float32))
+    writer.close()
+
+    # After a reboot the store on tmpfs is gone
+    store = open_store('skid1', capacity=200)
+    worker = DeviceWorker('skid1', '/dev/null', 9600, store, HostClock())
+    np.testing.assert_array_equal(store.latest()['time'], times[-200:])
+    # New samples are stamped after the refilled ones
+    assert worker.reader._last_time == times[-1]
+    worker.history.close()
+
+    # A store that survived keeps its own contents
+    head = store.head
+    DeviceWorker('skid1', '/dev/null', 9600, store, HostClock()).history.close()
+    assert store.head == head
+
+
+def test_aggregates_start_from_the_store():
+    store = open_store('skid1', capacity=5000)
+    now = time.time()
+    times = now - 4000 + np.arange(4000, dtype=np.float64)
+    store.extend(times, np.full(4000, 7.5, np.float32), np.zeros(4000, np.float32))
+
+    worker = DeviceWorker('skid1', '/dev/null', 9600, store, HostClock())
+    worker.history.close()
+    rows, newest = open_aggregates('skid1', readonly=True).read()
+    assert newest == times[-1]
+    # The 1 h window holds the last hour (to a bucket), not nothing
+    assert abs(int(rows[2]['count']) - 3600) <= 6
+    assert rows[2]['ph_mean'] == 7.5
+    assert rows[3]['count'] == 4000
@@ -0,0 +1,275 @@
+import sys
+import types
+import numpy as np
+import pytest
+import dosing
+from dosing import (HysteresisController, PidController, ControlLoop, SimulatedClock, StoreSource,
+                    gpio_pump, make_controller, simulate, DEFAULTS)
+from ring_store import open_store
+
+
+class FakePump:
+    # set_pump stand-in recording every write
+    def __init__(self):
+        self.writes = []
+
+    def __call__(self, on):
+        self.writes.append(on)
+
+
+class Tank:
+    # First-order plant: pH rises by `drift` per second and the pump takes
+    # it down by `gain` per second while on
+    def __init__(self, ph=8.5, drift=0.002, gain=0.01, period=dosing.PERIOD):
+        self.ph = ph
+        self.drift = drift
+        self.gain = gain
+        self.period = period
+        self.on = False
+
+    def pump(self, on):
+        self.on = on
+
+    def read(self):
+        self.ph += (self.drift - (self.gain if self.on else 0.0)) * self.period
+        return 0.0, self.ph
+
+
+def run_loop(controller, read, pump, ticks, **kwargs):
+    clock = SimulatedClock()
+    loop = ControlLoop(read, controller, pump, clock=clock, sleep=clock.sleep, **kwargs)
+    loop.run(ticks=ticks)
+    return loop
+
+
+def test_pid_step_response():
+    tank = Tank(ph=8.5)
+    trace = []
+
+    def read():
+        reading = tank.read()
+        trace.append(reading[1])
+        return reading
+
+    controller = PidController(8.0, kp=2.0, ki=0.01, kd=0.0)
+    loop = run_loop(controller, read, tank.pump, 3600, max_on=None)
+    trace = np.array(trace)
+    # Reaches the setpoint within a few minutes, without a large undershoot
+    assert np.argmax(trace < 8.05) < 300
+    assert trace.min() > 7.9
+    # and holds it, dosing against the drift; with integral action the
+    # last half hour averages out on the setpoint
+    assert abs(trace[-1800:].mean() - 8.0) < 0.02
+    assert trace[-1800:].max() < 8.1
+    assert loop.deadline_misses == 0
+
+
+def test_pid_output_is_clamped():
+    controller = PidController(8.0, kp=50.0, ki=1.0, kd=10.0)
+    assert controller.update(12.0, 1.0) == 1.0
+    assert controller.update(2.0, 1.0) == 0.0
+    raising = PidController(8.0, kp=50.0, ki=0.0, kd=0.0, direction='raise')
+    assert raising.update(7.0, 1.0) == 1.0
+    assert raising.update(9.0, 1.0) == 0.0
+
+
+def test_pid_integral_does_not_wind_up():
+    controller = PidController(8.0, kp=2.0, ki=0.01, kd=0.0)
+    # An hour far above the setpoint with the output saturated
+    for _ in range(3600):
+        assert controller.update(9.0, 1.0) == 1.0
+    assert controller.integral < 100 * 1.0
+    # Just below the setpoint the pump stops at once instead of running
+    # off an hour of accumulated error
+    assert controller.update(7.99, 1.0) < 0.5
+
+
+def test_pid_derivative_acts_on_the_measurement():
+    controller = PidController(8.0, kp=0.0, ki=0.0, kd=5.0)
+    controller.update(8.2, 1.0)
+    controller.setpoint = 7.0  # no kick from a setpoint change
+    assert controller.update(8.2, 1.0) == 0.0
+    assert controller.update(8.3, 1.0) == pytest.approx(0.5)
+
+
+@pytest.mark.parametrize('direction, past, back', [('lower', 8.2, 7.99), ('raise', 7.8, 8.01)])
+def test_hysteresis(direction, past, back):
+    controller = HysteresisController(8.0, 0.1, direction)
+    assert controller.update(8.0, 1.0) == 0.0
+    # Inside the band nothing happens
+    assert controller.update(past - (past - 8.0) / 2, 1.0) == 0.0
+    assert controller.update(past, 1.0) == 1.0
+    # Stays on through the band until the setpoint is crossed
+    assert controller.update(8.0 + (past - 8.0) / 4, 1.0) == 1.0
+    assert controller.update(back, 1.0) == 0.0
+
+
+def test_hysteresis_loop_holds_the_band():
+    tank = Tank(ph=8.3)
+    pump = FakePump()
+
+    def set_pump(on):
+        pump(on)
+        tank.pump(on)
+
+    trace = []
+
+    def read():
+        reading = tank.read()
+        trace.append(reading[1])
+        return reading
+
+    loop = run_loop(HysteresisController(8.0, 0.1), read, set_pump, 3600, max_on=None)
+    trace = np.array(trace[300:])
+    assert trace.min() > 7.95 and trace.max() < 8.15
+    # The pin is only written on changes
+    assert all(a != b for a, b in zip(pump.writes, pump.writes[1:]))
+    assert loop.switches == len(pump.writes)
+
+
+def test_pid_duty_is_time_proportioned():
+    class Fixed:
+        time_proportioned = True
+
+        def update(self, ph, dt):
+            return 0.3
+
+    pump = FakePump()
+    states = []
+    loop = run_loop(Fixed(), lambda: (0.0, 8.0), pump, 0, cycle=10.0)
+    for _ in range(30):
+        loop.step()
+        states.append(loop.pump_on)
+    assert states == ([True] * 3 + [False] * 7) * 3
+
+
+def test_max_on_forces_a_break():
+    pump = FakePump()
+    states = []
+    loop = run_loop(HysteresisController(8.0, 0.1), lambda: (0.0, 9.0), pump, 0, max_on=5.0, min_off=3.0)
+    for _ in range(20):
+        loop.step()
+        states.append(loop.pump_on)
+    assert states == ([True] * 5 + [False] * 3) * 2 + [True] * 4
+
+
+def test_stale_reading_switches_the_pump_off():
+    readings = iter([(0.0, 9.0)] * 3 + [None] * 2 + [(dosing.MAX_AGE + 1, 9.0)] * 2 + [(0.0, 9.0)])
+    pump = FakePump()
+    loop = run_loop(HysteresisController(8.0, 0.1), lambda: next(readings), pump, 8)
+    assert pump.writes == [True, False, True]
+    assert loop.stale_ticks == 4
+
+
+def test_alert_locks_the_pump_out():
+    store = open_store('skid1')
+    store.extend(np.array([1.7e9]), np.array([9.0], np.float32), np.array([50.0], np.float32))
+    clock = SimulatedClock()
+    source = StoreSource('skid1', clock=clock)
+
+    def read():
+        # A sample a tick, as the collector would write
+        store.extend(np.array([1.7e9 + clock.now + 1]), np.array([9.0], np.float32),
+                     np.array([50.0], np.float32))
+        return source.read()
+
+    controller = PidController(8.0, kp=2.0, ki=0.01, kd=0.0)
+    pump = FakePump()
+    loop = ControlLoop(read, controller, pump, clock=clock, sleep=clock.sleep, max_on=None,
+                       lockout=source.locked_out)
+    # The first tick has no reading yet, so the first relay cycle is off
+    loop.run(ticks=20)
+    assert loop.pump_on
+
+    store.set_alert(1, 0)  # a warning does not stop dosing
+    loop.run(ticks=10)
+    assert loop.pump_on and loop.lockout_ticks == 0
+
+    store.set_alert(2, 0)
+    integral = controller.integral
+    loop.run(ticks=100)
+    assert pump.writes[-1] is False and not loop.pump_on
+    assert loop.lockout_ticks == 100
+    assert controller.integral == integral  # not wound up while locked out
+
+    store.set_alert(0, 0)
+    loop.run(ticks=10)
+    assert loop.pump_on
+    assert loop.stats()['lockout_ticks'] == 100
+
+
+def test_lockout_level_and_opt_out():
+    store = open_store('skid1')
+    store.set_alert(1, 0)
+    assert StoreSource('skid1', lockout='warning').locked_out()
+    assert not StoreSource('skid1').locked_out()
+    store.set_alert(2, 0)
+    assert not StoreSource('skid1', lockout=None).locked_out()
+
+
+def test_store_source_age_follows_the_head():
+    store = open_store('skid1')
+    clock = SimulatedClock()
+    source = StoreSource('skid1', clock=clock)
+    assert source.read() is None
+    store.extend(np.array([1.7e9]), np.array([7.5], np.float32), np.array([50.0], np.float32))
+    clock.sleep(2.0)
+    assert source.read() == (0.0, 7.5)
+    clock.sleep(3.0)
+    assert source.read() == (3.0, 7.5)
+
+
+def test_deadline_misses_are_counted_and_skipped():
+    clock = SimulatedClock()
+
+    def slow_read():
+        if loop.ticks == 3:
+            clock.sleep(2.5)  # overruns two deadlines
+        return 0.0, 8.0
+
+    loop = ControlLoop(slow_read, HysteresisController(8.0, 0.1), FakePump(), clock=clock, sleep=clock.sleep)
+    loop.run(ticks=6)
+    assert loop.deadline_misses == 2
+    # Later ticks are back on the original grid
+    assert clock.now == pytest.approx(8.0)
+    assert loop.max_jitter == pytest.approx(0.0)
+
+
+def test_simulator_loop_is_deterministic():
+    for mode in ('hysteresis', 'pid'):
+        settings = {**DEFAULTS, 'mode': mode}
+        first = simulate(settings, 3600)
+        assert first == simulate(settings, 3600)
+        assert first['ticks'] == 3600
+        assert first['deadline_misses'] == 0 and first['stale_ticks'] == 0
+        assert 0 < first['pump_seconds'] < 3600
+        assert first['switches'] > 0
+
+
+def test_make_controller():
+    assert isinstance(make_controller(DEFAULTS), HysteresisController)
+    assert isinstance(make_controller({**DEFAULTS, 'mode': 'pid'}), PidController)
+    with pytest.raises(ValueError):
+        make_controller({**DEFAULTS, 'mode': 'bang-bang'})
+
+
+@pytest.mark.parametrize('active_low', [False, True])
+def test_gpio_pump_drives_the_pin(monkeypatch, active_low):
+    calls = []
+    gpio = types.SimpleNamespace(
+        BCM='BCM', OUT='OUT',
+        setwarnings=lambda flag: None,
+        setmode=lambda mode: calls.append(('mode', mode)),
+        setup=lambda pin, mode, initial: calls.append(('setup', pin, initial)),
+        output=lambda pin, level: calls.append(('output', pin, level)))
+    package = types.ModuleType('RPi')
+    package.GPIO = gpio
+    monkeypatch.setitem(sys.modules, 'RPi', package)
+    monkeypatch.setitem(sys.modules, 'RPi.GPIO', gpio)
+
+    set_pump = gpio_pump(17, active_low)
+    set_pump(True)
+    set_pump(False)
+    # The relay starts off: low for a high-side relay, high for a low-side one
+    assert calls == [('mode', 'BCM'), ('setup', 17, active_low),
+                     ('output', 17, not active_low), ('output', 17, active_low)]
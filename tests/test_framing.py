@@ -0,0 +1,67 @@
+import numpy as np
+from framing import FrameDecoder, encode_frame, SYNC, MAX_GAP
+
+
+def frames(seqs):
+    return b''.join(encode_frame(seq, 7.0 + seq / 1000) for seq in seqs)
+
+
+def test_decodes_back_to_back_frames():
+    seq, values, ends, consumed, missing, errors = FrameDecoder().decode(frames(range(5)))
+    assert seq.tolist() == [0, 1, 2, 3, 4]
+    np.testing.assert_allclose(values[:, 0], 7.0 + np.arange(5) / 1000, rtol=1e-6)
+    assert consumed == len(frames(range(5)))
+    assert ends.tolist() == [len(frames(range(i + 1))) for i in range(5)]
+    assert (missing, errors) == (0, 0)
+
+
+def test_resyncs_after_garbage():
+    buffer = b'noise' + frames([0, 1]) + b'\x00\xa5junk' + frames([2, 3])
+    seq, _, _, consumed, missing, errors = FrameDecoder().decode(buffer)
+    assert seq.tolist() == [0, 1, 2, 3]
+    assert consumed == len(buffer)
+    assert missing == 0
+    assert errors == 2
+
+
+def test_resyncs_after_corrupt_crc():
+    bad = bytearray(encode_frame(1, 7.5))
+    bad[-1] ^= 0xFF
+    buffer = frames([0]) + bytes(bad) + frames([2])
+    seq, _, _, _, missing, errors = FrameDecoder().decode(buffer)
+    assert seq.tolist() == [0, 2]
+    assert missing == 1
+    assert errors >= 1
+
+
+def test_keeps_partial_frame():
+    buffer = frames([0, 1])
+    decoder = FrameDecoder()
+    seq, _, _, consumed, _, _ = decoder.decode(buffer[:-3])
+    assert seq.tolist() == [0]
+    assert consumed == len(frames([0]))
+    seq, _, _, consumed, _, errors = decoder.decode(buffer[consumed:])
+    assert seq.tolist() == [1]
+    assert errors == 0
+
+
+def test_keeps_trailing_sync_byte():
+    _, _, _, consumed, _, _ = FrameDecoder().decode(frames([0]) + SYNC[:1])
+    assert consumed == len(frames([0]))
+
+
+def test_counts_gaps_across_calls_and_wrap():
+    decoder = FrameDecoder()
+    assert decoder.decode(frames([0xFFFD, 0xFFFE]))[4] == 0
+    # 0xFFFF and 0 lost across the wrap
+    seq, _, _, _, missing, _ = decoder.decode(frames([1, 2, 5]))
+    assert seq.tolist() == [1, 2, 5]
+    assert missing == 2 + 2
+
+
+def test_large_jump_is_a_restart():
+    decoder = FrameDecoder()
+    decoder.decode(frames([100]))
+    assert decoder.decode(frames([(100 + MAX_GAP + 2) & 0xFFFF]))[4] == 0
+    decoder.reset()
+    assert decoder.decode(frames([7]))[4] == 0
@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+import history
+from history import HistoryWriter, query, rollups, raw_records, lttb, coarsen, ROLLUP_DTYPE
+
+DAY = 86400
+START = 1_699_999_200.0  # on a whole hour, so every rollup level starts a bucket there
+
+
+def write(device_id, start, seconds, step, batch=1000):
+    # A sample every `step` seconds; pH is a slow sine so every bucket differs
+    times = start + np.arange(0, seconds, step, dtype=np.float64)
+    ph = (8.0 + 0.3 * np.sin(times / 7000)).astype(np.float32)
+    conductivity = (50 + 10 * np.cos(times / 5000)).astype(np.float32)
+    writer = HistoryWriter(device_id)
+    for lo in range(0, len(times), batch):
+        writer.extend(times[lo:lo + batch], ph[lo:lo + batch], conductivity[lo:lo + batch])
+    writer.close()
+    return times, ph, conductivity
+
+
+def test_rollups_match_the_samples():
+    times, ph, _ = write('skid1', START, 2 * 3600, 1.0)
+    rows = rollups('skid1', 600, -np.inf, np.inf)
+    # The bucket open at close is not written
+    assert len(rows) == 11
+    for row in rows:
+        inside = (times >= row['time']) & (times < row['time'] + 600)
+        assert row['count'] == inside.sum()
+        assert row['ph_min'] == ph[inside].min()
+        assert row['ph_max'] == ph[inside].max()
+        assert row['ph_mean'] == pytest.approx(ph[inside].mean(), rel=1e-6)
+
+
+def test_rollups_are_written_by_data_time():
+    # Far more data time than the flush interval, faster than real time
+    writer = HistoryWriter('skid1')
+    times = START + np.arange(0, 3600, 1.0)
+    writer.extend(times, np.full(len(times), 8.0, np.float32), np.zeros(len(times), np.float32))
+    writer.extend(times[-1:] + 1, np.full(1, 8.0, np.float32), np.zeros(1, np.float32))
+    assert len(rollups('skid1', 10, -np.inf, np.inf)) == 359
+    writer.close()
+
+
+def test_query_raw_and_lttb(monkeypatch):
+    times, ph, _ = write('skid1', START, 5000, 1.0)
+    columns, level = query('skid1', times[0], times[99], max_points=1000)
+    assert level == 'raw'
+    np.testing.assert_array_equal(columns['time'], times[:100])
+
+    columns, level = query('skid1', times[0], times[-1], max_points=500)
+    assert level == 'lttb'
+    assert len(columns['time']) == 500
+    assert columns['time'][0] == times[0] and columns['time'][-1] == times[-1]
+
+    monkeypatch.setattr(history, 'LTTB_LIMIT', 1000)
+    _, level = query('skid1', times[0], times[-1], max_points=500)
+    assert level == 60
+
+
+def test_query_picks_the_finest_level_that_fits(monkeypatch):
+    monkeypatch.setattr(history, 'LTTB_LIMIT', 1000)
+    times, _, _ = write('skid1', START, 3 * DAY, 10.0)
+    start, end = times[0], times[-1]
+    assert query('skid1', start, start + 4 * 3600, max_points=1000)[1] == 60
+    assert query('skid1', start, start + 2 * DAY, max_points=1000)[1] == 600
+    assert query('skid1', start, end, max_points=200)[1] == 3600
+
+
+def test_query_merges_coarsest_rollups_over_the_whole_range(monkeypatch):
+    monkeypatch.setattr(history, 'LTTB_LIMIT', 1000)
+    times, ph, _ = write('skid1', START, 30 * DAY, 60.0)
+    columns, level = query('skid1', times[0], times[-1], max_points=200)
+    assert len(columns['time']) <= 200
+    assert level % 3600 == 0 and level > 3600
+    # The whole range is covered, not just its end
+    assert columns['time'][0] <= times[0]
+    assert columns['time'][-1] >= times[-1] - 2 * level
+    assert columns['ph'].min() == pytest.approx(rollups('skid1', 3600, -np.inf, np.inf)['ph_min'].min())
+    assert columns['ph'].max() == pytest.approx(rollups('skid1', 3600, -np.inf, np.inf)['ph_max'].max())
+
+
+def test_coarsen():
+    rows = np.zeros(10, dtype=ROLLUP_DTYPE)
+    rows['time'] = np.arange(10) * 10.0
+    rows['count'] = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+    rows['ph_min'] = np.arange(10)
+    rows['ph_max'] = np.arange(10) + 100
+    rows['ph_mean'] = np.arange(10) + 50
+    merged, width = coarsen(rows, 10, 4)
+    assert len(merged) <= 4
+    assert merged['count'].sum() == rows['count'].sum()
+    assert merged['ph_min'][0] == 0 and merged['ph_max'][-1] == 109
+    first = rows['time'] < merged['time'][0] + width
+    expected = np.average(rows['ph_mean'][first], weights=rows['count'][first])
+    assert merged['ph_mean'][0] == pytest.approx(expected)
+
+
+def test_lttb_keeps_ends_and_peaks():
+    x = np.arange(1000, dtype=np.float64)
+    y = np.zeros(1000)
+    y[437] = 5.0
+    y[712] = -3.0
+    keep = lttb(x, y, 50)
+    assert len(keep) == 50
+    assert keep[0] == 0 and keep[-1] == 999
+    assert np.all(np.diff(keep) > 0)
+    assert 437 in keep and 712 in keep
+    assert lttb(x[:10], y[:10], 50).tolist() == list(range(10))
+
+
+def test_raw_records_range():
+    times, _, _ = write('skid1', START, 2000, 1.0)
+    records = raw_records('skid1', times[100], times[199])
+    np.testing.assert_array_equal(records['time'], times[100:200])
@@ -0,0 +1,91 @@
+import json
+import numpy as np
+import pytest
+import flask
+import history_api
+from history import HistoryWriter
+from ring_store import open_store
+
+START = 1_699_999_200.0  # on a whole hour
+
+
+@pytest.fixture
+def client():
+    app = flask.Flask(__name__)
+    history_api.register(app)
+    return app.test_client()
+
+
+@pytest.fixture
+def skid():
+    # Two hours of one sample a second
+    times = START + np.arange(0, 7200, 1.0)
+    ph = np.full(len(times), 7.25, np.float32)
+    conductivity = np.full(len(times), 50.5, np.float32)
+    writer = HistoryWriter('skid1')
+    for lo in range(0, len(times), 1000):
+        writer.extend(times[lo:lo + 1000], ph[lo:lo + 1000], conductivity[lo:lo + 1000])
+    writer.close()
+    return times
+
+
+def test_raw_json(client, skid):
+    response = client.get(f'/api/history/skid1?start={START}&end={START + 9}&channel=ph')
+    assert response.status_code == 200
+    body = json.loads(response.data)
+    assert body['columns'] == ['time', 'ph']
+    assert body['resolution'] == 'raw'
+    assert body['rows'] == [[START + i, 7.25] for i in range(10)]
+
+
+def test_rollup_json(client, skid):
+    response = client.get(f'/api/history/skid1?start={START}&end={START + 3599}&resolution=600')
+    body = json.loads(response.data)
+    assert body['columns'][:3] == ['time', 'count', 'ph_min']
+    assert [row[0] for row in body['rows']] == [START + 600 * i for i in range(6)]
+    assert all(row[1] == 600 for row in body['rows'])
+
+
+def test_iso_times_and_csv(client, skid):
+    response = client.get('/api/history/skid1?start=2023-11-14T22:00:00Z&end=2023-11-14T22:00:01Z'
+                          '&format=csv&channel=conductivity')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert response.data.decode().splitlines() == [
+        'time,conductivity',
+        '2023-11-14T22:00:00.000Z,50.5',
+        '2023-11-14T22:00:01.000Z,50.5',
+    ]
+
+
+@pytest.mark.parametrize('query', [
+    'start=yesterday',
+    'start=nan',
+    'end=inf',
+    'start=-Infinity',
+    f'start={START + 10}&end={START}',
+    'channel=temperature',
+    'resolution=7',
+    'format=xml',
+])
+def test_bad_queries_are_rejected(client, skid, query):
+    assert client.get(f'/api/history/skid1?{query}').status_code == 400
+
+
+def test_unknown_device_is_not_found(client, skid):
+    assert client.get('/api/history/skid2').status_code == 404
+    assert client.get('/api/history/..').status_code == 404
+
+
+def test_device_with_only_a_live_store(client):
+    # Replays run without history still answer from the ring
+    store = open_store('bench1')
+    store.extend(np.array([START]), np.array([7.0], np.float32), np.array([40.0], np.float32))
+    response = client.get(f'/api/history/bench1?start={START - 1}&end={START + 1}')
+    assert response.status_code == 200
+    assert json.loads(response.data)['rows'] == [[START, 7.0, 40.0]]
+
+
+def test_devices(client):
+    open_store('skid1')
+    assert json.loads(client.get('/api/devices').data) == ['skid1']
@@ -0,0 +1,74 @@
+import gc
+import pytest
+from sensor import PhSimulator
+from ring_store import open_store
+from serial_reader import SerialReader
+from history import HistoryWriter
+from alerts import AlertEngine
+from aggregates import AggregateSink, WINDOWS
+from calibration import Calibration
+from framing import frame_size
+from replay import ReplayPort, ReplayClock
+from payload import chart_columns
+
+BATCH = 1000          # frames per serial read
+SAMPLES = 1_000_000   # measured, after warm-up
+POINTS = 1000         # chart points rendered per read
+# Anonymous memory (the ring's file pages not included) may grow by less
+# than this per measured sample; a writer keeping anything per sample
+# costs tens of bytes
+MAX_BYTES_PER_SAMPLE = 0.5
+
+
+def anonymous_rss():
+    # Resident anonymous memory in bytes, or None where /proc does not say
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('RssAnon:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def test_steady_state_memory_is_bounded():
+    # The collector's pipeline with its default settings, one sample per
+    # second of data time, and a chart rendered from the store every read
+    if anonymous_rss() is None:
+        pytest.skip("needs /proc/self/status")
+    simulator = PhSimulator(seed=7)
+    # A baud rate that puts the frames one second apart on the wire
+    port = ReplayPort(10 * frame_size())
+    clock = ReplayClock()
+    store = open_store('memory0')
+    writer = HistoryWriter('memory0')
+    sinks = (writer, AlertEngine(store=store, device_id='memory0'), AggregateSink('memory0'))
+    reader = SerialReader(port, store, Calibration(), clock=clock, sinks=sinks, protocol='binary',
+                          max_read=BATCH * frame_size())
+    chunks = [b''.join(simulator.serial_frame() for _ in range(BATCH)) for _ in range(50)]
+
+    def run(steps, offset):
+        for step in range(offset, offset + steps):
+            clock.now = 1.7e9 + (step + 1) * BATCH
+            port.feed(chunks[step % len(chunks)])
+            while reader.poll():
+                pass
+            records, _ = store.snapshot(POINTS)
+            chart_columns(records['time'], records['ph'], records['conductivity'], [], [])
+
+    # Warm up until the ring has wrapped and the longest window is full
+    warmup = (max(store.capacity, WINDOWS[-1]) + 10 * BATCH) // BATCH
+    try:
+        run(warmup, 0)
+        gc.collect()
+        baseline = anonymous_rss()
+        run(SAMPLES // BATCH, warmup)
+        gc.collect()
+        growth = anonymous_rss() - baseline
+    finally:
+        writer.close()
+
+    assert reader.samples == warmup * BATCH + SAMPLES
+    assert reader.parse_errors == 0
+    assert growth < MAX_BYTES_PER_SAMPLE * SAMPLES, f"{growth / SAMPLES:.2f} bytes per sample"
@@ -0,0 +1,129 @@
+import base64
+import gzip
+import json
+import numpy as np
+import pytest
+import flask
+from payload import (chart_columns, typed_array, time_array, to_datetime, epoch_ms, register_compression,
+                     PAYLOAD_BUDGET, COMPRESS_MIN_BYTES)
+
+
+def decode(spec):
+    return np.frombuffer(base64.b64decode(spec['bdata']), dtype='<' + spec['dtype'])
+
+
+def series(n, start=1.7e9):
+    times = start + np.arange(n, dtype=np.float64) * 0.5
+    ph = (8.0 + 0.2 * np.sin(np.arange(n) / 50)).astype(np.float32)
+    conductivity = (50 + 5 * np.cos(np.arange(n) / 80)).astype(np.float32)
+    return times, ph, conductivity
+
+
+def test_typed_arrays_round_trip():
+    values = np.array([7.25, 8.125, -1.5], np.float32)
+    spec = typed_array(values)
+    assert spec['dtype'] == 'f4'
+    np.testing.assert_array_equal(decode(spec), values)
+    # Epoch milliseconds need float64: float32 would be off by minutes
+    times = np.array([1.7e9, 1.7e9 + 0.001, 1.7e9 + 12.345])
+    spec = time_array(times)
+    assert spec['dtype'] == 'f8'
+    np.testing.assert_array_equal(decode(spec), times * 1000)
+    # Serialisable as is
+    json.dumps(spec)
+
+
+def test_epoch_ms_matches_datetimes():
+    times = np.array([1.7e9, 1.7e9 + 0.25, 1_699_999_200.5])
+    np.testing.assert_array_equal(to_datetime(times).astype(np.int64), epoch_ms(times).astype(np.int64))
+    assert str(to_datetime(times)[2]) == '2023-11-14T22:00:00.500'
+
+
+def test_small_charts_are_sent_whole():
+    times, ph, conductivity = series(500)
+    (x, y_ph), (x2, y_cond), (future_x, pred) = chart_columns(times, ph, conductivity,
+                                                              times[-1:] + 60, np.array([8.1]))
+    np.testing.assert_array_equal(decode(x), times * 1000)
+    assert x2 is x
+    np.testing.assert_array_equal(decode(y_ph), ph)
+    np.testing.assert_array_equal(decode(y_cond), conductivity)
+    np.testing.assert_array_equal(decode(future_x), (times[-1:] + 60) * 1000)
+    np.testing.assert_array_equal(decode(pred), np.array([8.1], np.float32))
+
+
+@pytest.mark.parametrize('budget', [PAYLOAD_BUDGET, 4096])
+def test_large_charts_are_thinned_to_the_budget(budget):
+    times, ph, conductivity = series(200_000)
+    ph[123_456] = 11.0  # a spike LTTB must keep
+    (x, y_ph), (_, y_cond), _ = chart_columns(times, ph, conductivity, [], [], budget=budget)
+    # One time array per series, as the figure JSON carries it
+    size = 2 * len(x['bdata']) + len(y_ph['bdata']) + len(y_cond['bdata'])
+    assert size <= budget
+    assert size > budget * 0.9  # and uses most of it
+
+    kept = decode(x) / 1000
+    assert kept[0] == times[0] and kept[-1] == times[-1]
+    assert np.all(np.diff(kept) > 0)
+    thinned = decode(y_ph)
+    assert thinned.max() == 11.0
+    # Values stay paired with their times
+    index = np.searchsorted(times, kept)
+    np.testing.assert_array_equal(thinned, ph[index])
+    np.testing.assert_array_equal(decode(y_cond), conductivity[index])
+
+
+def test_plain_mode_keeps_every_point():
+    times, ph, conductivity = series(50_000)
+    (x, y_ph), (_, y_cond), (future_x, _) = chart_columns(times, ph, conductivity, times[-1:] + 60, [8.0],
+                                                          compact=False)
+    assert x.dtype == np.dtype('datetime64[ms]') and len(x) == len(times)
+    assert y_ph is ph and y_cond is conductivity
+    assert future_x[0] == to_datetime(times[-1:] + 60)[0]
+
+
+@pytest.fixture
+def client():
+    app = flask.Flask(__name__)
+    register_compression(app)
+    big = {'points': list(range(2000))}
+
+    @app.route('/big')
+    def big_view():
+        return flask.jsonify(big)
+
+    @app.route('/small')
+    def small_view():
+        return flask.jsonify({'ok': True})
+
+    @app.route('/text')
+    def text_view():
+        return flask.Response('x' * 10_000, mimetype='text/csv')
+
+    @app.route('/stream')
+    def stream_view():
+        return flask.Response((json.dumps(big) for _ in range(1)), mimetype='application/json')
+
+    return app.test_client()
+
+
+def test_json_is_gzipped_for_clients_that_accept_it(client):
+    response = client.get('/big', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert int(response.headers['Content-Length']) == len(response.data)
+    body = gzip.decompress(response.data)
+    assert json.loads(body) == {'points': list(range(2000))}
+    assert len(response.data) < len(body) / 2
+
+
+@pytest.mark.parametrize('path, headers', [
+    ('/big', {}),                              # client does not take gzip
+    ('/small', {'Accept-Encoding': 'gzip'}),   # under COMPRESS_MIN_BYTES
+    ('/text', {'Accept-Encoding': 'gzip'}),    # not JSON
+    ('/stream', {'Accept-Encoding': 'gzip'}),  # streamed
+])
+def test_other_responses_are_left_alone(client, path, headers):
+    response = client.get(path, headers=headers)
+    assert 'Content-Encoding' not in response.headers
+    if path == '/small':
+        assert len(response.data) < COMPRESS_MIN_BYTES
@@ -0,0 +1,120 @@
+import json
+import numpy as np
+import pytest
+from replay import (Replay, CaptureWriter, read_capture, read_history, parse_speed, check_target,
+                    reset_device)
+from history import HistoryWriter, raw_records
+from calibration import Calibration
+from ring_store import open_store
+from sensor import PhSimulator
+
+RULES = [
+    {'type': 'band', 'channel': 'ph', 'side': 'above', 'warning': 7.9, 'critical': 8.1, 'hysteresis': 0.01},
+    {'type': 'rate', 'channel': 'ph', 'window': 1, 'warning': 0.05, 'critical': 0.2},
+]
+
+
+def test_parse_speed():
+    assert parse_speed('max') is None
+    assert parse_speed('MAX') is None
+    assert parse_speed('1') == 1.0
+    assert parse_speed('100x') == 100.0
+    for bad in ('0', '-2', 'fast', 'maxx'):
+        with pytest.raises(ValueError):
+            parse_speed(bad)
+
+
+def test_check_target(tmp_path):
+    check_target('replay-skid1', source='skid1')
+    with pytest.raises(ValueError, match='must start'):
+        check_target('skid1')
+    with pytest.raises(ValueError, match='source'):
+        check_target('replay-x', source='replay-x')
+    config = tmp_path / 'skids.json'
+    config.write_text(json.dumps({'replay-live': {'port': '/dev/ttyACM0'}}))
+    with pytest.raises(ValueError, match='configured'):
+        check_target('replay-live', config=str(config))
+    with pytest.raises(ValueError):
+        reset_device('skid1')
+
+
+def write_capture(path, chunks=30, interval=0.05, lines=3):
+    simulator = PhSimulator(seed=11)
+    writer = CaptureWriter(path)
+    for i in range(chunks):
+        data = ''.join(simulator.serial_line() for _ in range(lines)).encode()
+        # Split mid-line now and then, as USB reads do
+        cut = len(data) // 2 if i % 4 == 0 else len(data)
+        writer.write(1.7e9 + i * interval, data[:cut])
+        if cut < len(data):
+            writer.write(1.7e9 + i * interval + interval / 2, data[cut:])
+    writer.close()
+
+
+def outcome(replay):
+    store = open_store(replay.device_id, readonly=True)
+    records = np.array(store.latest())
+    return records, list(replay.transitions), raw_records(replay.device_id)
+
+
+def assert_same(a, b):
+    np.testing.assert_array_equal(a[0], b[0])
+    assert a[1] == b[1]
+    np.testing.assert_array_equal(a[2], b[2])
+
+
+@pytest.fixture
+def rules(tmp_path):
+    path = tmp_path / 'rules.json'
+    path.write_text(json.dumps(RULES))
+    return str(path)
+
+
+def test_capture_replay_is_the_same_at_any_speed(rules):
+    write_capture('session.cap')
+    assert len(list(read_capture('session.cap'))) > 30
+    results = []
+    for device_id, speed in (('replay-real', 1.0), ('replay-max', None)):
+        replay = Replay(device_id, rules=rules)
+        summary = replay.run_capture(read_capture('session.cap'), speed, Calibration(), protocol='json',
+                                     baudrate=115200)
+        assert summary['samples'] == 90 and summary['parse_errors'] == 0
+        results.append((summary, outcome(replay)))
+    (real, real_outcome), (fast, fast_outcome) = results
+    # 1x takes the recorded 1.5 s, max does not wait
+    assert real['wall_seconds'] >= 1.4 > fast['wall_seconds']
+    assert real_outcome[1], "the rules should fire on this session"
+    assert_same(real_outcome, fast_outcome)
+
+
+def test_history_replay_is_the_same_at_any_speed(rules):
+    simulator = PhSimulator(seed=5)
+    times = 1.7e9 + np.arange(0, 2.0, 0.02)
+    ph = np.array([simulator.next() for _ in times], dtype=np.float32)
+    writer = HistoryWriter('skid1')
+    writer.extend(times, ph, np.zeros(len(times), np.float32))
+    writer.close()
+
+    outcomes = []
+    for device_id, speed in (('replay-real', 1.0), ('replay-max', None)):
+        replay = Replay(device_id, rules=rules, source='skid1')
+        summary = replay.run_records(read_history('skid1', batch=7), speed)
+        assert summary['samples'] == len(times)
+        outcomes.append(outcome(replay))
+    assert outcomes[0][1]
+    assert_same(*outcomes)
+    np.testing.assert_array_equal(outcomes[0][0]['time'], times)
+
+
+def test_read_history_streams_fixed_batches(monkeypatch):
+    import archive
+    monkeypatch.setattr(archive, 'MAX_CHUNK_SAMPLES', 64)
+    times = 1.7e9 + np.arange(1000, dtype=np.float64)
+    writer = HistoryWriter('skid1')
+    writer.extend(times, np.full(1000, 8.0, np.float32), np.zeros(1000, np.float32))
+    writer.close()
+    batches = list(read_history('skid1', batch=100))
+    assert [len(b) for b in batches] == [100] * 10
+    np.testing.assert_array_equal(np.concatenate(batches)['time'], times)
+    batches = list(read_history('skid1', start=times[10], end=times[104], batch=30))
+    assert [len(b) for b in batches] == [30, 30, 30, 5]
@@ -0,0 +1,106 @@
+import os
+import threading
+import numpy as np
+import pytest
+import plotly.graph_objs as go
+import live_view
+from live_view import LiveChart
+from figures import FigureTemplate
+from result_cache import ResultCache
+from ring_store import open_store, store_path
+
+
+def test_computes_once_per_key():
+    cache = ResultCache('test', shared_tier=False)
+    calls = []
+    for _ in range(3):
+        assert cache.get(('tick', 1), lambda: calls.append(1) or 'a') == 'a'
+    assert cache.get(('tick', 2), lambda: 'b') == 'b'
+    assert len(calls) == 1
+
+
+def test_lru_eviction_and_disabled_cache():
+    cache = ResultCache('test', max_entries=2, shared_tier=False)
+    for key in (1, 2, 3):
+        cache.get(key, lambda: key)
+    assert list(cache._entries) == [2, 3]
+    calls = []
+    uncached = ResultCache('test', max_entries=0, shared_tier=False)
+    for _ in range(3):
+        uncached.get(1, lambda: calls.append(1))
+    assert len(calls) == 3
+
+
+def test_concurrent_callers_share_one_computation():
+    cache = ResultCache('test', shared_tier=False)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(1.0)
+        return 'done'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('k', compute))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    started.wait(1.0)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == ['done'] * 5 and len(calls) == 1
+
+
+def test_shared_tier_across_processes(tmp_path):
+    # Two caches on one directory stand in for two worker processes
+    first = ResultCache('dash', directory=str(tmp_path / 'shm'))
+    second = ResultCache('dash', directory=str(tmp_path / 'shm'))
+    calls = []
+    assert first.get('k', lambda: calls.append(1) or {'v': 1}, shared=True) == {'v': 1}
+    assert second.get('k', lambda: calls.append(1) or {'v': 2}, shared=True) == {'v': 1}
+    assert len(calls) == 1
+    other = ResultCache('other', directory=str(tmp_path / 'shm'))
+    assert other.get('k', lambda: 'own', shared=True) == 'own'
+
+
+@pytest.fixture(autouse=True)
+def fresh_stores():
+    # live_view keeps its read-only stores per process
+    yield
+    live_view._stores.clear()
+
+
+def make_chart(tmp_path):
+    template = FigureTemplate(go.Figure(data=[go.Scatter(), go.Scatter(), go.Scatter()]))
+    chart = LiveChart('test', template, 100, (1, 120), lambda status: None, compact=False, push=False)
+    chart.results = ResultCache('test', directory=str(tmp_path / 'shm'))
+    return chart
+
+
+def fill(device_id, ph, n=50):
+    store = open_store(device_id, capacity=1000)
+    times = 1.7e9 + np.arange(n, dtype=np.float64)
+    store.extend(times, np.full(n, ph, np.float32), np.zeros(n, np.float32))
+    store.close()
+
+
+def test_recreated_store_is_not_served_from_the_cache(tmp_path):
+    fill('replay-a', 7.0)
+    chart = make_chart(tmp_path)
+    figure, _, state, cursor = chart.update('replay-a', 'live', None)
+    assert state['ph'] == 7.0
+    assert figure['data'][0]['y'][-1] == 7.0
+
+    # Same device and head, different samples (replay.reset_device)
+    os.remove(store_path('replay-a'))
+    fill('replay-a', 8.0)
+    # Another worker process with the same shared tier
+    other = make_chart(tmp_path)
+    for worker in (chart, other):
+        figure, extend, state, new_cursor = worker.update('replay-a', 'live', cursor)
+        assert state['ph'] == 8.0
+        assert figure['data'][0]['y'][-1] == 8.0
+        assert new_cursor['head'] == cursor['head'] and new_cursor['store'] != cursor['store']
@@ -0,0 +1,130 @@
+import threading
+import time
+import numpy as np
+import pytest
+from ring_store import open_store, store_path, list_devices, RECORD_DTYPE, TornRead
+
+
+def columns(start, n):
+    times = np.arange(start, start + n, dtype=np.float64)
+    return times, (7.0 + times / 1000).astype(np.float32), (times % 100).astype(np.float32)
+
+
+def test_append_and_latest():
+    store = open_store('skid1', capacity=8)
+    for t in range(3):
+        store.append(float(t), 7.0, 1.0)
+    assert len(store) == 3 and store.head == 3
+    assert store.latest()['time'].tolist() == [0.0, 1.0, 2.0]
+    assert store.latest(2)['time'].tolist() == [1.0, 2.0]
+    assert list_devices() == ['skid1']
+
+
+def test_latest_is_contiguous_after_wrap():
+    store = open_store('skid1', capacity=10)
+    for lo in range(0, 37, 3):
+        store.extend(*columns(lo, 3))
+    latest = store.latest()
+    assert latest.dtype == RECORD_DTYPE
+    assert latest['time'].tolist() == list(range(29, 39))
+    assert latest['ph'].tolist() == columns(29, 10)[1].tolist()
+    # A view into the mapping, not a copy
+    assert not latest.flags['OWNDATA']
+    assert store.latest(4, head=35)['time'].tolist() == [31.0, 32.0, 33.0, 34.0]
+
+
+def test_extend_larger_than_capacity():
+    store = open_store('skid1', capacity=10)
+    store.extend(*columns(0, 4))
+    store.extend(*columns(4, 25))
+    assert store.head == 29
+    assert store.latest()['time'].tolist() == list(range(19, 29))
+
+
+def test_reopen_keeps_records():
+    store = open_store('skid1', capacity=10)
+    store.extend(*columns(0, 12))
+    store.close()
+    reader = open_store('skid1', readonly=True)
+    assert reader.capacity == 10 and reader.head == 12
+    assert reader.latest()['time'].tolist() == list(range(2, 12))
+    writer = open_store('skid1', capacity=10)
+    assert writer.nonce == reader.nonce
+    writer.append(12.0, 7.0, 1.0)
+    assert reader.latest(1)['time'].tolist() == [12.0]
+
+
+def test_capacity_mismatch_is_refused():
+    open_store('skid1', capacity=10).close()
+    with pytest.raises(ValueError, match='holds 10 records'):
+        open_store('skid1', capacity=20)
+
+
+def test_invalid_device_id():
+    with pytest.raises(ValueError):
+        store_path('../etc')
+
+
+def test_snapshot_is_consistent_under_a_writer():
+    # Record i holds time i, so a consistent snapshot is a run of times
+    # ending at head - 1
+    store = open_store('skid1', capacity=64)
+    reader = open_store('skid1', readonly=True)
+    stop = threading.Event()
+
+    def write():
+        head = 0
+        while not stop.is_set():
+            n = 1 + head % 23
+            store.extend(*columns(head, n))
+            head += n
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    try:
+        checked = 0
+        deadline = time.monotonic() + 1.0
+        while time.monotonic() < deadline:
+            try:
+                records, head = reader.snapshot(32, copy=True)
+            except TornRead:
+                continue
+            if len(records):
+                assert records['time'][-1] == head - 1
+                assert np.all(np.diff(records['time']) == 1)
+                checked += 1
+    finally:
+        stop.set()
+        thread.join()
+    assert checked > 0
+
+
+def test_snapshot_gives_up_on_a_busy_writer():
+    store = open_store('skid1', capacity=8)
+    store.extend(*columns(0, 3))
+    store._begin()  # a write that never finishes
+    reader = open_store('skid1', readonly=True)
+    with pytest.raises(TornRead):
+        reader.snapshot()
+    with pytest.raises(TornRead):
+        reader.alert
+
+
+def test_unfinished_write_is_dropped_on_open():
+    store = open_store('skid1', capacity=8)
+    store.extend(*columns(0, 3))
+    generation = store._begin()
+    store._records[3] = (3.0, 7.0, 1.0)
+    store.close()
+    reopened = open_store('skid1', capacity=8)
+    assert reopened.generation == generation + 1
+    records, head = reopened.snapshot()
+    assert head == 3
+    assert records['time'].tolist() == [0.0, 1.0, 2.0]
+
+
+def test_alert_is_published():
+    store = open_store('skid1', capacity=8)
+    store.set_alert(2, 1)
+    assert open_store('skid1', readonly=True).alert == (2, 1)
+    assert store.generation % 2 == 0
@@ -0,0 +1,122 @@
+import time
+import numpy as np
+import pytest
+import serial_reader
+from serial_reader import SerialReader, HostClock, parse_line, MIN_SPACING
+from ring_store import open_store
+from calibration import Calibration
+from framing import encode_frame
+from replay import ReplayPort, ReplayClock
+
+
+class StepClock:
+    # Host clock stand-in: wall time is the monotonic time plus `offset`,
+    # which the test steps
+    def __init__(self, offset=1.7e9):
+        self.offset = offset
+
+    def to_wall(self, mono):
+        return mono + self.offset
+
+    def elapsed(self, mono):
+        return mono
+
+
+def make_reader(clock=None, baudrate=9600, protocol='auto', capacity=1000):
+    store = open_store('skid1', capacity=capacity)
+    reader = SerialReader(ReplayPort(baudrate), store, Calibration(), clock=clock or ReplayClock(),
+                          protocol=protocol)
+    return reader, store
+
+
+def lines(*values):
+    return [f"{{'pH': {v}}}".encode() for v in values]
+
+
+def test_parse_line():
+    assert parse_line("{'pH': 7.25}") == 7.25
+    assert parse_line('{"temp": 20}') is None
+    for bad in ('[1, 2]', 'null', '7.0', 'garbage'):
+        with pytest.raises(ValueError):
+            parse_line(bad)
+    with pytest.raises(TypeError):
+        parse_line("{'pH': null}")
+
+
+def test_lines_are_back_dated_by_wire_time():
+    reader, store = make_reader(baudrate=1000)
+    reader.port.feed(b"{'pH': 7.1}\n{'pH': 7.2}\n{'pH': 7.3}\n{'pH': 7.")
+    reader.clock.now = 1000.0
+    assert reader.poll() == 3
+    records = store.latest()
+    np.testing.assert_allclose(records['ph'], [7.1, 7.2, 7.3], rtol=1e-6)
+    # 12 bytes per line and 9 bytes of the partial one after, at 10 ms/byte
+    np.testing.assert_allclose(records['time'], 1000.0 - np.array([0.33, 0.21, 0.09]))
+    reader.port.feed(b"4}\n")
+    reader.clock.now = 1001.0
+    assert reader.poll() == 1
+    assert store.latest(1)['ph'][0] == pytest.approx(7.4)
+
+
+def test_bad_lines_are_counted_and_skipped():
+    reader, store = make_reader()
+    reader.port.feed(b"{'pH': 7.1}\n[1]\nnull\n{'pH': null}\n\xff\xfe\n{'temp': 3}\n{'pH': 7.2}\n")
+    reader.clock.now = 1000.0
+    assert reader.poll() == 2
+    assert reader.parse_errors == 4
+    assert store.latest()['ph'].tolist() == pytest.approx([7.1, 7.2])
+
+
+def test_auto_switches_to_frames():
+    reader, store = make_reader(baudrate=115200)
+    reader.port.feed(b"{'pH': 7.1}\n" + encode_frame(0, 7.2) + encode_frame(2, 7.3))
+    reader.clock.now = 1000.0
+    reader.poll()
+    assert reader.mode == 'binary'
+    assert store.latest()['ph'].tolist() == pytest.approx([7.1, 7.2, 7.3])
+    assert reader.missing_frames == 1
+    assert np.all(np.diff(store.latest()['time']) > 0)
+
+
+def test_clock_step_back_keeps_times_increasing():
+    clock = StepClock()
+    reader, store = make_reader(clock)
+    for i in range(10):
+        reader.ingest(lines(7.0), received=100.0 + i)
+    clock.offset -= 60.0  # the system clock is set back a minute
+    for i in range(10, 1000):
+        reader.ingest(lines(7.0), received=100.0 + i)
+    times = store.latest()['time']
+    spacing = np.diff(times)
+    # No run of equal times; samples keep close to their 1 s spacing while
+    # the step is slewed off, then follow the clock again
+    assert spacing.min() >= 1.0 - serial_reader.CLOCK_SLEW - 1e-6
+    assert spacing.max() <= 1.0 + 1e-6
+    assert times[-1] == pytest.approx(clock.to_wall(100.0 + 999))
+
+
+def test_restart_behind_the_store_continues_from_it():
+    clock = StepClock(offset=1000.0)
+    store = open_store('skid1', capacity=100)
+    store.append(2000.0, 7.0, 0.0)
+    reader = SerialReader(ReplayPort(), store, Calibration(), clock=clock)
+    for i in range(3):
+        reader.ingest(lines(7.0), received=10.0 + i)
+    times = store.latest()['time']
+    assert times[1] == pytest.approx(2000.0 + MIN_SPACING)
+    np.testing.assert_allclose(np.diff(times[1:]), 1.0 - serial_reader.CLOCK_SLEW)
+
+
+def test_host_clock_re_anchors_on_steps(monkeypatch):
+    wall = [1.7e9]
+    monkeypatch.setattr(serial_reader.time, 'time', lambda: wall[0] + time.monotonic())
+    clock = HostClock(step=1.0)
+    mono = time.monotonic()
+    assert clock.to_wall(mono) == pytest.approx(wall[0] + mono, abs=0.01)
+    wall[0] += 0.5  # slewed by NTP: ignored
+    assert clock.to_wall(mono) == pytest.approx(1.7e9 + mono, abs=0.01)
+    assert clock.steps == 0
+    wall[0] -= 30.0  # stepped back
+    assert clock.to_wall(mono) == pytest.approx(wall[0] + mono, abs=0.01)
+    assert clock.steps == 1
+    assert clock.elapsed(mono) == mono
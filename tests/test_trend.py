@@ -0,0 +1,96 @@
+import os
+import numpy as np
+import pytest
+from trend import TrendEstimator, StoreTrend
+from ring_store import open_store
+
+
+def samples(n, slope=0.002, intercept=8.0, start=1.7e9, noise=0.01, seed=0):
+    rng = np.random.default_rng(seed)
+    times = start + np.cumsum(rng.uniform(0.5, 1.5, n))
+    return times, intercept + slope * (times - start) + rng.normal(0, noise, n)
+
+
+def test_window_fit_matches_polyfit():
+    times, values = samples(500)
+    estimator = TrendEstimator(window=60)
+    estimator.add_many(times, values)
+    slope, intercept = estimator.fit()
+    expected = np.polyfit(times[-60:] - times[-1], values[-60:], 1)
+    assert slope == pytest.approx(expected[0], rel=1e-9)
+    # The intercept is in absolute (epoch) time, so it carries that rounding
+    assert slope * times[-1] + intercept == pytest.approx(expected[1], rel=1e-9)
+
+
+def test_forgetting_fit_matches_weighted_polyfit():
+    times, values = samples(3000)
+    estimator = TrendEstimator(forgetting=0.99)
+    estimator.add_many(times, values)
+    slope, intercept = estimator.fit()
+    weights = 0.99 ** np.arange(len(times))[::-1]
+    # polyfit weights multiply the residuals, not their squares
+    expected = np.polyfit(times - times[-1], values, 1, w=np.sqrt(weights))
+    assert slope == pytest.approx(expected[0], rel=1e-6)
+    assert estimator.predict(times[-1]) == pytest.approx(expected[1], rel=1e-9)
+
+
+def test_no_fit_below_two_distinct_times():
+    estimator = TrendEstimator(window=10)
+    assert estimator.fit() is None
+    estimator.add(1.0, 8.0)
+    assert estimator.fit() is None
+    estimator.add(1.0, 8.1)
+    assert estimator.fit() is None
+    assert estimator.crossing_time(9.0, 1.0) is None
+
+
+def test_unbounded_trend_needs_forgetting():
+    with pytest.raises(ValueError):
+        TrendEstimator()
+
+
+def rising(slope):
+    # Exact line y = 8 + slope * t at t = 0..9
+    estimator = TrendEstimator(window=10)
+    for t in range(10):
+        estimator.add(float(t), 8.0 + slope * t)
+    return estimator
+
+
+def test_crossing_time_ahead():
+    assert rising(0.1).crossing_time(9.5, after=9.0) == pytest.approx(15.0)
+
+
+def test_crossing_time_already_past():
+    assert rising(0.1).crossing_time(8.5, after=9.0) == 9.0
+
+
+def test_crossing_time_never():
+    assert rising(0.0).crossing_time(9.0, after=9.0) is None
+    assert rising(-0.1).crossing_time(9.0, after=9.0) is None
+
+
+def test_max_over_takes_the_higher_end():
+    assert rising(0.1).max_over(10.0, 20.0) == pytest.approx(10.0)
+    assert rising(-0.1).max_over(10.0, 20.0) == pytest.approx(7.0)
+
+
+def test_store_trend_follows_and_refits():
+    times, values = samples(200)
+    store = open_store('skid1', capacity=100)
+    store.extend(times[:150], values[:150].astype(np.float32), np.zeros(150, np.float32))
+    trend = StoreTrend(window=50)
+    trend.update(store)
+    store.extend(times[150:], values[150:].astype(np.float32), np.zeros(50, np.float32))
+    slope, _ = trend.update(store)
+    direct = TrendEstimator(window=50)
+    direct.add_many(times[-50:], values[-50:].astype(np.float32).astype(np.float64))
+    assert slope == pytest.approx(direct.fit()[0], rel=1e-9)
+
+    # A recreated store (new nonce) is refitted from scratch
+    store.close()
+    os.remove(store.path)
+    fresh = open_store('skid1', capacity=100)
+    fresh.extend(times[:20], np.full(20, 8.0, np.float32), np.zeros(20, np.float32))
+    slope, _ = trend.update(fresh)
+    assert slope == pytest.approx(0.0, abs=1e-9)
@@ -0,0 +1,167 @@
+import threading
+from collections import deque
+
+# Streaming linear trend (weighted least squares) over a sliding window.
+#
+# Keeps the running sums S0, St, Sy, Stt, Sty so that adding a sample, and
+# reading slope / intercept / forecast, are O(1) whatever the window length.
+# `forgetting` < 1 turns it into an exponentially weighted fit where a sample
+# added k steps ago has weight forgetting**k.
+
+
+class TrendEstimator:
+    def __init__(self, window=None, forgetting=1.0):
+        if window is None and forgetting >= 1.0:
+            raise ValueError("an unbounded trend needs forgetting < 1")
+        self.window = window
+        self.forgetting = forgetting
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self._samples = deque()
+        self._evictions = 0
+        self._t_ref = None
+        self._s0 = self._st = self._sy = self._stt = self._sty = 0.0
+        # weight of the oldest sample in a full window
+        self._tail_weight = self.forgetting ** self.window if self.window else 0.0
+
+    def add(self, t, y):
+        if self._t_ref is None:
+            self._t_ref = t
+        x = t - self._t_ref
+
+        lam = self.forgetting
+        if lam < 1.0:
+            self._s0 *= lam
+            self._st *= lam
+            self._sy *= lam
+            self._stt *= lam
+            self._sty *= lam
+
+        self._s0 += 1.0
+        self._st += x
+        self._sy += y
+        self._stt += x * x
+        self._sty += x * y
+        self.count += 1
+
+        if self.window:
+            self._samples.append((t, y))
+            if len(self._samples) > self.window:
+                self._evict()
+
+        # Keep the reference time close to the data so the sums stay small
+        if self.window and self._evictions >= self.window:
+            self._recompute()
+        elif not self.window and self.count % 1024 == 0:
+            self._rebase(t)
+
+    def add_many(self, times, values):
+        for t, y in zip(times.tolist(), values.tolist()):
+            self.add(t, y)
+
+    def _evict(self):
+        t, y = self._samples.popleft()
+        x = t - self._t_ref
+        w = self._tail_weight
+        self._s0 -= w
+        self._st -= w * x
+        self._sy -= w * y
+        self._stt -= w * x * x
+        self._sty -= w * x * y
+        self._evictions += 1
+
+    def _rebase(self, t):
+        d = t - self._t_ref
+        self._stt -= 2 * d * self._st - d * d * self._s0
+        self._sty -= d * self._sy
+        self._st -= d * self._s0
+        self._t_ref = t
+
+    def _recompute(self):
+        # Exact sums from the window, once per `window` evictions, so that
+        # rounding from add/subtract pairs cannot accumulate
+        samples = self._samples
+        self._t_ref = samples[-1][0]
+        lam = self.forgetting
+        w = 1.0
+        s0 = st = sy = stt = sty = 0.0
+        for t, y in reversed(samples):
+            x = t - self._t_ref
+            s0 += w
+            st += w * x
+            sy += w * y
+            stt += w * x * x
+            sty += w * x * y
+            w *= lam
+        self._s0, self._st, self._sy, self._stt, self._sty = s0, st, sy, stt, sty
+        self._evictions = 0
+
+    def fit(self):
+        # (slope, intercept) in absolute time, or None with fewer than 2 points
+        if self.count < 2:
+            return None
+        det = self._s0 * self._stt - self._st * self._st
+        if det <= 1e-12 * max(1.0, self._s0 * self._stt):
+            return None
+        slope = (self._s0 * self._sty - self._st * self._sy) / det
+        intercept_ref = (self._sy - slope * self._st) / self._s0
+        return slope, intercept_ref - slope * self._t_ref
+
+    def predict(self, t):
+        fit = self.fit()
+        if fit is None:
+            return None
+        slope, intercept = fit
+        return slope * t + intercept
+
+    def max_over(self, t0, t1):
+        # The maximum of a line on [t0, t1] is at one of the ends
+        fit = self.fit()
+        if fit is None:
+            return None
+        slope, intercept = fit
+        return max(slope * t0 + intercept, slope * t1 + intercept)
+
+    def crossing_time(self, threshold, after):
+        # First time >= `after` at which the trend reaches `threshold`
+        fit = self.fit()
+        if fit is None:
+            return None
+        slope, intercept = fit
+        if slope * after + intercept >= threshold:
+            return after
+        if slope <= 0:
+            return None
+        return (threshold - intercept) / slope
+
+
+class StoreTrend:
+    # Follows a RingStore channel and feeds new records into a TrendEstimator,
+    # so one estimator per process serves every dashboard client
+
+    def __init__(self, column='ph', window=None, forgetting=1.0):
+        self.column = column
+        self.estimator = TrendEstimator(window=window, forgetting=forgetting)
+        self.head = 0
+        self.nonce = None  # store followed so far (RingStore.nonce)
+        self._lock = threading.Lock()
+
+    def update(self, store, head=None):
+        if head is None:
+            head = store.head
+        with self._lock:
+            est = self.estimator
+            behind = head - self.head
+            backlog = est.window or store.capacity
+            if behind < 0 or behind > backlog or store.nonce != self.nonce:
+                # Store was reset or recreated, or we fell behind: refit from recent data
+                est.reset()
+                behind = min(head, backlog, store.capacity)
+            if behind:
+                records = store.latest(behind, head=head)
+                est.add_many(records['time'], records[self.column])
+            self.head = head
+            self.nonce = store.nonce
+            return est.fit()